@@ -27,7 +27,8 @@ from singular import singular, singular_console, singular_version, is_SingularEl
 from sage0 import sage0 as sage0, sage0_console, sage0_version, Sage
 from scilab import scilab
 from tachyon import tachyon_rt
-from psage import PSage
+from psage import PSage, ParallelSage
+from pool import InterfacePool
 from ecm import ECM, ecm
 from povray import povray
 from lie import lie, lie_console, LiE
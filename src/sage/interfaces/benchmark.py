@@ -0,0 +1,205 @@
+r"""
+Benchmarks of the pexpect interfaces
+
+This module measures the cost of talking to other systems through
+the pexpect interfaces, as opposed to the cost of the computations
+they do: how long an interface takes to start, how long a trivial
+command takes, how fast large values are sent and received, how fast
+interface elements are created and freed, and how long it takes to
+get an interface back after interrupting a computation.
+
+The results are returned as a dictionary and can be written to a file
+as JSON, so that they can be compared across releases and machines.
+
+EXAMPLES::
+
+    sage: from sage.interfaces.benchmark import interface_benchmark
+    sage: F = tmp_filename() + '.json'
+    sage: R = interface_benchmark(['gap', 'singular'], filename=F, verbose=False)
+    sage: R['interfaces']['gap']['round_trip_seconds']   # random
+    0.00052
+    sage: sorted(R['interfaces']['singular'].keys())
+    ['bulk_get_bytes_per_second', 'bulk_get_using_file_bytes_per_second',
+     'bulk_set_bytes_per_second', 'elements_created_per_second',
+     'elements_freed_per_second', 'errors', 'installed',
+     'interrupt_recovery_seconds', 'round_trip_seconds',
+     'startup_from_spare_seconds', 'startup_seconds']
+"""
+
+#############################################################################
+#       Copyright (C) 2009 William Stein <wstein@gmail.com>
+#  Distributed under the terms of the GNU General Public License (GPL)
+#  The full text of the GPL is available at:
+#                  http://www.gnu.org/licenses/
+#############################################################################
+
+import gc
+import os
+import time
+
+from expect import startup_benchmark
+
+# For each interface: the module and class implementing it, a trivial
+# command, the syntax of a list of integers, and a command that runs
+# forever.
+INTERFACES = [
+    ('gap',         'gap',         'Gap',         '1;',  '[%s]',       'while true do od;'),
+    ('gp',          'gp',          'Gp',          '1',   '[%s]',       'while(1,)'),
+    ('macaulay2',   'macaulay2',   'Macaulay2',   '1',   '{%s}',       'while true do null'),
+    ('magma',       'magma',       'Magma',       '1;',  '[%s]',       'while true do end while;'),
+    ('maple',       'maple',       'Maple',       '1;',  '[%s]',       'do od;'),
+    ('mathematica', 'mathematica', 'Mathematica', '1',   '{%s}',       'While[True]'),
+    ('maxima',      'maxima',      'Maxima',      '1;',  '[%s]',       'while true do 1$'),
+    ('octave',      'octave',      'Octave',      '1;',  '[%s]',       'while 1 end'),
+    ('r',           'r',           'R',           '1',   'c(%s)',      'while(TRUE){}'),
+    ('singular',    'singular',    'Singular',    '1;',  'intvec(%s)', 'while(1){};'),
+    ]
+
+def interface_benchmark(names=None, filename=None, repeat=3, round_trips=100,
+                        list_length=10000, elements=200, verbose=True):
+    """
+    Benchmark the installed interfaces and return the results.
+
+    INPUT:
+
+    -  ``names`` - list of strings (default: all interfaces in
+       INTERFACES); names of the interfaces to benchmark
+
+    -  ``filename`` - string (default: None); if given, the results
+       are written to this file as JSON
+
+    -  ``repeat`` - integer (default: 3); number of times the
+       interfaces are started for measuring startup time
+
+    -  ``round_trips`` - integer (default: 100); number of trivial
+       commands evaluated for measuring latency
+
+    -  ``list_length`` - integer (default: 10000); length of the list
+       of integers that is sent and received for measuring throughput
+
+    -  ``elements`` - integer (default: 200); number of elements
+       created and freed
+
+    -  ``verbose`` - bool (default: True); print results as they are
+       obtained
+
+    OUTPUT: a dictionary with the Sage version, date, host and, under
+    'interfaces', a dictionary of results for each interface.  The
+    results of an interface that could not be started only have the
+    entries 'installed' (False) and 'errors'.  All times are wall
+    times in seconds.
+    """
+    from sage.version import version
+    if names is None:
+        names = [spec[0] for spec in INTERFACES]
+    specs = dict([(spec[0], spec) for spec in INTERFACES])
+    results = {}
+    for name in names:
+        if not specs.has_key(name):
+            raise ValueError, "unknown interface '%s'"%name
+        if verbose:
+            print "Benchmarking %s..."%name
+        results[name] = benchmark_interface(specs[name], repeat=repeat,
+                              round_trips=round_trips, list_length=list_length,
+                              elements=elements)
+        if verbose:
+            _print_results(results[name])
+    R = {'sage_version': version,
+         'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+         'host': os.uname()[1],
+         'parameters': {'repeat': repeat, 'round_trips': round_trips,
+                        'list_length': list_length, 'elements': elements},
+         'interfaces': results}
+    if filename is not None:
+        from sage.misc.jsonify import jsonify
+        open(filename, 'w').write(jsonify(R, indent=2) + '\n')
+    return R
+
+def benchmark_interface(spec, repeat=3, round_trips=100, list_length=10000, elements=200):
+    """
+    Benchmark a new instance of the interface described by spec, an
+    entry of INTERFACES, and return a dictionary of results.  See
+    interface_benchmark for the meaning of the other arguments.
+    """
+    name, module, cls, trivial, list_syntax, busy = spec
+    R = {'installed': False, 'errors': {}}
+    try:
+        m = __import__('sage.interfaces.%s'%module, {}, {}, [cls])
+        P = getattr(m, cls)()
+        P._start()
+    except Exception, msg:
+        R['errors']['startup'] = str(msg)
+        return R
+    R['installed'] = True
+
+    def run(key, f):
+        try:
+            f()
+        except Exception, msg:
+            R['errors'][key] = str(msg)
+
+    def startup():
+        R['startup_seconds'], R['startup_from_spare_seconds'] = startup_benchmark(P, repeat)
+
+    def latency():
+        P.eval(trivial)
+        t = time.time()
+        for i in range(round_trips):
+            P.eval(trivial)
+        R['round_trip_seconds'] = (time.time() - t)/round_trips
+
+    def bulk():
+        value = list_syntax%(','.join([str(i) for i in range(list_length)]))
+        t = time.time()
+        x = P(value)
+        R['bulk_set_bytes_per_second'] = _rate(len(value), time.time() - t)
+        t = time.time()
+        s = P.get(x.name())
+        R['bulk_get_bytes_per_second'] = _rate(len(s), time.time() - t)
+        t = time.time()
+        s = P.get_using_file(x.name())
+        R['bulk_get_using_file_bytes_per_second'] = _rate(len(s), time.time() - t)
+
+    def create_and_free():
+        t = time.time()
+        v = [P('1') for i in range(elements)]
+        R['elements_created_per_second'] = _rate(elements, time.time() - t)
+        t = time.time()
+        del v
+        gc.collect()
+        P.eval(trivial)    # frees the variables of the deleted elements
+        R['elements_freed_per_second'] = _rate(elements, time.time() - t)
+
+    def interrupt():
+        P.eval(trivial)
+        P._sendstr(busy + '\n')
+        time.sleep(0.5)
+        t = time.time()
+        P.interrupt()
+        P.eval(trivial)
+        R['interrupt_recovery_seconds'] = time.time() - t
+
+    run('startup', startup)
+    run('round_trip', latency)
+    run('bulk', bulk)
+    run('elements', create_and_free)
+    run('interrupt', interrupt)
+    try:
+        P.quit()
+    except Exception:
+        pass
+    return R
+
+def _rate(n, t):
+    return n/max(t, 1e-6)
+
+def _print_results(R):
+    if not R['installed']:
+        print "    not installed"
+        return
+    keys = [k for k in R.keys() if k not in ('installed', 'errors')]
+    keys.sort()
+    for k in keys:
+        print "    %-40s %.6g"%(k, R[k])
+    for k, msg in R['errors'].iteritems():
+        print "    %s failed: %s"%(k, msg.split('\n')[0])
@@ -31,9 +31,11 @@ AUTHORS:
 from __future__ import with_statement
 
 import os
+import re
 import weakref
 import time
 import gc
+import itertools
 from random import randrange
 
 ########################################################
@@ -62,6 +64,13 @@ import os
 from sage.misc.misc import SAGE_ROOT, verbose, SAGE_TMP_INTERFACE, LOCAL_IDENTIFIER
 BAD_SESSION = -2
 
+# Pipelined evaluation (see Expect._eval_pipelined) sends at most this
+# many lines, and at most about this many bytes, in one batch.  The
+# byte limit keeps each batch well below the size of the input buffer
+# of a terminal, so that sending never blocks.
+PIPELINE_BATCH_SIZE = 100
+PIPELINE_MAX_BYTES = 1024
+
 failed_to_start = []
 
 #tmp_expect_interface_local='%s/tmp'%SAGE_TMP_INTERFACE
@@ -69,6 +78,8 @@ failed_to_start = []
 def tmp_expect_interface_local():
     return '%s/tmp'%SAGE_TMP_INTERFACE + str(os.getpid())
 
+_tmpfile_numbers = itertools.count()
+
 ## On some platforms, e.g., windows, this can easily take 10 seconds!?!  Terrible.  And
 ## it should not be necessary or used anyways. 
 ## def _absolute(cmd):
@@ -147,6 +158,21 @@ class Expect(ParentWithBase):
     """
     Expect interface object.
     """
+    # Whether the names of cleared variables are used for new objects.
+    _reuse_var_names = True
+
+    # Values and lines longer than this many characters are sent to
+    # and received from the interpreter through a temporary file
+    # instead of through the pseudo-tty, which is slow for large
+    # amounts of data and hangs on lines of more than 4096 characters.
+    _file_transfer_cutoff = 4000
+
+    # Whether to start a spare process in the background whenever the
+    # interface is started, which the next _start (after a restart or
+    # a crash, or for another instance) takes over instead of waiting
+    # for the interpreter to boot.  See keep_spare and _prestart.
+    _keep_spare = False
+
     def __init__(self, name, prompt, command=None, server=None, server_tmpdir=None,
                  ulimit = None, maxread=100000, 
                  script_subdirectory="", restart_on_ctrlc=False,
@@ -209,6 +235,10 @@ class Expect(ParentWithBase):
         
         quit.expect_objects.append(weakref.ref(self))
         self._available_vars = []
+        self._vars_to_clear = []
+        self._objects_created = 0
+        self._objects_released = 0
+        self._vars_freed = 0
         ParentWithBase.__init__(self, self)
 
     def _get(self, wait=0.1, alternate_prompt=None):
@@ -419,6 +449,10 @@ If this all works, you can then make calls like:
         global failed_to_start
 
         self._session_number += 1
+        # The objects of the previous session are gone.
+        self._vars_to_clear = []
+        self._objects_created = 0
+        self._objects_released = 0
         current_path = os.path.abspath('.')
         dir = self.__path
         if not os.path.exists(dir):
@@ -447,9 +481,14 @@ If this all works, you can then make calls like:
             if self.__remote_cleaner and self._server:
                 c = 'sage-native-execute  ssh %s "nohup sage -cleaner"  &'%self._server
                 os.system(c)
-            self._expect = pexpect.spawn(cmd, logfile=self.__logfile)
-            if self._do_cleaner():
-                cleaner.cleaner(self._expect.pid, cmd)
+            E, ready = self._take_spare()
+            if E is None:
+                E = pexpect.spawn(cmd, logfile=self.__logfile)
+                if self._do_cleaner():
+                    cleaner.cleaner(E.pid, cmd)
+            else:
+                E.logfile = self.__logfile
+            self._expect = E
             
         except (ExceptionPexpect, pexpect.EOF, IndexError):
             self._expect = None
@@ -464,7 +503,8 @@ If this all works, you can then make calls like:
         self._expect.maxread = self.__maxread
         self._expect.delaybeforesend = 0
         try:
-            self._expect.expect(self._prompt)
+            if not ready:
+                self._expect.expect(self._prompt)
         except (pexpect.TIMEOUT, pexpect.EOF), msg:
             self._expect = None
             self._session_number = BAD_SESSION
@@ -478,6 +518,107 @@ If this all works, you can then make calls like:
             else:
                 for X in self.__init_code:
                     self._send(X)
+        if self._keep_spare:
+            self._prestart()
+
+    def keep_spare(self, keep=None):
+        """
+        Return whether a spare process of this interface is started in
+        the background whenever it starts, so that restarting it after
+        a quit or a crash does not wait for the interpreter to boot.
+        If keep is given, turn this on or off instead; turning it off
+        kills the spare process.
+
+        This is off by default, since the spare process uses as much
+        memory as the interpreter itself for the whole session.
+
+        EXAMPLES::
+
+            sage: s = Singular()
+            sage: s.keep_spare()
+            False
+            sage: s.keep_spare(True)
+            sage: s('2+3')
+            5
+            sage: s.quit(); s('2+3')    # fast, since the spare process is used
+            5
+            sage: s.keep_spare(False); s.quit()
+        """
+        if keep is None:
+            return self._keep_spare
+        self._keep_spare = bool(keep)
+        if not self._keep_spare:
+            E, ready = self._take_spare()
+            if E is not None:
+                quit.close_spare(E)
+        elif self._expect is not None:
+            self._prestart()
+
+    def _spare_key(self):
+        return (self.__command, self.__path, os.getpid())
+
+    def _prestart(self, wait=False):
+        """
+        Start a process for this interface in the background, which
+        the next call to _start uses instead of starting a new one.
+        Nothing happens if there already is such a spare process.
+
+        INPUT:
+
+        -  ``wait`` - bool (default: False); if True, wait until the
+           process is ready for input
+
+        EXAMPLES::
+
+            sage: s = Singular()
+            sage: s._prestart(wait=True)
+            sage: s._start()       # fast, since the process is already running
+            sage: s('2+3')
+            5
+            sage: s.quit()
+        """
+        key = self._spare_key()
+        spare = quit.spare_processes.get(key)
+        if spare is not None and spare[0].isalive():
+            E, ready = spare
+        else:
+            current_path = os.path.abspath('.')
+            dir = self.__path
+            if not os.path.exists(dir):
+                os.makedirs(dir)
+            os.chdir(dir)
+            try:
+                try:
+                    E = pexpect.spawn(self.__command)
+                except (ExceptionPexpect, pexpect.EOF, IndexError):
+                    return
+            finally:
+                os.chdir(current_path)
+            if self._do_cleaner():
+                cleaner.cleaner(E.pid, self.__command)
+            ready = False
+        if wait and not ready:
+            try:
+                E.expect(self._prompt, timeout=self.__max_startup_time)
+                ready = True
+            except (pexpect.TIMEOUT, pexpect.EOF):
+                quit.close_spare(E)
+                return
+        quit.spare_processes[key] = (E, ready)
+
+    def _take_spare(self):
+        """
+        Return the pair (pexpect object, whether the prompt has been
+        read already) for the spare process started by _prestart, and
+        forget about it, or return (None, False) if there is none.
+        """
+        spare = quit.spare_processes.pop(self._spare_key(), None)
+        if spare is None:
+            return None, False
+        if not spare[0].isalive():
+            quit.close_spare(spare[0])
+            return None, False
+        return spare
 
 
     def clear_prompts(self):
@@ -555,7 +696,9 @@ If this all works, you can then make calls like:
         try:
             return self.__local_tmpfile
         except AttributeError:
-            self.__local_tmpfile = tmp_expect_interface_local()
+            # Each instance has its own file, so that several instances
+            # of an interface can be used at the same time.
+            self.__local_tmpfile = '%s-%s'%(tmp_expect_interface_local(), _tmpfile_numbers.next())
             return self.__local_tmpfile
 
     def _remote_tmpdir(self):
@@ -629,9 +772,89 @@ If this all works, you can then make calls like:
     def _post_process_from_file(self, s):
         return s
 
+    def _can_read_in_files(self):
+        """
+        Return True if this interface knows how to make the interpreter
+        read in a file, i.e., implements _read_in_file_command.  This
+        is only found out once, since _eval_line asks for every line.
+        """
+        try:
+            return self.__can_read_in_files
+        except AttributeError:
+            pass
+        try:
+            self._read_in_file_command(self._local_tmpfile())
+            self.__can_read_in_files = True
+        except (NotImplementedError, ValueError):
+            self.__can_read_in_files = False
+        return self.__can_read_in_files
+
+    def _line_cutoff(self):
+        """
+        Return the length above which lines are evaluated by reading
+        them in from a file, or 0 if that is not possible.
+        """
+        if self._eval_using_file_cutoff:
+            return self._eval_using_file_cutoff
+        if self._can_read_in_files():
+            return self._file_transfer_cutoff
+        return 0
+
+    def _write_to_file_command(self, var):
+        """
+        Return a command that makes the interpreter write the string
+        representation of the variable var to a file, whose name is
+        substituted for the %s in the command.
+
+        Derived classes implement this to make get_using_file fast.
+        """
+        raise NotImplementedError
+
+    def _eval_to_file(self, cmd):
+        r"""
+        Evaluate the command cmd%filename, which makes the interpreter
+        write to the file filename, and return what it wrote.
+
+        This works for remote interpreters as well, in which case the
+        file is copied from the server.
+
+        EXAMPLES::
+
+            sage: gap._eval_to_file('PrintTo("%s", 2^10);')
+            '1024'
+        """
+        local_file = self._local_tmpfile() + '.out'
+        if os.path.exists(local_file):
+            os.unlink(local_file)
+        if self.is_remote():
+            filename = self._remote_tmpfile() + '.out'
+        else:
+            filename = local_file
+        out = self.eval(cmd%filename)
+        if self.is_remote():
+            self._get_tmpfile_from_server(local_file, filename)
+        if not os.path.exists(local_file):
+            raise RuntimeError, "%s did not write the output of %s to a file:\n%s"%(self, cmd%filename, out)
+        F = open(local_file)
+        try:
+            s = F.read()
+        finally:
+            F.close()
+        os.unlink(local_file)
+        return s
+
+    def _post_process_get_using_file(self, s):
+        """
+        Turn the contents s of a file written by the command returned
+        by _write_to_file_command into what get would have returned.
+        """
+        return s.strip()
+
     def _eval_line(self, line, allow_use_file=True, wait_for_prompt=True):
-        if allow_use_file and self._eval_using_file_cutoff and len(line) > self._eval_using_file_cutoff:
-            return self._eval_line_using_file(line)
+        if allow_use_file:
+            cutoff = self._line_cutoff()
+            if cutoff and len(line) > cutoff:
+                return self._eval_line_using_file(line)
         try:
             if self._expect is None:
                 self._start()
@@ -935,7 +1158,199 @@ If this all works, you can then make calls like:
     # END Synchronization code.
     ###########################################################################
 
-    def eval(self, code, strip=True, synchronize=False, locals=None, **kwds):
+    ###########################################################################
+    # BEGIN Pipelined evaluation.
+    #
+    # Instead of sending one line and waiting for the prompt before
+    # sending the next one, a batch of lines is sent at once, each
+    # followed by a command that makes the interpreter print a unique
+    # marker.  The output is then split at the markers, so we get the
+    # output of each line without a round trip per line.
+    #
+    # Interfaces support this by implementing _pipeline_marker_command,
+    # and, if the output of a line needs more processing than
+    # stripping prompts and echoed input, _pipeline_output.
+    ###########################################################################
+
+    def _pipeline_marker(self, n):
+        """
+        Return the marker printed by the command
+        ``self._pipeline_marker_command(n)``.
+        
+        EXAMPLES::
+        
+            sage: singular._pipeline_marker(5)
+            '__SAGE_PIPE_5__'
+        """
+        return '__SAGE_PIPE_%s__'%n
+
+    def _pipeline_marker_command(self, n):
+        """
+        Return a command that makes the interpreter print
+        ``self._pipeline_marker(n)``.  The marker must not appear in
+        the text of the command itself, since the command is echoed.
+        
+        Interfaces that do not support pipelined evaluation raise a
+        NotImplementedError.
+        
+        EXAMPLES::
+        
+            sage: singular._pipeline_marker_command(5)
+            '"__SAGE_PIPE_"+string(4+1)+"__";'
+        """
+        raise NotImplementedError
+
+    def _pipeline_line(self, line):
+        """
+        Return the text to send for line in a pipelined batch, or None
+        if line has to be evaluated on its own with _eval_line (e.g.,
+        because it is so long that it is sent through a file).
+        
+        EXAMPLES::
+        
+            sage: singular._pipeline_line('2+3;')
+            '2+3;'
+            sage: singular._pipeline_line('x'*5000) is None
+            True
+        """
+        if len(line) > PIPELINE_MAX_BYTES:
+            return None
+        if self._eval_using_file_cutoff and len(line) > self._eval_using_file_cutoff:
+            return None
+        return line
+
+    def _pipeline_output(self, line, out):
+        """
+        Return the output of line from out, which is everything the
+        interpreter printed between the marker before line and the
+        marker after it.  This should return what _eval_line would
+        have returned, and raise the same errors.
+        
+        The base class removes the prompts before and after the
+        output and a first line that echoes line.
+        
+        EXAMPLES::
+        
+            sage: singular._pipeline_output('2+3;', '\r\n> 2+3;\r\n5\r\n> ')
+            '5'
+        """
+        prompts = list(re.finditer(self._prompt, out))
+        if len(prompts) > 0:
+            out = out[prompts[0].end():prompts[-1].start()]
+        out = out.replace('\r\n', '\n')
+        if out.endswith('\n'):
+            out = out[:-1]
+        i = out.find('\n')
+        if i != -1 and out[:i].strip() == line.strip():
+            out = out[i+1:]
+        elif out.strip() == line.strip():
+            out = ''
+        return out
+
+    def _pipeline_abort(self, line, out, pattern):
+        """
+        Called when, while evaluating line in a pipelined batch, the
+        output matched one of the patterns in
+        ``self._pipeline_error_patterns()`` instead of the marker.
+        This must bring the interpreter back into a usable state and
+        raise an exception.
+        """
+        self.interrupt()
+        self._synchronize()
+        raise RuntimeError, "%s\n%s failed executing %s"%(out, self, line)
+
+    def _pipeline_error_patterns(self):
+        """
+        Return a list of patterns that indicate that the interpreter
+        is waiting for input and would swallow the following lines
+        of a pipelined batch.
+        """
+        return []
+
+    def _eval_pipelined(self, lines, **kwds):
+        """
+        Evaluate lines, sending them in batches, and return the list of
+        their outputs.
+        
+        Errors are raised for the first line whose output contains
+        one, exactly as if the lines were evaluated one at a time;
+        however, the lines after it in the same batch have already
+        been sent to the interpreter.
+        
+        Lines that have to be evaluated on their own (see
+        _pipeline_line) are passed to _eval_line with the keyword
+        arguments kwds.
+        
+        EXAMPLES::
+        
+            sage: singular._eval_pipelined(['int a = 2;', 'a+3;', 'a*5;'])
+            ['', '5', '10']
+        """
+        outputs = []
+        batch = []
+        nbytes = 0
+        for L in lines:
+            X = self._pipeline_line(L)
+            if X is not None and (len(batch) >= PIPELINE_BATCH_SIZE or
+                                  nbytes + len(X) > PIPELINE_MAX_BYTES):
+                outputs.extend(self._eval_batch(batch))
+                batch = []
+                nbytes = 0
+            if X is None:
+                outputs.extend(self._eval_batch(batch))
+                batch = []
+                nbytes = 0
+                outputs.append(self._eval_line(L, **kwds))
+            else:
+                batch.append((L, X))
+                nbytes += len(X) + 40
+        outputs.extend(self._eval_batch(batch))
+        return outputs
+
+    def _eval_batch(self, batch):
+        """
+        Send the lines in batch, a list of pairs (line, text to send),
+        at once and return the list of their outputs.
+        """
+        if len(batch) == 0:
+            return []
+        if self._expect is None:
+            self._start()
+        E = self._expect
+        # Keep the markers small enough for 32-bit integers.
+        n = randrange(10**8)
+        cmds = [self._pipeline_marker_command(n)]
+        for i, (L, X) in enumerate(batch):
+            cmds.append(X)
+            cmds.append(self._pipeline_marker_command(n+i+1))
+        patterns = self._pipeline_error_patterns()
+        chunks = []
+        try:
+            self._sendstr('\n'.join(cmds) + '\n')
+            # Everything before the first marker is input that the
+            # terminal echoed.
+            E.expect(self._pipeline_marker(n))
+            for i, (L, X) in enumerate(batch):
+                j = E.expect([self._pipeline_marker(n+i+1)] + patterns)
+                if j > 0:
+                    self._pipeline_abort(L, E.before, patterns[j-1])
+                chunks.append(E.before)
+            E.expect(self._prompt)
+        except pexpect.EOF, msg:
+            self._crash_msg()
+            self.quit()
+            L = batch[min(len(chunks), len(batch)-1)][0]
+            raise RuntimeError, "%s\n%s crashed executing %s"%(msg, self, L)
+        except KeyboardInterrupt:
+            self._keyboard_interrupt()
+            raise KeyboardInterrupt, "Ctrl-c pressed while running %s"%self
+        return [self._pipeline_output(L, out) for (L, X), out in zip(batch, chunks)]
+
+    ###########################################################################
+    # END Pipelined evaluation.
+    ###########################################################################
+
+    def eval(self, code, strip=True, synchronize=False, locals=None, pipeline=False, **kwds):
         """
         INPUT:
         
@@ -948,6 +1363,11 @@ If this all works, you can then make calls like:
         - ``locals`` - None (ignored); this is used for compatibility with the
           Sage notebook's generic system interface.
          
+        -  ``pipeline`` - bool (default: False); if True and the
+           interface supports it, send the lines of code in batches
+           instead of waiting for the output of each line before
+           sending the next one (see _eval_pipelined)
+         
         -  ``**kwds`` - All other arguments are passed onto
            the _eval_line method. An often useful example is
            reformat=False.
@@ -967,12 +1387,24 @@ If this all works, you can then make calls like:
         if not isinstance(code, basestring):
             raise TypeError, 'input code must be a string.'
 
+        with gc_disabled():
+            self._clear_pending_vars()
+
         #Remove extra whitespace
         code = code.strip()
         
+        lines = [L for L in code.split('\n') if L != '']
+        if pipeline and len(lines) > 1:
+            try:
+                self._pipeline_marker_command(0)
+            except NotImplementedError:
+                pipeline = False
+
         try:
             with gc_disabled():
-                return '\n'.join([self._eval_line(L, **kwds) for L in code.split('\n') if L != ''])
+                if pipeline and len(lines) > 1:
+                    return '\n'.join(self._eval_pipelined(lines, **kwds))
+                return '\n'.join([self._eval_line(L, **kwds) for L in lines])
         except KeyboardInterrupt:
             # DO NOT CATCH KeyboardInterrupt, as it is being caught
             # by _eval_line
@@ -1129,20 +1561,112 @@ If this all works, you can then make calls like:
         Return the string representation of the variable var in self,
         possibly using a file. Use this if var has a huge string
         representation, since it may be way faster.
-        
-        .. warning::
 
-           In fact unless a special derived class implements this, it
-           will *not* be any faster. This is the case for this class
-           if you're reading it through introspection and seeing this.
+        The interpreter writes var to a temporary file, which is then
+        read back.  Interfaces that do not implement
+        _write_to_file_command simply call get.
+
+        EXAMPLES::
+
+            sage: gap.set('x', '2^1000')
+            sage: gap.get_using_file('x') == str(2^1000)
+            True
         """
-        return self.get(var)
+        try:
+            cmd = self._write_to_file_command(var)
+        except NotImplementedError:
+            return self.get(var)
+        return self._post_process_get_using_file(self._eval_to_file(cmd))
 
     def clear(self, var):
         """
         Clear the variable named var.
+        
+        This is called when objects are garbage collected, so the
+        variable is not cleared right away, which would cost a round
+        trip to the interpreter for every object.  Instead it is
+        queued and cleared together with all other queued variables
+        at the beginning of the next evaluation (see
+        _clear_pending_vars).  Afterwards its name is reused for new
+        objects.
+        """
+        self._vars_to_clear.append(var)
+
+    def _clear_commands(self, vars):
+        """
+        Return a list of commands that free the values of the
+        variables in the list vars in the interpreter.
+        
+        Interfaces should return as few commands as possible (see
+        _batch_commands).  The base class does not free anything; the
+        values are only replaced when the names of the variables are
+        reused.
+        
+        EXAMPLES::
+        
+            sage: from sage.interfaces.expect import Expect
+            sage: Expect._clear_commands(gp, ['sage1', 'sage2'])
+            []
+        """
+        return []
+
+    def _clear_pending_vars(self):
         """
-        self._available_vars.append(var)
+        Free all variables that were queued by clear in the
+        interpreter, using as few round trips as possible, and make
+        their names available for new objects.
+        
+        EXAMPLES::
+        
+            sage: a = singular(2); n = a.name(); del a
+            sage: n in singular._vars_to_clear
+            True
+            sage: singular._clear_pending_vars()
+            sage: singular._vars_to_clear
+            []
+        """
+        if len(self._vars_to_clear) == 0:
+            return
+        # clear may be called again while we are evaluating the
+        # commands below, so take the queue out first.
+        vars = self._vars_to_clear
+        self._vars_to_clear = []
+        if self._expect is not None:
+            for cmd in self._clear_commands(vars):
+                self._eval_line(cmd)
+        self._vars_freed += len(vars)
+        if self._reuse_var_names:
+            self._available_vars.extend(vars)
+
+    def remote_object_counts(self):
+        """
+        Return counts of the objects of this interface and of the
+        variables that hold them in the interpreter.
+        
+        OUTPUT: a dictionary with the keys
+        
+        -  ``'live'`` - the number of objects of the current session
+           that have not been garbage collected yet
+        
+        -  ``'pending'`` - the number of variables of garbage collected
+           objects that will be freed at the next evaluation
+        
+        -  ``'freed'`` - the number of variables freed so far
+        
+        EXAMPLES::
+        
+            sage: g = Gap()
+            sage: a = g(2); b = g(3); del a
+            sage: g.remote_object_counts()
+            {'freed': 0, 'live': 1, 'pending': 1}
+            sage: g.eval('1')
+            '1'
+            sage: g.remote_object_counts()
+            {'freed': 1, 'live': 1, 'pending': 0}
+        """
+        return {'live': self._objects_created - self._objects_released,
+                'pending': len(self._vars_to_clear),
+                'freed': self._vars_freed}
     
     def _next_var_name(self):
         if len(self._available_vars) != 0:
@@ -1355,6 +1879,9 @@ class ExpectElement(RingElement):
     """
     Expect element.
     """
+    # Whether the string representation is fetched through a file.
+    _get_using_file = False
+
     def __init__(self, parent, value, is_name=False, name=None):
         RingElement.__init__(self, parent)
         self._create = value
@@ -1362,8 +1889,8 @@ class ExpectElement(RingElement):
         # idea: Joe Wetherell -- try to find out if the output
         # is too long and if so get it using file, otherwise
         # don't.
-        if isinstance(value, basestring) and parent._eval_using_file_cutoff and \
-           parent._eval_using_file_cutoff < len(value):
+        if isinstance(value, basestring) and parent._line_cutoff() and \
+           parent._line_cutoff() < len(value):
             self._get_using_file = True
             
         if is_name:
@@ -1375,6 +1902,7 @@ class ExpectElement(RingElement):
                 self._session_number = -1
                 raise TypeError, x
         self._session_number = parent._session_number
+        parent._objects_created += 1
 
 
     def _latex_(self):
@@ -1482,6 +2010,7 @@ class ExpectElement(RingElement):
             if hasattr(self,'_name'):
                 P = self.parent()
                 if not (P is None):
+                    P._objects_released += 1
                     P.clear(self._name)
                 
         except (RuntimeError, ExceptionPexpect), msg:    # needed to avoid infinite loops in some rare cases
@@ -1489,7 +2018,7 @@ class ExpectElement(RingElement):
             pass
 
     def _sage_(self):
-        #TO DO: this could use file transfers when self.is_remote()
+        # repr uses a file transfer if the value is large
         return sage.misc.sage_eval.sage_eval(repr(self).replace('\n',''))
         
 
@@ -1504,16 +2033,27 @@ class ExpectElement(RingElement):
             self._check_valid()
         except ValueError:
             return '(invalid object -- defined in terms of closed session)'
-        try:
-            if self._get_using_file:
-                s = self.parent().get_using_file(self._name)
-        except AttributeError:
-            s = self.parent().get(self._name)
+        s = self._get()
         if s.__contains__(self._name):
             if hasattr(self, '__custom_name'):
                 s =  s.replace(self._name, self.__dict__['__custom_name'])
         return s
 
+    def _get(self):
+        """
+        Return the string representation of self in the interpreter.
+
+        Once a value turns out to be large, it is fetched through a
+        file from then on.
+        """
+        P = self.parent()
+        if self._get_using_file:
+            return P.get_using_file(self._name)
+        s = P.get(self._name)
+        if len(s) > P._file_transfer_cutoff:
+            self._get_using_file = True
+        return s
+
     def __getattr__(self, attrname):
         P = self._check_valid()
         if attrname[:1] == "_":
@@ -1782,9 +2322,114 @@ class ExpectElement(RingElement):
 def reduce_load(parent, x):
     return parent(x)
 
+def _batch_commands(items, template, sep, maxlen=1000):
+    """
+    Join the strings in items with sep into groups, and return the
+    list of strings template%group, each of which is at most maxlen
+    characters long unless a single item is too long.
+    
+    EXAMPLES::
+    
+        sage: from sage.interfaces.expect import _batch_commands
+        sage: _batch_commands(['a', 'b', 'c'], 'kill(%s)$', ',', 11)
+        ['kill(a,b)$', 'kill(c)$']
+    """
+    commands = []
+    group = []
+    n = len(template) - 2
+    for x in items:
+        if group and n + len(sep) + len(x) > maxlen:
+            commands.append(template%sep.join(group))
+            group = []
+            n = len(template) - 2
+        if group:
+            n += len(sep)
+        group.append(x)
+        n += len(x)
+    if group:
+        commands.append(template%sep.join(group))
+    return commands
+
 import os
 def console(cmd):
     os.system(cmd)
 
 
 
+
+def pipeline_benchmark(P, lines):
+    """
+    Evaluate lines in the interface P one at a time and then
+    pipelined, and return the wall times that this took.
+
+    INPUT:
+
+    -  ``P`` - an interface that supports pipelined evaluation
+
+    -  ``lines`` - list of strings
+
+    OUTPUT: pair (seconds without pipelining, seconds with pipelining)
+
+    EXAMPLES::
+
+        sage: from sage.interfaces.expect import pipeline_benchmark
+        sage: pipeline_benchmark(singular, ['int a%s = %s;'%(i,i) for i in range(500)])  # random
+        (0.81, 0.05)
+        sage: pipeline_benchmark(maxima, ['a%s : %s$'%(i,i) for i in range(500)])  # random
+        (2.92, 0.11)
+    """
+    code = '\n'.join(lines)
+    P.eval('0;')   # start the interface
+    t = time.time()
+    P.eval(code)
+    t0 = time.time() - t
+    t = time.time()
+    P.eval(code, pipeline=True)
+    t1 = time.time() - t
+    return t0, t1
+
+def startup_benchmark(P, n=3):
+    """
+    Start the interface P n times from scratch and n times using a
+    spare process started ahead of time, and return the average wall
+    time it took until P evaluated its first command.
+
+    INPUT:
+
+    -  ``P`` - an interface
+
+    -  ``n`` - integer (default: 3)
+
+    OUTPUT: pair (seconds for a cold start, seconds using a spare)
+
+    EXAMPLES::
+
+        sage: from sage.interfaces.expect import startup_benchmark
+        sage: startup_benchmark(Maxima())  # random
+        (1.21, 0.13)
+        sage: startup_benchmark(Singular())  # random
+        (0.09, 0.01)
+    """
+    keep_spare = P._keep_spare
+    P._keep_spare = False
+    try:
+        cold = 0
+        for i in range(n):
+            P.quit()
+            E, ready = P._take_spare()
+            if E is not None:
+                quit.close_spare(E)
+            t = time.time()
+            P.eval('0;')
+            cold += time.time() - t
+        warm = 0
+        for i in range(n):
+            P.quit()
+            P._prestart(wait=True)
+            t = time.time()
+            P.eval('0;')
+            warm += time.time() - t
+        P.quit()
+    finally:
+        P._keep_spare = keep_spare
+    return cold/n, warm/n
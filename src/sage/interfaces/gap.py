@@ -176,7 +176,7 @@ AUTHORS:
 #*****************************************************************************
 
 import expect
-from expect import Expect, ExpectElement, FunctionElement, ExpectFunction
+from expect import Expect, ExpectElement, FunctionElement, ExpectFunction, _batch_commands
 from sage.misc.misc import SAGE_ROOT, DOT_SAGE, is_64_bit, is_in_string
 from IPython.genutils import page
 import re
@@ -540,17 +540,32 @@ class Gap(Expect):
             '2'
         """
         if use_file:
-            tmp = self._local_tmpfile()
-            if os.path.exists(tmp):
-                os.unlink(tmp)
-            self.eval('PrintTo("%s", %s);'%(tmp,var), strip=False)
-            r = open(tmp).read()
-            r = r.strip().replace("\\\n","")
-            os.unlink(tmp)
-            return r
+            return self.get_using_file(var)
         else:
             return self.eval('Print(%s);'%var, newlines=False)
 
+    def _write_to_file_command(self, var):
+        """
+        Return the command used to write the variable var to a file.
+        
+        EXAMPLES::
+        
+            sage: gap._write_to_file_command('x')
+            'PrintTo("%s", x);'
+        """
+        return 'PrintTo("%%s", %s);'%var
+
+    def _post_process_get_using_file(self, s):
+        r"""
+        Remove the line continuations GAP puts into long output.
+        
+        EXAMPLES::
+        
+            sage: gap._post_process_get_using_file('123\\\n456\n')
+            '123456'
+        """
+        return s.strip().replace("\\\n","")
+
     def _pre_interact(self):
         """
         EXAMPLES::
@@ -746,6 +761,21 @@ class Gap(Expect):
         self.eval('Unbind(%s)'%var)
         self._available_vars.append(var)
 
+    def _clear_commands(self, vars):
+        """
+        Return the commands that unbind the variables in the list vars
+        (see Expect.clear).
+        
+        EXAMPLES::
+        
+            sage: gap._clear_commands(['$sage1', '$sage2'])
+            ['Unbind($sage1);Unbind($sage2);']
+        """
+        # Longer lines would be read from a file, which only works
+        # for expressions.
+        return _batch_commands(['Unbind(%s);'%v for v in vars], '%s', '',
+                               self._eval_using_file_cutoff)
+
     def _contains(self, v1, v2):
         """
         EXAMPLES::
@@ -385,6 +385,20 @@ class Gp(Expect):
         """
         return self.eval('print(%s)'%var)
 
+    def _write_to_file_command(self, var):
+        """
+        Return the command used to write the variable var to a file.
+        
+        EXAMPLES::
+        
+            sage: gp._write_to_file_command('x')
+            'write("%s", x)'
+            sage: gp.set('x', '2^1000')
+            sage: gp.get_using_file('x') == str(2^1000)
+            True
+        """
+        return 'write("%%s", %s)'%var
+
     def kill(self, var):
         """
         EXAMPLES::
@@ -178,7 +178,21 @@ class Macaulay2(Expect):
             sage: import os
             sage: os.unlink(filename)
         """
-        return 'get "%s"'%filename
+        return 'value get "%s"'%filename
+
+    def _write_to_file_command(self, var):
+        """
+        Return the command that writes what get returns for var to a
+        file.
+
+        EXAMPLES:
+            sage: macaulay2._write_to_file_command('a')
+            '"%s" << toString describe a << close;'
+            sage: macaulay2.set("a", "2^100")       #optional
+            sage: macaulay2.get_using_file("a")     #optional
+            '1267650600228229401496703205376'
+        """
+        return '"%%s" << toString describe %s << close;'%var
 
     def __getattr__(self, attrname):
         """
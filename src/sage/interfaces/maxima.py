@@ -456,7 +456,7 @@ import os, re, sys, subprocess
 import pexpect
 cygwin = os.uname()[0][:6]=="CYGWIN"
 
-from expect import Expect, ExpectElement, FunctionElement, ExpectFunction, gc_disabled, AsciiArtString
+from expect import Expect, ExpectElement, FunctionElement, ExpectFunction, gc_disabled, AsciiArtString, _batch_commands
 from pexpect import EOF
 
 from random import randrange
@@ -481,6 +481,9 @@ class Maxima(Expect):
     """
     Interface to the Maxima interpreter.
     """
+    # Cleared names may be those of user variables, e.g., x.
+    _reuse_var_names = False
+
     def __init__(self, script_subdirectory=None, logfile=None, server=None,
                  init_code = None):
         """
@@ -659,7 +662,8 @@ class Maxima(Expect):
         if self.is_remote():
             self._send_tmpfile_to_server(local_file=filename)
             tmp_to_use = self._remote_tmpfile()
-        tmp_to_use = filename
+        else:
+            tmp_to_use = filename
         
         if batchload:
             cmd = 'batchload("%s");'%tmp_to_use
@@ -695,6 +699,9 @@ class Maxima(Expect):
             line += ';'
 
         self._synchronize()
+        # Many methods call _eval_line directly instead of eval, so
+        # also kill the variables of garbage collected objects here.
+        self._clear_pending_vars()
 
         if len(line) > self.__eval_using_file_cutoff:
 	    # This implicitly uses the set method, then displays the result of the thing that was set. 
@@ -716,7 +723,18 @@ class Maxima(Expect):
         
         if not reformat:
             return out
+        return self._reformat(out)
+
+    def _reformat(self, out):
+        """
+        Return the output out of a line without the output label and
+        without whitespace.
         
+        EXAMPLES::
+        
+            sage: maxima._reformat('(%o5) x + 1\r\n')
+            'x+1'
+        """
         r = self._output_prompt_re
         m = r.search(out)
         if m is None:
@@ -726,8 +744,89 @@ class Maxima(Expect):
         o = ''.join([x.strip() for x in o.split()])
         return o
 
-        i = o.rfind('(%o')
-        return o[:i]
+    ###########################################
+    # Pipelined evaluation (see Expect._eval_pipelined)
+    ###########################################
+    def _pipeline_marker_command(self, n):
+        """
+        Return a command that prints the marker used to separate the
+        outputs of lines in pipelined evaluation.
+        
+        Pipelining saves two round trips per line, since _eval_line
+        also synchronizes before each line::
+        
+            sage: maxima.eval('a : 2$\na + 3;\na * 5;', pipeline=True)
+            '\n5\n10'
+        
+        EXAMPLES::
+        
+            sage: maxima._pipeline_marker_command(5)
+            'print(sconcat("__SAGE_PIPE_", 4+1, "__"))$'
+        """
+        return 'print(sconcat("__SAGE_PIPE_", %s+1, "__"))$'%(n-1)
+
+    def _pipeline_line(self, line):
+        """
+        Return the line as it is sent in pipelined evaluation, or None
+        if it is too long for that.
+        
+        EXAMPLES::
+        
+            sage: maxima._pipeline_line('2+3')
+            '2+3;'
+        """
+        line = line.rstrip()
+        if len(line) == 0 or len(line) > self.__eval_using_file_cutoff:
+            return None
+        if line[-1] != '$' and line[-1] != ';':
+            line += ';'
+        return line
+
+    def _pipeline_output(self, line, out):
+        """
+        Return the output of line from out, which is everything Maxima
+        printed between the marker before line and the marker after
+        it, and check it for errors like _eval_line.
+        
+        EXAMPLES::
+        
+            sage: maxima._pipeline_output('2+3;', '\n<sage-display>(%i5) <sage-display>(%o5) 5\r\n(%i6) ')
+            '5'
+        """
+        # Skip the prompt for the line and drop the prompt for the
+        # marker command.
+        prompts = list(re.finditer(self._prompt, out))
+        if len(prompts) > 0:
+            out = out[prompts[0].end():prompts[-1].start()]
+        out = out.replace(self._display_prompt, '')
+        self._error_check(line, out)
+        return self._reformat(out)
+
+    def _pipeline_error_patterns(self):
+        """
+        Return the questions that Maxima may ask during a computation,
+        which would swallow the following lines of a pipelined batch.
+        
+        EXAMPLES::
+        
+            sage: maxima._pipeline_error_patterns()[0]
+            'zero or nonzero?'
+        """
+        return self._ask
+
+    def _pipeline_abort(self, line, out, pattern):
+        """
+        Interrupt Maxima after it asked a question during pipelined
+        evaluation, and raise the same error as _eval_line.
+        """
+        j = out.find('Is ')
+        v = out[j:]
+        k = v.find(' ',4)
+        msg = "Computation failed since Maxima requested additional constraints (try the command 'assume(" + v[4:k] +">0)' before integral or limit evaluation, for example):\n" + v + pattern
+        self._sendstr(chr(3))
+        self._sendstr(chr(3))
+        self._synchronize()
+        raise ValueError, msg
 
 
     def _synchronize(self):
@@ -1100,6 +1199,28 @@ class Maxima(Expect):
         """
         s = self._eval_line('%s;'%var)
         return s
+
+    def _write_to_file_command(self, var):
+        """
+        Return the command used to write the variable var to a file.
+        
+        EXAMPLES::
+        
+            sage: maxima._write_to_file_command('x')
+            'with_stdout("%s", print(string(x)))$'
+        """
+        return 'with_stdout("%%s", print(string(%s)))$'%var
+
+    def _post_process_get_using_file(self, s):
+        """
+        Remove all whitespace, like _eval_line does.
+        
+        EXAMPLES::
+        
+            sage: maxima._post_process_get_using_file('x + 1 \n')
+            'x+1'
+        """
+        return ''.join(s.split())
         
     def clear(self, var):
         """
@@ -1114,10 +1235,19 @@ class Maxima(Expect):
             sage: maxima.get('x')
             'x'
         """
-        try:
-            self._expect.send('kill(%s)$'%var)
-        except (TypeError, AttributeError):
-            pass
+        Expect.clear(self, var)
+
+    def _clear_commands(self, vars):
+        """
+        Return the commands that kill the variables in the list vars
+        (see Expect.clear).
+        
+        EXAMPLES::
+        
+            sage: maxima._clear_commands(['sage1', 'sage2'])
+            ['kill(sage1,sage2)$']
+        """
+        return _batch_commands(vars, 'kill(%s)$', ',', self.__eval_using_file_cutoff)
         
     def console(self):
         r"""
@@ -1805,7 +1935,7 @@ class MaximaElement(ExpectElement):
             return self.__repr
         except AttributeError:
             pass
-        r = P.get(self._name)
+        r = self._get()
         self.__repr = r
         return r
 
@@ -0,0 +1,346 @@
+r"""
+Pools of interface instances
+
+Every interface module provides one global instance, such as ``gap``
+or ``singular``, so all computations of a Sage session in that system
+run one after the other in a single subprocess.  An InterfacePool
+manages several instances of an interface, which run independently
+of each other.  Instances are checked out for exclusive use and
+checked back in afterwards; before an instance is handed out, it is
+checked that it is still alive and in sync with its subprocess, and
+it is restarted if it crashed.
+
+Each thread of a Sage process may use its own instance, and map
+evaluates a function on many inputs concurrently, using all
+instances of the pool, so that independent computations run on
+several cores.
+
+EXAMPLES::
+
+    sage: P = InterfacePool(Gap, 2); P
+    Pool of 2 Gap interfaces
+    sage: P.map(lambda G, n: G.eval('Factorial(%s)'%n), [5, 10, 15])
+    ['120', '3628800', '1307674368000']
+    sage: G = P.checkout()
+    sage: G('Size(SymmetricGroup(5))')
+    120
+    sage: P.checkin(G)
+    sage: P.quit()
+"""
+
+#############################################################################
+#       Copyright (C) 2009 William Stein <wstein@gmail.com>
+#  Distributed under the terms of the GNU General Public License (GPL)
+#  The full text of the GPL is available at:
+#                  http://www.gnu.org/licenses/
+#############################################################################
+
+import os
+import sys
+import threading
+import Queue
+
+try:
+    from sage.structure.sage_object import SageObject
+except ImportError:
+    from sage.interfaces.expect_compat import SageObject
+
+def ncpus():
+    """
+    Return the number of processors of this computer, or 1 if that
+    cannot be determined.
+
+    EXAMPLES::
+
+        sage: from sage.interfaces.pool import ncpus
+        sage: ncpus() >= 1
+        True
+    """
+    try:
+        n = os.sysconf('SC_NPROCESSORS_ONLN')
+        if n > 0:
+            return n
+    except (AttributeError, ValueError, OSError):
+        pass
+    return 1
+
+class InterfacePool(SageObject):
+    def __init__(self, cls, n=None, **kwds):
+        """
+        A pool of at most n instances of the interface class cls.
+
+        INPUT:
+
+        - ``cls`` - a class derived from Expect, such as Gap,
+          Singular or Maxima, or any function that returns a new
+          interface instance
+
+        - ``n`` - integer (default: the number of processors); the
+          maximal number of instances
+
+        - ``**kwds`` - passed on to cls when an instance is created
+
+        Instances are created when they are first needed.
+
+        EXAMPLES::
+
+            sage: InterfacePool(Singular, 3)
+            Pool of 3 Singular interfaces
+        """
+        if n is None:
+            n = ncpus()
+        n = int(n)
+        if n < 1:
+            raise ValueError, "a pool must have at least one instance"
+        self.__cls = cls
+        self.__kwds = kwds
+        self.__size = n
+        self.__instances = []
+        self.__idle = Queue.Queue()
+        self.__lock = threading.Lock()
+
+    def _repr_(self):
+        return 'Pool of %s %s interfaces'%(self.__size, getattr(self.__cls, '__name__', self.__cls))
+
+    def size(self):
+        """
+        Return the maximal number of instances in this pool.
+
+        EXAMPLES::
+
+            sage: InterfacePool(Gap, 2).size()
+            2
+        """
+        return self.__size
+
+    def instances(self):
+        """
+        Return a list of the instances created so far, whether they
+        are checked out or not.
+
+        EXAMPLES::
+
+            sage: P = InterfacePool(Gap, 2)
+            sage: P.instances()
+            []
+            sage: P.checkin(P.checkout()); P.instances()
+            [Gap]
+        """
+        return list(self.__instances)
+
+    def checkout(self, timeout=None):
+        """
+        Return an idle instance for the exclusive use of the caller,
+        who must return it with checkin when done.
+
+        A new instance is created if there is no idle one and the pool
+        is not full yet; otherwise, this waits until another caller
+        checks an instance in.
+
+        INPUT:
+
+        - ``timeout`` - None or number of seconds; if no instance
+          becomes available within timeout seconds, a RuntimeError is
+          raised
+
+        EXAMPLES::
+
+            sage: P = InterfacePool(Gap, 1)
+            sage: G = P.checkout()
+            sage: P.checkout(timeout=0.1)
+            Traceback (most recent call last):
+            ...
+            RuntimeError: no Gap interface of the pool became available within 0.1 seconds
+            sage: P.checkin(G)
+            sage: P.checkout() is G
+            True
+        """
+        try:
+            P = self.__idle.get_nowait()
+        except Queue.Empty:
+            P = self._new_instance()
+            if P is None:
+                try:
+                    P = self.__idle.get(True, timeout)
+                except Queue.Empty:
+                    raise RuntimeError, "no %s interface of the pool became available within %s seconds"%(
+                        getattr(self.__cls, '__name__', self.__cls), timeout)
+        try:
+            self._health_check(P)
+        except:
+            self.__idle.put(P)
+            raise
+        return P
+
+    def checkin(self, P):
+        """
+        Return the instance P, obtained from checkout, to the pool.
+
+        EXAMPLES::
+
+            sage: P = InterfacePool(Gap, 1)
+            sage: G = P.checkout(); P.checkin(G)
+            sage: P.checkin(gap)
+            Traceback (most recent call last):
+            ...
+            ValueError: Gap does not belong to this pool
+        """
+        if not [Q for Q in self.__instances if Q is P]:
+            raise ValueError, "%s does not belong to this pool"%P
+        self.__idle.put(P)
+
+    def _new_instance(self):
+        """
+        Create a new instance if the pool is not full yet, and return
+        it, or return None.
+        """
+        self.__lock.acquire()
+        try:
+            if len(self.__instances) >= self.__size:
+                return None
+            P = self.__cls(**self.__kwds)
+            self.__instances.append(P)
+            return P
+        finally:
+            self.__lock.release()
+
+    def _health_check(self, P):
+        r"""
+        Make sure that the instance P can be used: restart it if its
+        subprocess died, and otherwise resynchronize it with its
+        subprocess, which interrupts any computation left running by
+        a previous user.
+
+        EXAMPLES::
+
+            sage: P = InterfacePool(Singular, 1)
+            sage: S = P.checkout(); S('2+3')
+            5
+            sage: S._sendstr('quit;\n')    # make it look like singular died
+            sage: P.checkin(S); S = P.checkout()
+            Singular crashed -- automatically restarting.
+            sage: S('2+3')
+            5
+            sage: P.checkin(S); P.quit()
+        """
+        if P._expect is None:
+            P._start()
+            return
+        if not P.is_running():
+            P._crash_msg()
+            P.quit()
+        else:
+            P._synchronize()
+        if P._expect is None:
+            # _synchronize found that P crashed.
+            P._start()
+
+    def eval(self, code, **kwds):
+        """
+        Evaluate code in an idle instance and return the output.
+
+        EXAMPLES::
+
+            sage: InterfacePool(Gap, 1).eval('2+3;')
+            '5'
+        """
+        P = self.checkout()
+        try:
+            return P.eval(code, **kwds)
+        finally:
+            self.checkin(P)
+
+    def map(self, f, inputs):
+        """
+        Return the list of f(P, x) for x in inputs, where P is an
+        instance of the pool.  The values are computed concurrently,
+        using up to size() instances.
+
+        Since the instances are separate processes, objects created in
+        one of them cannot be used in another one; f should return
+        Python objects or strings rather than interface elements.  If
+        f raises an exception for some input, the exception for the
+        first such input is raised once all computations are done.
+        Pressing Ctrl-C interrupts all instances.
+
+        EXAMPLES::
+
+            sage: P = InterfacePool(Gap, 2)
+            sage: P.map(lambda G, n: G('Size(SymmetricGroup(%s))'%n).sage(), [3, 4, 5])
+            [6, 24, 120]
+        """
+        inputs = list(inputs)
+        tasks = Queue.Queue()
+        for i in range(len(inputs)):
+            tasks.put(i)
+        results = [None]*len(inputs)
+        errors = {}
+        busy = []
+
+        def worker():
+            try:
+                P = self.checkout()
+            except Exception:
+                errors[-1] = sys.exc_info()
+                return
+            busy.append(P)
+            try:
+                while True:
+                    try:
+                        i = tasks.get_nowait()
+                    except Queue.Empty:
+                        return
+                    try:
+                        results[i] = f(P, inputs[i])
+                    except Exception:
+                        errors[i] = sys.exc_info()
+            finally:
+                busy.remove(P)
+                self.checkin(P)
+
+        threads = []
+        for _ in range(min(self.__size, len(inputs))):
+            T = threading.Thread(target=worker)
+            T.setDaemon(True)
+            T.start()
+            threads.append(T)
+        try:
+            for T in threads:
+                # Join with a timeout, so that Ctrl-C is noticed.
+                while T.isAlive():
+                    T.join(0.1)
+        except KeyboardInterrupt:
+            while True:
+                try:
+                    tasks.get_nowait()
+                except Queue.Empty:
+                    break
+            for P in list(busy):
+                P.interrupt()
+            raise KeyboardInterrupt, "Ctrl-c pressed while running %s"%self
+        if errors:
+            e = errors[min(errors.keys())]
+            raise e[0], e[1], e[2]
+        return results
+
+    def quit(self):
+        """
+        Quit all idle instances of this pool.
+
+        EXAMPLES::
+
+            sage: P = InterfacePool(Gap, 1)
+            sage: P.eval('1;')
+            '1'
+            sage: P.quit(); P.instances()[0].is_running()
+            False
+        """
+        idle = []
+        while True:
+            try:
+                idle.append(self.__idle.get_nowait())
+            except Queue.Empty:
+                break
+        for P in idle:
+            P.quit()
+            self.__idle.put(P)
@@ -10,7 +10,8 @@ PSage print <<currently executing code>> until code execution
 completes, when they print as normal.
 
 \note{BUG -- currently non-idle PSage subprocesses do not stop when
-\sage exits.  I would very much like to fix this but don't know how.}
+\sage exits.  I would very much like to fix this but don't know how.
+ParallelSage, described below, does not have this problem.}
 
 EXAMPLES:
 We illustrate how to factor 3 integers in parallel.
@@ -36,9 +37,21 @@ finished:
     [3 * 11 * 31^2 * 311 * 11161 * 11471 * 73471 * 715827883 * 2147483647 * 4649919401 * 18158209813151 * 5947603221397891 * 29126056043168521,
      23^2 * 47 * 89 * 178481 * 4103188409 * 199957736328435366769577 * 44667711762797798403039426178361,
      9623 * 68492481833 * 23579543011798993222850893929565870383844167873851502677311057483194673]
+
+A ParallelSage runs code in a bounded number of \sage subprocesses
+and returns a future for each piece of submitted code, whose result
+is sent back pickled once it is known:
+
+    sage: S = ParallelSage(2)
+    sage: futures = [S.submit('factor(2^%s-1)'%n) for n in [32, 64]]
+    sage: [f.result() for f in futures]
+    [3 * 5 * 17 * 257 * 65537, 3 * 5 * 17 * 257 * 641 * 65537 * 6700417]
+    sage: len(list(S.as_completed(futures)))
+    2
+    sage: S.shutdown()
 """
 
-import os, time
+import os, time, signal, threading, Queue, cPickle, traceback
 
 from sage0 import Sage, SageElement
 from expect import Expect
@@ -158,3 +171,445 @@ class PSage(Sage):
 class PSageElement(SageElement):
     def is_locked(self):
         return self.parent().is_locked()
+
+
+######################################################################
+# Futures
+######################################################################
+
+PENDING = 'pending'
+RUNNING = 'running'
+FINISHED = 'finished'
+CANCELLED = 'cancelled'
+
+class SageFuture:
+    """
+    The result of code submitted to a ParallelSage, which becomes
+    available once a \\sage subprocess has computed it.
+    """
+    def __init__(self, executor, task):
+        self._executor = executor
+        self._task = task
+        self._state = PENDING
+        self._result = None
+        self._exception = None
+        self._instance = None
+        self._callbacks = []
+        self._condition = threading.Condition()
+
+    def __repr__(self):
+        return '<SageFuture %s>'%self._state
+
+    def running(self):
+        """
+        Return True if the code is being evaluated right now.
+        """
+        return self._state == RUNNING
+
+    def done(self):
+        """
+        Return True if the code was evaluated or cancelled.
+        """
+        return self._state in (FINISHED, CANCELLED)
+
+    def cancelled(self):
+        """
+        Return True if the evaluation was cancelled.
+        """
+        return self._state == CANCELLED
+
+    def cancel(self):
+        """
+        Cancel the evaluation.  Pending code is never run; code that
+        is running is interrupted in its subprocess.
+
+        OUTPUT:
+            bool -- False if the evaluation had already finished
+
+        EXAMPLES:
+            sage: S = ParallelSage(1)
+            sage: f = S.submit('sleep(100)')
+            sage: f.cancel()
+            True
+            sage: f.cancelled()
+            True
+            sage: S.submit('1+1').result()
+            2
+        """
+        self._condition.acquire()
+        try:
+            if self._state == FINISHED:
+                return False
+            if self._state == CANCELLED:
+                return True
+            if self._state == PENDING:
+                self._set_done(CANCELLED)
+                return True
+            # Running: interrupt the subprocess; the worker marks the
+            # future as cancelled once the subprocess is back at its
+            # prompt.
+            self._state = CANCELLED
+            P = self._instance
+        finally:
+            self._condition.release()
+        if P is not None:
+            P._interrupt_task()
+        return True
+
+    def result(self, timeout=None):
+        """
+        Return the value of the code, waiting at most timeout seconds
+        (forever if timeout is None) for it to be computed.  If the code
+        raised an exception, that exception is raised here.
+        """
+        self._wait(timeout)
+        if self._state == CANCELLED:
+            raise RuntimeError, "the evaluation was cancelled"
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        """
+        Return the exception raised by the code, or None if it
+        succeeded, waiting at most timeout seconds for it to finish.
+        """
+        self._wait(timeout)
+        if self._state == CANCELLED:
+            raise RuntimeError, "the evaluation was cancelled"
+        return self._exception
+
+    def _wait(self, timeout):
+        if timeout is not None:
+            end = time.time() + timeout
+        self._condition.acquire()
+        try:
+            while not self._finished():
+                # Wait in pieces, so that Ctrl-C is noticed.
+                wait = 0.1
+                if timeout is not None:
+                    wait = min(end - time.time(), wait)
+                    if wait <= 0:
+                        raise RuntimeError, "no result within %s seconds"%timeout
+                self._condition.wait(wait)
+        finally:
+            self._condition.release()
+
+    def _finished(self):
+        # A future cancelled while running is not finished until its
+        # subprocess has stopped.
+        return self.done() and self._instance is None
+
+    def _add_done_callback(self, f):
+        self._condition.acquire()
+        try:
+            if not self._finished():
+                self._callbacks.append(f)
+                return
+        finally:
+            self._condition.release()
+        f(self)
+
+    def _start(self, P):
+        """
+        Mark the future as running in P and return True, or return
+        False if it was cancelled.
+        """
+        self._condition.acquire()
+        try:
+            if self._state != PENDING:
+                return False
+            self._state = RUNNING
+            self._instance = P
+            return True
+        finally:
+            self._condition.release()
+
+    def _set_done(self, state, result=None, exception=None):
+        self._condition.acquire()
+        try:
+            if self._state != CANCELLED:
+                self._state = state
+                self._result = result
+                self._exception = exception
+            self._instance = None
+            callbacks = self._callbacks
+            self._callbacks = []
+            self._condition.notifyAll()
+        finally:
+            self._condition.release()
+        for f in callbacks:
+            f(self)
+
+def as_completed(futures, timeout=None):
+    """
+    Iterate over the futures in the order in which they finish.
+
+    INPUT:
+        futures -- list of SageFuture objects
+        timeout -- None or number of seconds; a RuntimeError is raised
+                   if not all futures finished within timeout seconds
+
+    EXAMPLES:
+        sage: from sage.interfaces.psage import as_completed
+        sage: S = ParallelSage(2)
+        sage: F = [S.submit('(sleep(1), 1)[1]'), S.submit('2')]
+        sage: [f.result() for f in as_completed(F)]
+        [2, 1]
+    """
+    futures = list(futures)
+    done = Queue.Queue()
+    for f in futures:
+        f._add_done_callback(done.put)
+    if timeout is not None:
+        end = time.time() + timeout
+    for i in range(len(futures)):
+        while True:
+            if timeout is None:
+                wait = 0.1
+            else:
+                wait = min(end - time.time(), 0.1)
+                if wait <= 0:
+                    raise RuntimeError, "%s of %s futures did not finish within %s seconds"%(
+                        len(futures) - i, len(futures), timeout)
+            try:
+                yield done.get(True, wait)
+                break
+            except Queue.Empty:
+                pass
+
+######################################################################
+# The executor
+######################################################################
+
+class ParallelSage:
+    """
+    Evaluate code in at most a given number of \\sage subprocesses at
+    the same time.
+    """
+    def __init__(self, workers=None, **kwds):
+        """
+        INPUT:
+            workers -- integer (default: the number of processors); the
+                       number of subprocesses
+            **kwds -- passed on to Sage when a subprocess is started
+
+        Subprocesses are started when they are first needed, and they
+        are restarted if they crash.
+        """
+        from pool import InterfacePool, ncpus
+        if kwds.has_key('server'):
+            raise NotImplementedError, "ParallelSage doesn't work on remote server yet."
+        if workers is None:
+            workers = ncpus()
+        self.__pool = InterfacePool(_TaskSage, workers, **kwds)
+        self.__workers = []
+        self.__tasks = Queue.Queue()
+        self.__lock = threading.Lock()
+        self.__shutdown = False
+
+    def __repr__(self):
+        return 'Parallel Sage with %s workers'%self.__pool.size()
+
+    def submit(self, code, *args, **kwds):
+        """
+        Start evaluating code in a subprocess and return a future for
+        its value.
+
+        INPUT:
+            code -- either a string, which is evaluated as a \\sage
+                    expression, or a function, which is called with
+                    the remaining arguments; in the second case the
+                    function and its arguments must be picklable,
+                    e.g., a function defined at the top level of a
+                    module
+
+        EXAMPLES:
+            sage: S = ParallelSage(2)
+            sage: S.submit('2^10').result()
+            1024
+            sage: S.submit(factorial, 5).result()
+            120
+            sage: S.submit('1/0').result()
+            Traceback (most recent call last):
+            ...
+            ZeroDivisionError: Rational division by zero
+        """
+        if isinstance(code, str):
+            if args or kwds:
+                raise TypeError, "arguments can only be given with a function"
+            task = ('eval', code)
+        else:
+            task = ('call', code, args, kwds)
+        self.__lock.acquire()
+        try:
+            if self.__shutdown:
+                raise RuntimeError, "cannot submit code after shutdown"
+            future = SageFuture(self, cPickle.dumps(task, 2))
+            self.__tasks.put(future)
+            if len(self.__workers) < self.__pool.size():
+                T = threading.Thread(target=self._worker)
+                T.setDaemon(True)
+                T.start()
+                self.__workers.append(T)
+        finally:
+            self.__lock.release()
+        return future
+
+    def as_completed(self, futures, timeout=None):
+        """
+        Iterate over the futures in the order in which they finish.
+        See as_completed in this module.
+        """
+        return as_completed(futures, timeout)
+
+    def map(self, f, inputs, timeout=None):
+        """
+        Iterate over the values of f(x) for x in inputs, in order, as
+        soon as each of them is known.  The values are computed in
+        parallel.
+
+        INPUT:
+            f -- a picklable function, or a string such as
+                 'factor(%s)', into which each input is substituted
+            inputs -- an iterable
+            timeout -- None or total number of seconds to wait
+
+        EXAMPLES:
+            sage: S = ParallelSage(2)
+            sage: list(S.map('%s^2', [1,2,3]))
+            [1, 4, 9]
+        """
+        if isinstance(f, str):
+            futures = [self.submit(f%(x,)) for x in inputs]
+        else:
+            futures = [self.submit(f, x) for x in inputs]
+        if timeout is not None:
+            end = time.time() + timeout
+        try:
+            for F in futures:
+                if timeout is None:
+                    yield F.result()
+                else:
+                    yield F.result(max(0, end - time.time()))
+        finally:
+            for F in futures:
+                F.cancel()
+
+    def shutdown(self, wait=True):
+        """
+        Cancel all pending evaluations and stop the subprocesses once
+        the running ones are done (or right away, interrupting them,
+        if wait is False).
+        """
+        self.__lock.acquire()
+        try:
+            self.__shutdown = True
+            workers = list(self.__workers)
+        finally:
+            self.__lock.release()
+        while True:
+            try:
+                F = self.__tasks.get_nowait()
+            except Queue.Empty:
+                break
+            F.cancel()
+        for T in workers:
+            self.__tasks.put(None)
+        if not wait:
+            for P in self.__pool.instances():
+                P._interrupt_task()
+        for T in workers:
+            while T.isAlive():
+                T.join(0.1)
+        self.__pool.quit()
+
+    def _worker(self):
+        while True:
+            F = self.__tasks.get()
+            if F is None:
+                return
+            if F.done():
+                continue
+            try:
+                P = self.__pool.checkout()
+            except Exception, msg:
+                F._set_done(FINISHED, exception=msg)
+                continue
+            try:
+                if F._start(P):
+                    try:
+                        F._set_done(FINISHED, *P._run_task(F._task))
+                    except Exception, msg:
+                        F._set_done(FINISHED, exception=msg)
+            finally:
+                self.__pool.checkin(P)
+
+class _TaskSage(Sage):
+    """
+    A \\sage subprocess that runs the tasks of a ParallelSage.
+    """
+    def _task_files(self):
+        base = self._local_tmpfile()
+        return base + '.task', base + '.result'
+
+    def _run_task(self, task):
+        """
+        Run the pickled task and return a pair (result, exception).
+        """
+        task_file, result_file = self._task_files()
+        open(task_file, 'wb').write(task)
+        if os.path.exists(result_file):
+            os.unlink(result_file)
+        out = self.eval('from sage.interfaces.psage import _run_task; _run_task("%s", "%s")'%(
+            task_file, result_file))
+        try:
+            data = open(result_file, 'rb').read()
+        except IOError:
+            raise RuntimeError, "the evaluation did not finish:\n%s"%out
+        os.unlink(result_file)
+        ok, value = cPickle.loads(data)
+        if ok:
+            return value, None
+        return None, value
+
+    def _interrupt_task(self):
+        """
+        Interrupt the computation running in the subprocess, like
+        pressing Ctrl-C in it would.
+        """
+        E = self._expect
+        if E is not None:
+            try:
+                os.killpg(E.pid, signal.SIGINT)
+            except OSError:
+                pass
+
+def _run_task(task_file, result_file):
+    """
+    Run the task pickled in task_file and pickle a pair (True, value)
+    or (False, exception) to result_file.  This is called in the
+    subprocesses of a ParallelSage.
+    """
+    from sage.misc.sage_eval import sage_eval
+    task = cPickle.loads(open(task_file, 'rb').read())
+    try:
+        if task[0] == 'eval':
+            value = sage_eval(task[1])
+        else:
+            value = task[1](*task[2], **task[3])
+        result = (True, value)
+    except Exception, msg:
+        result = (False, msg)
+    try:
+        data = cPickle.dumps(result, 2)
+    except Exception:
+        # The value or exception cannot be pickled.
+        if result[0]:
+            result = (False, RuntimeError("the result cannot be pickled: %r"%(result[1],)))
+        else:
+            result = (False, RuntimeError(''.join(traceback.format_exception_only(type(msg), msg)).strip()))
+        data = cPickle.dumps(result, 2)
+    tmp = result_file + '.tmp'
+    open(tmp, 'wb').write(data)
+    os.rename(tmp, result_file)
@@ -4,6 +4,10 @@ import os, time, pexpect
 
 expect_objects = []
 
+# Processes started ahead of time by Expect._prestart, as pairs
+# (pexpect object, whether its prompt has been read).
+spare_processes = {}
+
 def expect_quitall(verbose=False):
     for P in expect_objects:
         R = P()
@@ -13,8 +17,24 @@ def expect_quitall(verbose=False):
                 pass
             except RuntimeError:
                 pass
+    for E, ready in spare_processes.values():
+        close_spare(E)
+    spare_processes.clear()
     kill_spawned_jobs()
 
+def close_spare(E):
+    """
+    Kill the spare process controlled by the pexpect object E.
+    """
+    try:
+        os.killpg(E.pid, 9)
+    except OSError:
+        pass
+    try:
+        E.close()
+    except Exception:
+        pass
+
 def kill_spawned_jobs():
     file = '%s/tmp/%s/spawned_processes'%(os.environ['DOT_SAGE'], os.getpid())
     if not os.path.exists(file):
@@ -807,6 +807,20 @@ class R(Expect):
         #return self._remove_indices_re.sub("", s).strip()
         return s
 
+    def _write_to_file_command(self, var):
+        """
+        Returns the R command that writes what get returns for var to
+        a file.
+
+        EXAMPLES:
+            sage: r._write_to_file_command('a')
+            'capture.output(print(a), file="%s")'
+            sage: r.set('a', 2)
+            sage: r.get_using_file('a')
+            '[1] 2'
+        """
+        return 'capture.output(print(%s), file="%%s")'%var
+
     def na(self):
         """
         Returns the NA in R.
@@ -1571,11 +1585,14 @@ class RElement(ExpectElement):
         # This is the core of the trick: using dput 
         # dput prints out the internal structure of R's data elements
         # options via .deparseOpts(control=...)
-        # TODO: dput also works with a file, if things get huge!
-        # [[However, using a file for output often isn't necessary
-        # since pipe buffering works pretty well for output.
-        # That said, benchmark this.  -- William Stein]]
-        exp = P.eval('dput(%s)'%self.name())
+        # Large objects are written to a file, which is much faster
+        # than reading them through the pseudo-tty.
+        if self._get_using_file:
+            exp = P._eval_to_file('dput(%s, file="%%s")'%self.name())
+        else:
+            exp = P.eval('dput(%s)'%self.name())
+            if len(exp) > P._file_transfer_cutoff:
+                self._get_using_file = True
 
         # Preprocess expression
         # example what this could be:
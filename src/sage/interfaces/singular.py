@@ -303,7 +303,7 @@ TESTS: We test an automatic coercion::
 
 import os, re
 
-from expect import Expect, ExpectElement, FunctionElement, ExpectFunction
+from expect import Expect, ExpectElement, FunctionElement, ExpectFunction, _batch_commands
 
 from sage.structure.sequence import Sequence
 
@@ -357,7 +357,6 @@ class Singular(Expect):
                         eval_using_file_cutoff=100 if os.uname()[0]=="SunOS" else 1000)
         self.__libs  = []
         self._prompt_wait = prompt
-        self.__to_clear = []   # list of variable names that need to be cleared.
 
     def _start(self, alt_message=None):
         """
@@ -518,14 +517,10 @@ class Singular(Expect):
             sage: set_verbose(0)
             sage: o = s.hilb()
         """
-        # Syncrhonize the interface and clear any variables that are queued up to 
-        # be cleared.
+        # Synchronize the interface.  Variables that are queued up to be
+        # cleared are cleared by Expect.eval.
         self._synchronize()
-        if len(self.__to_clear) > 0:
-            for var in self.__to_clear:
-                self._eval_line('if(defined(%s)>0){kill %s;};'%(var,var), wait_for_prompt=True)
-            self.__to_clear = []
-        
+
         # Uncomment the print statements below for low-level debuging of
         # code that involves the singular interfaces.  Everything goes
         # through here. 
@@ -551,6 +546,23 @@ class Singular(Expect):
         else:
             return s
 
+    def _pipeline_marker_command(self, n):
+        """
+        Return a command that prints the marker used to separate the
+        outputs of lines in pipelined evaluation.
+        
+        This makes it possible to send many lines at once::
+        
+            sage: singular.eval('int a = 2;\na + 3;\na * 5;', pipeline=True)
+            '\n5\n10'
+        
+        EXAMPLES::
+        
+            sage: singular._pipeline_marker_command(5)
+            '"__SAGE_PIPE_"+string(4+1)+"__";'
+        """
+        return '"__SAGE_PIPE_"+string(%s+1)+"__";'%(n-1)
+
     def set(self, type, name, value):
         """
         Set the variable with given name to the given value.
@@ -578,6 +590,21 @@ class Singular(Expect):
             '2'
         """
         return self.eval('print(%s);'%var)
+
+    def _write_to_file_command(self, var):
+        """
+        Return the command used to write the variable var to a file,
+        formatted as by print.
+        
+        EXAMPLES::
+        
+            sage: singular._write_to_file_command('x')
+            'write(":w %s", print(x, "%%p"));'
+            sage: singular.set('int', 'x', '2^20')
+            sage: singular.get_using_file('x')
+            '1048576'
+        """
+        return 'write(":w %%s", print(%s, "%%%%p"));'%var
         
     def clear(self, var):
         """
@@ -597,7 +624,20 @@ class Singular(Expect):
         # the interface at the same time we do garbage collection, which can
         # lead to subtle problems.    This was Willem Jan's ideas, implemented
         # by William Stein.
-        self.__to_clear.append(var)
+        Expect.clear(self, var)
+
+    def _clear_commands(self, vars):
+        """
+        Return the commands that kill the variables in the list vars
+        (see Expect.clear).
+        
+        EXAMPLES::
+        
+            sage: singular._clear_commands(['sage1', 'sage2'])
+            ['if(defined(sage1)>0){kill sage1;};if(defined(sage2)>0){kill sage2;};']
+        """
+        return _batch_commands(['if(defined(%s)>0){kill %s;};'%(v,v) for v in vars], '%s', '',
+                               self._eval_using_file_cutoff)
 
     def _create(self, value, type='def'):
         """
@@ -1140,11 +1180,7 @@ class SingularElement(ExpectElement):
             self._check_valid()
         except ValueError:
             return '(invalid object -- defined in terms of closed session)'
-        try:
-            if self._get_using_file:
-                s = self.parent().get_using_file(self._name)
-        except AttributeError:
-            s = self.parent().get(self._name)
+        s = self._get()
         if s.__contains__(self._name):
             if hasattr(self, '__custom_name'):
                 s =  s.replace(self._name, self.__dict__['__custom_name'])
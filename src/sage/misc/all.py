@@ -52,7 +52,8 @@ from classgraph import class_graph
 
 from reset import reset, restore
 
-from getusage import top, get_memory_usage
+from getusage import (top, get_memory_usage, get_peak_memory_usage,
+                      get_resident_memory_usage, reset_peak_memory_usage)
 
 from log import log_html, log_dvi, log_text
 
@@ -169,10 +170,11 @@ def benchmark(n=-1):
     takes for each to run.
 
     INPUT:
-        n -- int (default: -1) the benchmark number; the default
+        n -- string, integer from 0 to 7, or list of them (default: -1)
+             the names or old numbers of the benchmarks; the default
              of -1 runs all the benchmarks.
     OUTPUT:
-        list -- summary of timings for each benchmark.
+        dict -- the results, see sage.misc.benchmark.run_benchmarks
     """
     import sage.misc.benchmark
     return sage.misc.benchmark.benchmark(n)
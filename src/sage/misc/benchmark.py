@@ -1,205 +1,460 @@
-from misc import cputime
+r"""
+Benchmarks
 
-from sage.all import *
+This module runs a registered set of benchmarks of Sage, each at one
+or more problem sizes, and records how long they take and how much
+memory they use, so that runs on different versions of Sage or
+different machines can be compared.
 
-def benchmark(n=-1):
+Each benchmark is first run ``warmup`` times without being timed.  Then,
+as with ``timeit``, it is called in a loop of as many calls as needed
+to take at least ``min_time`` seconds, and the loop is timed
+``repeat`` times.  The minimum, median, mean and standard deviation of
+the CPU and wall time of a call are recorded, as well as the growth of
+the memory usage and the peak resident memory of the process while
+the benchmark ran.  The peak is only known where it can be reset
+before each benchmark (on Linux 4.0 and later); elsewhere it is
+recorded as None.
+
+The results can be written to a file as JSON, and two such files
+compared with :func:`compare_benchmarks`, which flags the benchmarks
+that got slower by more than a given fraction.
+
+EXAMPLES::
+
+    sage: from sage.misc.benchmark import register_benchmark, run_benchmarks, compare_benchmarks
+    sage: register_benchmark('sum_range', lambda n: lambda: sum(range(n)),
+    ...       sizes=[10^3, 10^4], description='Sum of range(n)')
+    sage: F = tmp_filename() + '.json'
+    sage: R = run_benchmarks(['sum_range'], filename=F, verbose=False)
+    sage: sorted(R['results'].keys())
+    ['sum_range:1000', 'sum_range:10000']
+    sage: R['results']['sum_range:1000']['cpu_seconds']['min']    # random
+    2.1e-05
+    sage: _ = compare_benchmarks(F, F)
+    benchmark                                 old          new   ratio
+    sum_range:1000                     ...    1.00
+    sum_range:10000                    ...    1.00
+    0 regressions, 0 improvements
+"""
+
+#############################################################################
+#       Copyright (C) 2009 William Stein <wstein@gmail.com>
+#  Distributed under the terms of the GNU General Public License (GPL)
+#  The full text of the GPL is available at:
+#                  http://www.gnu.org/licenses/
+#############################################################################
+
+import gc
+import os
+import time
+
+from misc import cputime, walltime
+from getusage import get_memory_usage, get_peak_memory_usage, reset_peak_memory_usage
+
+class Benchmark:
+    """
+    A benchmark: setup(size) prepares the problem of the given size
+    and returns a function of no arguments that solves it, which is
+    what is timed.
     """
-    Run a well-chosen range of SAGE commands and record the time it
-    takes for each to run.
+    def __init__(self, name, setup, sizes, description):
+        self.name = name
+        self.setup = setup
+        self.sizes = list(sizes)
+        self.description = description
 
-    INPUT:
-        n -- int (default: -1) the benchmark number; the default
-             of -1 runs all the benchmarks.
-    OUTPUT:
-        list -- summary of timings for each benchmark.
-        int -- if n == -1, also return the total time
-
-    EXAMPLE:
-        sage: from sage.misc.benchmark import *
-        sage: _ = benchmark()
-        Running benchmark 0
-        Benchmark 0: Factor the following polynomial over
-            the rational numbers: (x^97+19*x+1)*(x^103-19*x^97+14)*(x^100-1)
-        Time: ... seconds
-        Running benchmark 1
-        Find the Mordell-Weil group of the elliptic curve 5077A using mwrank
-        Time: ... seconds
-        Running benchmark 2
-        Some basic arithmetic with very large Integer numbers: '3^1000001 * 19^100001
-        Time: ... seconds
-        Running benchmark 3
-        Some basic arithmetic with very large Rational numbers: '(2/3)^100001 * (17/19)^100001
-        Time: ... seconds
-        Running benchmark 4
-        Rational polynomial arithmetic using SAGE. Compute (x^29+17*x-5)^200.
-        Time: ... seconds
-        Running benchmark 5
-        Rational polynomial arithmetic using SAGE. Compute (x^19 - 18*x + 1)^50 one hundred times.
-        Time: ... seconds
-        Running benchmark 6
-        Compute the p-division polynomials of y^2 = x^3 + 37*x - 997 for primes p < 40.
-        Time: ... seconds
-        Running benchmark 7
-        Compute the Mordell-Weil group of y^2 = x^3 + 37*x - 997.
-        Time: ... seconds
-        Running benchmark 8
-
-    """
-
-    if isinstance(n, list):
-        t = cputime()
-        v = [benchmark(m) for m in n]
-        return v, cputime(t)
-
-    if n != -1:
-        print "Running benchmark %s"%n
-        try:
-            desc, t = eval("bench%s()"%n)
-        except NameError:
-            raise RuntimeError, "no benchmark %s"%n        
-        print desc
-        print "Time: %s seconds"%t        
-        return (n, t, desc)
-
-    t = cputime()
-    m = 0
-    v = []
-    while True:
-        try:
-            v.append(benchmark(m))
-            m += 1
-        except RuntimeError:
-            break
-    return v, cputime(t)
+    def __repr__(self):
+        return 'Benchmark %s: %s'%(self.name, self.description)
 
-def bench0():
+# The registered benchmarks, by name.
+_benchmarks = {}
+
+# The name and size of the benchmarks that were numbered 0 to 7 in
+# older versions of Sage.
+NUMBERED_BENCHMARKS = [('factor_polynomial', 97), ('mwrank_5077a', None),
+                       ('integer_power', 10**6), ('rational_power', 10**5),
+                       ('polynomial_power', 200), ('polynomial_powers', 100),
+                       ('division_polynomials', 40), ('elliptic_curve_gens', None)]
+
+def register_benchmark(name, setup, sizes=[None], description=''):
     """
-    Run a benchmark.
+    Register a benchmark, replacing any benchmark with the same name.
+
+    INPUT:
 
-    BENCHMARK:
-        sage: from sage.misc.benchmark import *
-        sage: print bench0()[0]  
-        Benchmark 0: Factor the following polynomial over
-            the rational numbers: (x^97+19*x+1)*(x^103-19*x^97+14)*(x^100-1)
+    - ``name`` - string
 
+    - ``setup`` - a function that takes a size and returns a function
+      of no arguments to be timed
+
+    - ``sizes`` - list (default: [None]); the sizes at which the
+      benchmark is run by default
+
+    - ``description`` - string (default: '')
+
+    EXAMPLES::
+
+        sage: from sage.misc.benchmark import register_benchmark, benchmarks
+        sage: register_benchmark('empty', lambda n: lambda: None, description='Nothing')
+        sage: benchmarks()['empty']
+        Benchmark empty: Nothing
     """
-    desc = """Benchmark 0: Factor the following polynomial over
-    the rational numbers: (x^97+19*x+1)*(x^103-19*x^97+14)*(x^100-1)"""
-    x = polygen(QQ,"x")
-    f = (x**97+19*x+1)*(x**103-19*x**97+14)*(x**100-1)
-    t = cputime()
-    F = f.factor()
-    return (desc, cputime(t))
+    _benchmarks[name] = Benchmark(name, setup, sizes, description)
 
-def bench1():
+def benchmarks():
     """
-    Run a benchmark.
+    Return a dictionary of the registered benchmarks, by name.
 
-    BENCHMARK:
-        sage: from sage.misc.benchmark import *
-        sage: print bench1()[0]
-        Find the Mordell-Weil group of the elliptic curve 5077A using mwrank
+    EXAMPLES::
 
+        sage: from sage.misc.benchmark import benchmarks
+        sage: benchmarks()['integer_power']
+        Benchmark integer_power: Compute 3^n * 19^(n/10) using Integers
     """
-    desc = """Find the Mordell-Weil group of the elliptic curve 5077A using mwrank"""
-    E = mwrank_EllipticCurve([0, 0, 1, -7, 6])
-    t = cputime()
-    g = E.gens()
-    return (desc, cputime(t))
+    return dict(_benchmarks)
 
-def bench2():
+def run_benchmarks(names=None, sizes=None, repeat=5, warmup=1, min_time=0.2,
+                   filename=None, verbose=True):
     """
-    Run a benchmark.
+    Run benchmarks and return their results.
+
+    INPUT:
+
+    - ``names`` - list of strings (default: all registered benchmarks)
+
+    - ``sizes`` - dictionary (default: None); the list of sizes at
+      which to run a benchmark can be given here by its name, instead
+      of the sizes it was registered with
+
+    - ``repeat`` - integer (default: 5); number of timed loops
 
-    BENCHMARK:
-        sage: from sage.misc.benchmark import *
-        sage: print bench2()[0]
-        Some basic arithmetic with very large Integer numbers: '3^1000001 * 19^100001
+    - ``warmup`` - integer (default: 1); number of calls before the
+      timed loops
 
+    - ``min_time`` - number (default: 0.2); seconds that a timed loop
+      should take at least
+
+    - ``filename`` - string (default: None); if given, the results are
+      written to this file as JSON
+
+    - ``verbose`` - bool (default: True); print the results as they
+      are obtained
+
+    OUTPUT: a dictionary with the Sage version, date, host, the
+    parameters and, under 'results', a dictionary of the results of
+    each benchmark and size, keyed by 'name:size'.  Times are in
+    seconds per call and memory in megabytes.
     """
-    desc = """Some basic arithmetic with very large Integer numbers: '3^1000001 * 19^100001"""
-    t = cputime()
-    a = ZZ(3)**1000001 * ZZ(19)**100001
-    return (desc, cputime(t))    
+    from sage.version import version
+    if names is None:
+        names = _benchmarks.keys()
+        names.sort()
+    if sizes is None:
+        sizes = {}
+    results = {}
+    for name in names:
+        try:
+            B = _benchmarks[name]
+        except KeyError:
+            raise ValueError, "unknown benchmark '%s'"%name
+        for size in sizes.get(name, B.sizes):
+            key = '%s:%s'%(name, size)
+            if verbose:
+                print "Running %s"%key
+            results[key] = run_benchmark(B, size, repeat=repeat, warmup=warmup,
+                                         min_time=min_time)
+            if verbose:
+                _print_result(results[key])
+    R = {'sage_version': version,
+         'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+         'host': os.uname()[1],
+         'parameters': {'repeat': repeat, 'warmup': warmup, 'min_time': min_time},
+         'results': results}
+    if filename is not None:
+        from jsonify import jsonify
+        open(filename, 'w').write(jsonify(R, indent=2) + '\n')
+    return R
 
-def bench3():
+def run_benchmark(B, size, repeat=5, warmup=1, min_time=0.2):
     """
-    Run a benchmark.
+    Run the benchmark B at the given size and return a dictionary of
+    results.  See :func:`run_benchmarks` for the meaning of the other
+    arguments.
+    """
+    memory = _memory_usage()
+    peak = reset_peak_memory_usage()
+    f = B.setup(size)
+    for i in range(warmup):
+        f()
+    number = 1
+    while True:
+        t = _time_loop(f, number)[1]
+        if t >= min_time or number >= 10**6:
+            break
+        number *= 5
+    cpu = []
+    wall = []
+    for i in range(repeat):
+        c, w = _time_loop(f, number)
+        cpu.append(c/number)
+        wall.append(w/number)
+    R = {'name': B.name, 'size': size, 'description': B.description,
+         'number': number, 'repeat': repeat,
+         'cpu_seconds': statistics(cpu), 'wall_seconds': statistics(wall)}
+    if memory is not None:
+        R['memory_mb'] = _memory_usage() - memory
+        if peak:
+            R['peak_memory_mb'] = get_peak_memory_usage()
+        else:
+            # The peak of the whole process says nothing about
+            # this benchmark.
+            R['peak_memory_mb'] = None
+    return R
+
+def _time_loop(f, number):
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        c = cputime()
+        w = walltime()
+        for i in xrange(number):
+            f()
+        return cputime(c), walltime(w)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
 
-    BENCHMARK:
-        sage: from sage.misc.benchmark import *
-        sage: print bench3()[0]
-        Some basic arithmetic with very large Rational numbers: '(2/3)^100001 * (17/19)^100001
+def _memory_usage():
+    try:
+        return get_memory_usage()
+    except NotImplementedError:
+        return None
 
+def statistics(v):
     """
-    desc = """Some basic arithmetic with very large Rational numbers: '(2/3)^100001 * (17/19)^100001"""
-    t = cputime()
-    a = QQ('2/3')**100001 * QQ('17/19')**100001
-    return (desc, cputime(t))
+    Return a dictionary with the minimum, maximum, median, mean and
+    sample standard deviation of the list of numbers v.
 
-def bench4():
+    EXAMPLES::
+
+        sage: from sage.misc.benchmark import statistics
+        sage: sorted(statistics([3, 1, 2, 4]).items())
+        [('max', 4), ('mean', 2.5), ('median', 2.5), ('min', 1), ('stdev', 1.29099444873...)]
+    """
+    v = sorted(v)
+    n = len(v)
+    mean = sum(v)/float(n)
+    if n % 2:
+        median = v[n//2]
+    else:
+        median = (v[n//2 - 1] + v[n//2])/2.0
+    if n > 1:
+        stdev = (sum([(x - mean)**2 for x in v])/(n - 1))**0.5
+    else:
+        stdev = 0.0
+    return {'min': v[0], 'max': v[-1], 'mean': mean, 'median': median, 'stdev': stdev}
+
+def compare_benchmarks(old, new, threshold=0.1, key='cpu_seconds', verbose=True):
     """
-    Run a benchmark.
+    Compare two runs of the benchmarks and flag the ones that got
+    slower or faster by more than threshold.
+
+    INPUT:
+
+    - ``old``, ``new`` - dictionaries returned by
+      :func:`run_benchmarks`, or names of the JSON files it wrote
+
+    - ``threshold`` - number (default: 0.1); a benchmark whose
+      minimum time per call changed by a factor more than
+      1 + threshold is a regression or an improvement
+
+    - ``key`` - string (default: 'cpu_seconds'); 'cpu_seconds' or
+      'wall_seconds'
+
+    - ``verbose`` - bool (default: True); print the comparison
 
-    BENCHMARK:
-        sage: from sage.misc.benchmark import *
-        sage: print bench4()[0]
-        Rational polynomial arithmetic using SAGE. Compute (x^29+17*x-5)^200.
+    OUTPUT: a list of tuples (benchmark, old time, new time, ratio,
+    status), where status is 'regression', 'improvement' or 'same',
+    for the benchmarks in both runs.
 
+    EXAMPLES::
+
+        sage: from sage.misc.benchmark import compare_benchmarks
+        sage: old = {'results': {'a:1': {'cpu_seconds': {'min': 1.0}},
+        ...                      'b:1': {'cpu_seconds': {'min': 2.0}}}}
+        sage: new = {'results': {'a:1': {'cpu_seconds': {'min': 1.5}},
+        ...                      'b:1': {'cpu_seconds': {'min': 1.0}}}}
+        sage: compare_benchmarks(old, new)
+        benchmark                                 old          new   ratio
+        a:1                                1.0000e+00   1.5000e+00    1.50  REGRESSION
+        b:1                                2.0000e+00   1.0000e+00    0.50  improvement
+        1 regressions, 1 improvements
+        [('a:1', 1.0, 1.5, 1.5, 'regression'), ('b:1', 2.0, 1.0, 0.5, 'improvement')]
     """
-    desc = """Rational polynomial arithmetic using SAGE. Compute (x^29+17*x-5)^200."""
-    x = PolynomialRing(QQ, 'x').gen()
-    t = cputime()
-    f = x**29 + 17*x-5
-    a = f**200
-    return (desc, cputime(t))
+    if isinstance(old, basestring):
+        old = _load(old)
+    if isinstance(new, basestring):
+        new = _load(new)
+    keys = [k for k in old['results'].keys() if new['results'].has_key(k)]
+    keys.sort()
+    comparison = []
+    for k in keys:
+        a = old['results'][k][key]['min']
+        b = new['results'][k][key]['min']
+        ratio = b/max(a, 1e-12)
+        if ratio > 1 + threshold:
+            status = 'regression'
+        elif ratio < 1/(1 + float(threshold)):
+            status = 'improvement'
+        else:
+            status = 'same'
+        comparison.append((k, a, b, ratio, status))
+    if verbose:
+        print "%-32s %12s %12s %7s"%('benchmark', 'old', 'new', 'ratio')
+        for k, a, b, ratio, status in comparison:
+            flag = {'regression': '  REGRESSION', 'improvement': '  improvement', 'same': ''}[status]
+            print "%-32s %12.4e %12.4e %7.2f%s"%(k, a, b, ratio, flag)
+        print "%s regressions, %s improvements"%(
+            len([c for c in comparison if c[4] == 'regression']),
+            len([c for c in comparison if c[4] == 'improvement']))
+    return comparison
+
+def _load(filename):
+    from jsonify import unjsonify
+    return unjsonify(open(filename).read())
+
+def _print_result(R):
+    cpu = R['cpu_seconds']
+    print "    %s loops, best of %s: %.4g s per call (median %.4g s, stdev %.2g s)"%(
+        R['number'], R['repeat'], cpu['min'], cpu['median'], cpu['stdev'])
+    if R.has_key('memory_mb'):
+        if R['peak_memory_mb'] is None:
+            print "    memory growth %.1f MB"%R['memory_mb']
+        else:
+            print "    memory growth %.1f MB, peak resident memory %.1f MB"%(
+                R['memory_mb'], R['peak_memory_mb'])
 
-def bench5():
+def benchmark(n=-1):
     """
-    Run a benchmark.
+    Run all registered benchmarks, or those given by n, at their
+    default sizes and print the results.  This is the same as
+    :func:`run_benchmarks`, and is kept for backwards compatibility.
+
+    INPUT:
+
+    - ``n`` - a name, a number from 0 to 7 or a list of them
+      (default: -1, all benchmarks).  The numbers are those of the
+      benchmarks of older versions of Sage, which are run at the
+      size they used, given in ``NUMBERED_BENCHMARKS``.
 
-    BENCHMARK:
-        sage: from sage.misc.benchmark import *
-        sage: print bench5()[0]
-        Rational polynomial arithmetic using SAGE. Compute (x^19 - 18*x + 1)^50 one hundred times.
+    EXAMPLES::
 
+        sage: from sage.misc.benchmark import benchmark
+        sage: _ = benchmark('integer_power')    # long time
+        Running integer_power:10000
+        ...
+        sage: _ = benchmark(2)                  # long time
+        Running integer_power:1000000
+        ...
+        sage: benchmark(8)
+        Traceback (most recent call last):
+        ...
+        ValueError: no benchmark 8
     """
-    desc = """Rational polynomial arithmetic using SAGE. Compute (x^19 - 18*x + 1)^50 one hundred times."""
+    if n == -1:
+        return run_benchmarks()
+    if not isinstance(n, (list, tuple)):
+        n = [n]
+    names = []
+    sizes = {}
+    for m in n:
+        if isinstance(m, str):
+            name = m
+        else:
+            try:
+                if m < 0:
+                    raise IndexError
+                name, size = NUMBERED_BENCHMARKS[int(m)]
+            except (IndexError, TypeError, ValueError):
+                raise ValueError, "no benchmark %s"%m
+            sizes.setdefault(name, []).append(size)
+        if name not in names:
+            names.append(name)
+    return run_benchmarks(names, sizes)
+
+######################################################################
+# The benchmarks
+######################################################################
+
+def _factor_polynomial(n):
+    from sage.all import polygen, QQ
+    x = polygen(QQ, 'x')
+    f = (x**n + 19*x + 1)*(x**(n+6) - 19*x**n + 14)*(x**(n+3) - 1)
+    return f.factor
+
+register_benchmark('factor_polynomial', _factor_polynomial, [25, 50, 97],
+    'Factor (x^n+19*x+1)*(x^(n+6)-19*x^n+14)*(x^(n+3)-1) over the rational numbers')
+
+def _mwrank_gens(n):
+    from sage.all import mwrank_EllipticCurve
+    return lambda: mwrank_EllipticCurve([0, 0, 1, -7, 6]).gens()
+
+register_benchmark('mwrank_5077a', _mwrank_gens, [None],
+    'Find the Mordell-Weil group of the elliptic curve 5077A using mwrank')
+
+def _integer_power(n):
+    from sage.all import ZZ
+    a = ZZ(3)
+    b = ZZ(19)
+    m = n//10
+    return lambda: a**n * b**m
+
+register_benchmark('integer_power', _integer_power, [10**4, 10**5, 10**6],
+    'Compute 3^n * 19^(n/10) using Integers')
+
+def _rational_power(n):
+    from sage.all import QQ
+    a = QQ('2/3')
+    b = QQ('17/19')
+    return lambda: a**n * b**n
+
+register_benchmark('rational_power', _rational_power, [10**3, 10**4, 10**5],
+    'Compute (2/3)^n * (17/19)^n using Rationals')
+
+def _polynomial_power(n):
+    from sage.all import PolynomialRing, QQ
+    x = PolynomialRing(QQ, 'x').gen()
+    f = x**29 + 17*x - 5
+    return lambda: f**n
+
+register_benchmark('polynomial_power', _polynomial_power, [50, 100, 200],
+    'Compute (x^29+17*x-5)^n over the rational numbers')
+
+def _polynomial_powers(n):
+    from sage.all import PolynomialRing, QQ
     x = PolynomialRing(QQ, 'x').gen()
-    t = cputime()
     f = x**19 - 18*x + 1
-    w = [f**50 for _ in range(100)]
-    return (desc, cputime(t))
-           
-def bench6():
-    """
-    Run a benchmark.
+    return lambda: [f**50 for i in range(n)]
 
-    BENCHMARK:
-        sage: from sage.misc.benchmark import *
-        sage: print bench6()[0]
-        Compute the p-division polynomials of y^2 = x^3 + 37*x - 997 for primes p < 40.
+register_benchmark('polynomial_powers', _polynomial_powers, [10, 100],
+    'Compute (x^19-18*x+1)^50 over the rational numbers n times')
 
-    """
-    desc = """Compute the p-division polynomials of y^2 = x^3 + 37*x - 997 for primes p < 40."""
-    E = EllipticCurve([0,0,0,37,-997])
-    t = cputime()    
-    for p in [2,3,5,7,11,13,17,19,23,29,31,37]:
-        f = E.division_polynomial(p)
-    return (desc, cputime(t))
+def _division_polynomials(n):
+    from sage.all import EllipticCurve, prime_range
+    primes = prime_range(n)
+    def f():
+        # a new curve each time, since division polynomials are cached
+        E = EllipticCurve([0, 0, 0, 37, -997])
+        return [E.division_polynomial(p) for p in primes]
+    return f
 
-def bench7():
-    """
-    Run a benchmark.
+register_benchmark('division_polynomials', _division_polynomials, [20, 40],
+    'Compute the p-division polynomials of y^2 = x^3 + 37*x - 997 for primes p < n')
 
-    BENCHMARK:
-        sage: from sage.misc.benchmark import *
-        sage: print bench7()[0]
-        Compute the Mordell-Weil group of y^2 = x^3 + 37*x - 997.
+def _elliptic_curve_gens(n):
+    from sage.all import EllipticCurve
+    return lambda: EllipticCurve([0, 0, 0, 37, -997]).gens()
 
-    """
-    desc = """Compute the Mordell-Weil group of y^2 = x^3 + 37*x - 997."""
-    E = EllipticCurve([0,0,0,37,-997])
-    t = cputime()    
-    G = E.gens()
-    return (desc, cputime(t))
+register_benchmark('elliptic_curve_gens', _elliptic_curve_gens, [None],
+    'Compute the Mordell-Weil group of y^2 = x^3 + 37*x - 997')
@@ -1,5 +1,9 @@
 """
-A weakref cache factory
+Caches
+
+A weakref cache factory, and caches of bounded size or lifetime, in
+memory or in a file on disk, which are used as backends by
+:func:`~sage.misc.cachefunc.cached_function`.
 """
 
 #*****************************************************************************
@@ -10,7 +14,13 @@ A weakref cache factory
 #                  http://www.gnu.org/licenses/
 #*****************************************************************************
 
+import cPickle
+import os
+import time
 import weakref
+from collections import deque
+from cStringIO import StringIO
+from hashlib import sha1
 
 class Cache:
     """
@@ -83,3 +93,517 @@ class Cache:
         
 
 
+
+class LRUCache:
+    """
+    A dictionary that holds at most a given number of entries; when it
+    is full, the entry that was used least recently is dropped.
+
+    EXAMPLES:
+        sage: from sage.misc.cache import LRUCache
+        sage: C = LRUCache(2)
+        sage: C['a'] = 1; C['b'] = 2
+        sage: C['a']
+        1
+        sage: C['c'] = 3
+        sage: C.keys()
+        ['c', 'a']
+        sage: 'b' in C
+        False
+    """
+    def __init__(self, maxsize=128):
+        """
+        INPUT:
+            maxsize -- positive integer; the maximal number of entries
+        """
+        if maxsize < 1:
+            raise ValueError, "maxsize must be positive"
+        self.__maxsize = maxsize
+        self.__evictions = 0
+        self.clear()
+
+    def clear(self):
+        """
+        Remove all entries.
+        """
+        # Entries are kept in a circular doubly linked list of nodes
+        # [previous, next, key, value], most recently used first.
+        self.__nodes = {}
+        self.__root = root = [None, None, None, None]
+        root[0] = root[1] = root
+
+    def maxsize(self):
+        """
+        Return the maximal number of entries.
+        """
+        return self.__maxsize
+
+    def evictions(self):
+        """
+        Return the number of entries dropped to make room for others.
+        """
+        return self.__evictions
+
+    def __len__(self):
+        return len(self.__nodes)
+
+    def __contains__(self, key):
+        return self.__nodes.has_key(key)
+
+    has_key = __contains__
+
+    def __getitem__(self, key):
+        node = self.__nodes[key]
+        self.__unlink(node)
+        self.__link_first(node)
+        return node[3]
+
+    def get(self, key, default=None):
+        """
+        Return the value for key, or default if there is none.
+        """
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        node = self.__nodes.get(key)
+        if node is not None:
+            self.__unlink(node)
+            node[3] = value
+        else:
+            if len(self.__nodes) >= self.__maxsize:
+                oldest = self.__root[0]
+                self.__unlink(oldest)
+                del self.__nodes[oldest[2]]
+                self.__evictions += 1
+            node = [None, None, key, value]
+            self.__nodes[key] = node
+        self.__link_first(node)
+
+    def __delitem__(self, key):
+        self.__unlink(self.__nodes.pop(key))
+
+    def keys(self):
+        """
+        Return the keys, from the most to the least recently used.
+        """
+        v = []
+        node = self.__root[1]
+        while node is not self.__root:
+            v.append(node[2])
+            node = node[1]
+        return v
+
+    def __repr__(self):
+        return 'LRU cache with %s of at most %s entries'%(len(self), self.__maxsize)
+
+    def __unlink(self, node):
+        node[0][1] = node[1]
+        node[1][0] = node[0]
+
+    def __link_first(self, node):
+        root = self.__root
+        node[0] = root
+        node[1] = root[1]
+        root[1][0] = node
+        root[1] = node
+
+
+class TTLCache:
+    """
+    A dictionary whose entries are dropped a given number of seconds
+    after they were set, and which optionally holds at most a given
+    number of entries; when it is full, the entry that would expire
+    first is dropped.
+
+    EXAMPLES:
+        sage: from sage.misc.cache import TTLCache
+        sage: C = TTLCache(0.5, maxsize=2)
+        sage: C['a'] = 1; C['b'] = 2; C['c'] = 3
+        sage: sorted(C.keys())
+        ['b', 'c']
+        sage: C['c']
+        3
+        sage: sleep(1)
+        sage: 'c' in C, len(C)
+        (False, 0)
+        sage: C.evictions()
+        3
+    """
+    def __init__(self, ttl, maxsize=None):
+        """
+        INPUT:
+            ttl -- positive number; the lifetime of the entries in seconds
+            maxsize -- positive integer or None (default: None); the
+                       maximal number of entries, or None for no limit
+        """
+        if ttl <= 0:
+            raise ValueError, "ttl must be positive"
+        if maxsize is not None and maxsize < 1:
+            raise ValueError, "maxsize must be positive"
+        self.__ttl = ttl
+        self.__maxsize = maxsize
+        self.__evictions = 0
+        self.clear()
+
+    def clear(self):
+        """
+        Remove all entries.
+        """
+        # Entries are nodes [expiry time, key, value], which are also
+        # kept in the order of their expiry times in a queue; the queue
+        # may still hold nodes that have been replaced or deleted.
+        self.__nodes = {}
+        self.__queue = deque()
+
+    def ttl(self):
+        """
+        Return the lifetime of the entries in seconds.
+        """
+        return self.__ttl
+
+    def maxsize(self):
+        """
+        Return the maximal number of entries, or None if there is no limit.
+        """
+        return self.__maxsize
+
+    def evictions(self):
+        """
+        Return the number of entries dropped because they expired or to
+        make room for others.
+        """
+        return self.__evictions
+
+    def __len__(self):
+        self.__expire(time.time())
+        return len(self.__nodes)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    has_key = __contains__
+
+    def __getitem__(self, key):
+        node = self.__nodes[key]
+        now = time.time()
+        if node[0] <= now:
+            self.__expire(now)
+            raise KeyError(key)
+        return node[2]
+
+    def get(self, key, default=None):
+        """
+        Return the value for key, or default if there is none.
+        """
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        now = time.time()
+        self.__expire(now)
+        nodes = self.__nodes
+        if self.__maxsize is not None and len(nodes) >= self.__maxsize and not nodes.has_key(key):
+            while True:
+                node = self.__queue.popleft()
+                if nodes.get(node[1]) is node:
+                    del nodes[node[1]]
+                    self.__evictions += 1
+                    break
+        node = [now + self.__ttl, key, value]
+        nodes[key] = node
+        self.__queue.append(node)
+        if len(self.__queue) > 2*len(nodes) + 16:
+            # forget the nodes that were replaced or deleted
+            self.__queue = deque([x for x in self.__queue if nodes.get(x[1]) is x])
+
+    def __delitem__(self, key):
+        del self.__nodes[key]
+
+    def keys(self):
+        """
+        Return the keys of the entries that have not expired.
+        """
+        self.__expire(time.time())
+        return self.__nodes.keys()
+
+    def __repr__(self):
+        return 'TTL cache with %s entries of lifetime %s seconds'%(len(self), self.__ttl)
+
+    def __expire(self, now):
+        queue = self.__queue
+        nodes = self.__nodes
+        while queue and queue[0][0] <= now:
+            node = queue.popleft()
+            if nodes.get(node[1]) is node:
+                del nodes[node[1]]
+                self.__evictions += 1
+
+
+def key_pickle(key):
+    """
+    Return a pickle of key that only depends on its value, so that
+    equal keys made of strings, numbers, tuples and Sage objects have
+    the same pickle in every session.
+
+    Unlike with ``cPickle.dumps``, objects that occur several times in
+    key are pickled each time, so the pickle does not depend on which
+    parts of key happen to be the same object.
+    """
+    f = StringIO()
+    p = cPickle.Pickler(f, 2)
+    p.fast = 1
+    p.dump(key)
+    return f.getvalue()
+
+def key_digest(key):
+    """
+    Return a hexadecimal SHA-1 digest of key, which is the same in
+    every session, unlike ``hash(key)``.
+
+    EXAMPLES:
+        sage: from sage.misc.cache import key_digest
+        sage: key_digest(((5,), ()))
+        '...'
+        sage: a = 'x'*10; key_digest((a, a)) == key_digest((a, 'x'*10))
+        True
+    """
+    return sha1(key_pickle(key)).hexdigest()
+
+
+# Seconds by which the last use of an entry of a DiskCache may be off.
+ATIME_RESOLUTION = 60
+
+class DiskCache:
+    """
+    A dictionary stored in a single file on disk, which keeps its
+    entries between sessions and can be shared by several processes at
+    the same time.  It optionally holds at most a given number of
+    entries, in which case the least recently used entries are dropped,
+    and its entries can be given a lifetime.
+
+    The keys must be picklable and are identified by their
+    :func:`key_digest`; the values are stored with
+    :func:`~sage.structure.sobj.dumps`.  Several caches with different
+    namespaces can share a file, but maxsize applies to the whole file.
+
+    The file is an SQLite database, indexed by the key digests and the
+    times the entries were last used.  Writers lock it for the short time
+    of a change, and a process waits up to timeout seconds for the
+    lock before raising an error.  So that looking up a value does not
+    write to the file every time, the time an entry was last used is
+    only updated when it is more than ATIME_RESOLUTION seconds old,
+    and the least recently used entries are only known up to that.
+
+    EXAMPLES:
+        sage: from sage.misc.cache import DiskCache
+        sage: F = tmp_filename()
+        sage: C = DiskCache(F, maxsize=2)
+        sage: C[2/3] = matrix(2, [1,2,3,4]); C['b'] = 2; C['b']
+        2
+        sage: C[2/3]
+        [1 2]
+        [3 4]
+        sage: C['c'] = 3; 2/3 in C, len(C), C.evictions()
+        (False, 2, 1)
+        sage: D = DiskCache(F); sorted(D.keys())
+        ['b', 'c']
+        sage: D.clear(); len(C)
+        0
+    """
+    def __init__(self, filename, maxsize=None, ttl=None, namespace='', compress=True,
+                 timeout=60):
+        """
+        INPUT:
+            filename -- string; the file, which is created if it does
+                        not exist
+            maxsize -- positive integer or None (default: None); the
+                       maximal number of entries, or None for no limit
+            ttl -- positive number or None (default: None); the lifetime
+                   of the entries in seconds, or None for no limit
+            namespace -- string (default: ''); the entries of caches
+                         with another namespace are kept apart
+            compress -- bool (default: True); whether to compress the values
+            timeout -- number (default: 60); seconds to wait for a lock
+        """
+        if maxsize is not None and maxsize < 1:
+            raise ValueError, "maxsize must be positive"
+        if ttl is not None and ttl <= 0:
+            raise ValueError, "ttl must be positive"
+        self.__filename = os.path.abspath(filename)
+        self.__maxsize = maxsize
+        self.__ttl = ttl
+        self.__namespace = namespace
+        self.__compress = compress
+        self.__timeout = timeout
+        self.__evictions = 0
+        self.__pid = None
+        db = self.__connection()
+        db.execute('CREATE TABLE IF NOT EXISTS entries (digest TEXT PRIMARY KEY, '
+                   'namespace TEXT NOT NULL, key BLOB NOT NULL, value BLOB NOT NULL, '
+                   'atime REAL NOT NULL, expires REAL)')
+        db.execute('CREATE INDEX IF NOT EXISTS entries_atime ON entries (atime)')
+        db.execute('CREATE INDEX IF NOT EXISTS entries_namespace ON entries (namespace)')
+        db.execute('CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires)')
+        # The number of entries is kept up to date by triggers, so that
+        # it is not counted on every insertion.
+        db.execute('CREATE TABLE IF NOT EXISTS entry_count '
+                   '(id INTEGER PRIMARY KEY CHECK (id = 0), n INTEGER NOT NULL)')
+        db.execute('CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries '
+                   'BEGIN UPDATE entry_count SET n = n + 1; END')
+        db.execute('CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries '
+                   'BEGIN UPDATE entry_count SET n = n - 1; END')
+        db.execute('INSERT OR IGNORE INTO entry_count SELECT 0, COUNT(*) FROM entries')
+        db.commit()
+
+    def filename(self):
+        """
+        Return the name of the file.
+        """
+        return self.__filename
+
+    def maxsize(self):
+        """
+        Return the maximal number of entries, or None if there is no limit.
+        """
+        return self.__maxsize
+
+    def evictions(self):
+        """
+        Return the number of entries this process dropped because they
+        expired or to make room for others.
+        """
+        return self.__evictions
+
+    def __len__(self):
+        return self.__connection().execute(
+            'SELECT COUNT(*) FROM entries WHERE namespace = ? AND '
+            '(expires IS NULL OR expires > ?)', (self.__namespace, time.time())).fetchone()[0]
+
+    def __contains__(self, key):
+        p, digest = self.__key(key)
+        row = self.__connection().execute('SELECT key, expires FROM entries WHERE digest = ?',
+                                          (digest,)).fetchone()
+        return row is not None and str(row[0]) == p and (row[1] is None or row[1] > time.time())
+
+    has_key = __contains__
+
+    def __getitem__(self, key):
+        from sage.structure.sobj import loads
+        p, digest = self.__key(key)
+        db = self.__connection()
+        row = db.execute('SELECT key, value, expires, atime FROM entries WHERE digest = ?',
+                         (digest,)).fetchone()
+        if row is None or str(row[0]) != p:
+            raise KeyError(key)
+        now = time.time()
+        if row[2] is not None and row[2] <= now:
+            if db.execute('DELETE FROM entries WHERE digest = ? AND expires <= ?',
+                          (digest, now)).rowcount:
+                self.__evictions += 1
+            db.commit()
+            raise KeyError(key)
+        if now - row[3] > ATIME_RESOLUTION:
+            db.execute('UPDATE entries SET atime = ? WHERE digest = ?', (now, digest))
+            db.commit()
+        return loads(str(row[1]), self.__compress)
+
+    def get(self, key, default=None):
+        """
+        Return the value for key, or default if there is none.
+        """
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        from sage.structure.sobj import dumps
+        p, digest = self.__key(key)
+        value = dumps(value, self.__compress)
+        now = time.time()
+        if self.__ttl is None:
+            expires = None
+        else:
+            expires = now + self.__ttl
+        db = self.__connection()
+        try:
+            # Not INSERT OR REPLACE, whose deletions do not fire the
+            # trigger that counts the entries.
+            if not db.execute('UPDATE entries SET namespace = ?, key = ?, value = ?, atime = ?, '
+                              'expires = ? WHERE digest = ?',
+                              (self.__namespace, buffer(p), buffer(value), now, expires,
+                               digest)).rowcount:
+                db.execute('INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                           (digest, self.__namespace, buffer(p), buffer(value), now, expires))
+            if self.__maxsize is not None:
+                n = self.__count(db)
+                if n > self.__maxsize:
+                    self.__evictions += db.execute('DELETE FROM entries WHERE expires <= ?',
+                                                   (now,)).rowcount
+                    n = self.__count(db)
+                if n > self.__maxsize:
+                    self.__evictions += db.execute(
+                        'DELETE FROM entries WHERE digest IN '
+                        '(SELECT digest FROM entries ORDER BY atime LIMIT ?)',
+                        (n - self.__maxsize,)).rowcount
+            db.commit()
+        except:
+            db.rollback()
+            raise
+
+    def __delitem__(self, key):
+        p, digest = self.__key(key)
+        db = self.__connection()
+        n = db.execute('DELETE FROM entries WHERE digest = ? AND key = ?',
+                       (digest, buffer(p))).rowcount
+        db.commit()
+        if not n:
+            raise KeyError(key)
+
+    def keys(self):
+        """
+        Return the keys of the entries in the namespace of this cache
+        that have not expired.
+        """
+        rows = self.__connection().execute(
+            'SELECT key FROM entries WHERE namespace = ? AND (expires IS NULL OR expires > ?)',
+            (self.__namespace, time.time())).fetchall()
+        return [cPickle.loads(str(row[0]))[1] for row in rows]
+
+    def clear(self):
+        """
+        Remove all entries in the namespace of this cache.
+        """
+        db = self.__connection()
+        db.execute('DELETE FROM entries WHERE namespace = ?', (self.__namespace,))
+        db.commit()
+
+    def __repr__(self):
+        if self.__maxsize is None:
+            return 'Disk cache in %s'%self.__filename
+        return 'Disk cache in %s of at most %s entries'%(self.__filename, self.__maxsize)
+
+    def __count(self, db):
+        return db.execute('SELECT n FROM entry_count').fetchone()[0]
+
+    def __key(self, key):
+        p = key_pickle((self.__namespace, key))
+        return p, sha1(p).hexdigest()
+
+    def __connection(self):
+        # A connection must not be used by a forked child process, so
+        # each process opens its own.
+        if self.__pid != os.getpid():
+            import sqlite3
+            self.__db = sqlite3.connect(self.__filename, timeout=self.__timeout)
+            self.__pid = os.getpid()
+        return self.__db
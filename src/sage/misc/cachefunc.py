@@ -1,6 +1,24 @@
 """
 Cached Functions
 
+A cached function remembers the values it has computed, in a
+dictionary by default.  With :func:`cached_function`, the values can
+instead be kept in a cache of bounded size, whose least recently used
+entries are dropped, in a cache whose entries expire after some time,
+or in a file on disk, where they are kept between sessions and shared
+by several processes; see :mod:`sage.misc.cache`.  The numbers of
+hits, misses and evictions are given by
+:meth:`CachedFunction.cache_info`.
+
+EXAMPLES:
+    sage: @cached_function(maxsize=2)
+    ... def f(n):
+    ...     return n^2
+    sage: [f(1), f(2), f(1), f(3)]
+    [1, 4, 1, 9]
+    sage: sorted(f.cache_info().items())
+    [('evictions', 1), ('hits', 1), ('maxsize', 2), ('misses', 3), ('size', 2)]
+
 AUTHOR:
     -- William Stein (inspired by conversation with Justin Walker).
     -- Mike Hansen (added doctests and made it work with class methods).
@@ -13,11 +31,16 @@ AUTHOR:
 #
 #                  http://www.gnu.org/licenses/
 ########################################################################
+
+from cache import LRUCache, TTLCache, DiskCache
+
 class CachedFunction(object):
-    def __init__(self, f):
+    def __init__(self, f, cache=None):
         """
         Create a cached version of a function, which only recomputes
-        values it hasn't already computed.
+        values it hasn't already computed.  The values are kept in
+        cache, which is a dictionary or one of the caches of
+        sage.misc.cache (default: a new dictionary).
 
         If f is a function, do either g = CachedFunction(f) to make
         a cached version of f, or put @CachedFunction right before
@@ -42,7 +65,10 @@ class CachedFunction(object):
 
         """
         self.f = f
-        self.cache = {}
+        if cache is None:
+            cache = {}
+        self.cache = cache
+        self.stats = [0, 0]
         if hasattr(f, "func_doc"):
             self.__doc__ = f.func_doc
         if hasattr(f, "func_name"):
@@ -77,10 +103,14 @@ class CachedFunction(object):
         """
         cache = self.get_cache()
         k = self.get_key(*args, **kwds)
-        if cache.has_key(k):
-            return cache[k]
-        w = self.f(*args, **kwds)
-        cache[k] = w
+        try:
+            w = cache[k]
+        except KeyError:
+            self.get_stats()[1] += 1
+            w = self.f(*args, **kwds)
+            cache[k] = w
+            return w
+        self.get_stats()[0] += 1
         return w
 
     def get_cache(self):
@@ -96,6 +126,19 @@ class CachedFunction(object):
         """
         return self.cache
 
+    def get_stats(self):
+        """
+        Returns the list [hits, misses] of the numbers of calls that
+        found their value in the cache and that computed it.
+
+        EXAMPLES:
+            sage: g = CachedFunction(number_of_partitions)
+            sage: a = g(5); a = g(5)
+            sage: g.get_stats()
+            [1, 1]
+        """
+        return self.stats
+
     def is_in_cache(self, *args, **kwds):
         """
         EXAMPLES:
@@ -171,9 +214,37 @@ class CachedFunction(object):
         """
         return "Cached version of %s"%self.f 
 
+    def cache_info(self):
+        """
+        Return a dictionary giving the numbers of calls that found
+        their value in the cache ('hits') and that computed it
+        ('misses'), the number of values dropped from the cache
+        ('evictions'), the number of values in it ('size') and the
+        maximal number of values it holds ('maxsize', None if there
+        is no limit).
+
+        EXAMPLES:
+            sage: g = cached_function(number_of_partitions, ttl=60)
+            sage: a = g(5); a = g(5); a = g(6)
+            sage: sorted(g.cache_info().items())
+            [('evictions', 0), ('hits', 1), ('maxsize', None), ('misses', 2), ('size', 2)]
+        """
+        cache = self.get_cache()
+        if hasattr(cache, 'evictions'):
+            evictions = cache.evictions()
+        else:
+            evictions = 0
+        if hasattr(cache, 'maxsize'):
+            maxsize = cache.maxsize()
+        else:
+            maxsize = None
+        hits, misses = self.get_stats()
+        return {'hits': hits, 'misses': misses, 'evictions': evictions,
+                'size': len(cache), 'maxsize': maxsize}
+
     def clear_cache(self):
         """
-        Clear the cache dictionary.
+        Clear the cache dictionary and the numbers of hits and misses.
 
         EXAMPLES:
             sage: g = CachedFunction(number_of_partitions)
@@ -184,12 +255,65 @@ class CachedFunction(object):
             sage: g.get_cache()
             {}
         """
-        cache = self.get_cache()
-        for key in cache.keys():
-            del cache[key]
+        self.get_cache().clear()
+        self.get_stats()[:] = [0, 0]
+
+
+def cached_function(f=None, maxsize=None, ttl=None, filename=None, cache=None):
+    """
+    Return a cached version of the function f, which keeps its values
+    in a cache chosen by the other arguments.  Without f, return a
+    decorator that does so, as in ``@cached_function(maxsize=100)``.
 
+    INPUT:
+        f -- a function
+        maxsize -- positive integer or None (default: None); the maximal
+                   number of values kept, the least recently used being
+                   dropped first, or None for no limit
+        ttl -- positive number or None (default: None); the number of
+               seconds after which a value is computed again, or None
+        filename -- string or None (default: None); if given, the values
+                    are kept in this file (see sage.misc.cache.DiskCache),
+                    where they persist between sessions and are shared by
+                    processes using the same file.  The arguments and
+                    values of f must be picklable.
+        cache -- a dictionary-like object (default: None); if given, the
+                 values are kept in it and the other arguments are ignored
 
-cached_function = CachedFunction
+    EXAMPLES:
+        sage: g = cached_function(number_of_partitions)
+        sage: g(5)
+        7
+        sage: F = tmp_filename()
+        sage: @cached_function(filename=F, maxsize=1000)
+        ... def h(n):
+        ...     return factor(n)
+        sage: h(2^32+1)
+        641 * 6700417
+        sage: sorted(h.cache_info().items())
+        [('evictions', 0), ('hits', 0), ('maxsize', 1000), ('misses', 1), ('size', 1)]
+
+      A new version of h using the same file finds the values computed
+      before, even in another session:
+        sage: @cached_function(filename=F, maxsize=1000)
+        ... def h(n):
+        ...     return factor(n)
+        sage: h(2^32+1)
+        641 * 6700417
+        sage: h.cache_info()['hits']
+        1
+    """
+    if f is None:
+        return lambda f: cached_function(f, maxsize, ttl, filename, cache)
+    if cache is None:
+        if filename is not None:
+            namespace = '%s.%s'%(f.__module__, getattr(f, '__name__', ''))
+            cache = DiskCache(filename, maxsize=maxsize, ttl=ttl, namespace=namespace)
+        elif ttl is not None:
+            cache = TTLCache(ttl, maxsize)
+        elif maxsize is not None:
+            cache = LRUCache(maxsize)
+    return CachedFunction(f, cache)
 
 class CachedMethod(CachedFunction):
     def __init__(self, f):
@@ -206,6 +330,7 @@ class CachedMethod(CachedFunction):
             '_cache__f'
         """
         self._cache_name = '_cache__' + f.__name__
+        self._stats_name = '_cache_stats__' + f.__name__
         CachedFunction.__init__(self, f)
 
     def __call__(self, *args, **kwds):
@@ -236,11 +361,14 @@ class CachedMethod(CachedFunction):
         """
         cache = self.get_cache()
         key = self.get_key(*args, **kwds)
-        if cache.has_key(key):
-            return cache[key]
-        else:
-            cache[key] = self.f(self._instance, *args, **kwds)
-            return cache[key]
+        try:
+            w = cache[key]
+        except KeyError:
+            self.get_stats()[1] += 1
+            w = cache[key] = self.f(self._instance, *args, **kwds)
+            return w
+        self.get_stats()[0] += 1
+        return w
 
     def get_cache(self):
         """
@@ -263,6 +391,30 @@ class CachedMethod(CachedFunction):
         """
         return self._instance.__dict__.setdefault(self._cache_name, {})
 
+    def get_stats(self):
+        """
+        Returns the list [hits, misses] of the calls of the method of
+        this instance, which are counted separately for each instance
+        like its cache.
+
+        EXAMPLES:
+            sage: class Foo:
+            ...       @cached_method
+            ...       def f(self):
+            ...           return 4
+            ...
+            sage: a = Foo(); b = Foo()
+            sage: a.f(); a.f(); b.f()
+            4
+            4
+            4
+            sage: a.f.get_stats(), b.f.get_stats()
+            ([1, 1], [0, 1])
+            sage: sorted(a.f.cache_info().items())
+            [('evictions', 0), ('hits', 1), ('maxsize', None), ('misses', 1), ('size', 1)]
+        """
+        return self._instance.__dict__.setdefault(self._stats_name, [0, 0])
+
     def __get__(self, inst, cls=None):
         """
         This is needed to allow CachedFunction to decorate
@@ -86,6 +86,70 @@ def get_memory_usage(t=None):
         return m - t
 
 
+def get_peak_memory_usage():
+    """
+    Return the largest amount of memory in megabytes that this process
+    has had resident at any time, as a float.
+
+    This is only known on Linux; on other systems None is returned.
+    It is 0.0 if the kernel does not report it.
+
+    EXAMPLES::
+
+        sage: m = get_peak_memory_usage()
+        sage: m is None or m >= 0
+        True
+    """
+    U = os.uname()[0].lower()
+    if U != 'linux':
+        return None
+    try:
+        return VmB('VmHWM:')
+    except ValueError:
+        return 0.0
+
+def get_resident_memory_usage():
+    """
+    Return the amount of memory in megabytes that this process has
+    resident, as a float.
+
+    This is only implemented on Linux.
+
+    EXAMPLES::
+
+        sage: 0 < get_resident_memory_usage() <= get_memory_usage()
+        True
+    """
+    U = os.uname()[0].lower()
+    if U != 'linux':
+        raise NotImplementedError, "resident memory usage not implemented on platform %s"%U
+    return VmB('VmRSS:')
+
+def reset_peak_memory_usage():
+    """
+    Reset the peak memory usage returned by get_peak_memory_usage to
+    the current resident memory usage, and return True, if the
+    operating system allows it (Linux 4.0 and later); otherwise
+    return False.
+
+    EXAMPLES::
+
+        sage: if reset_peak_memory_usage():
+        ...       abs(get_peak_memory_usage() - get_resident_memory_usage()) < 1
+        ... else:
+        ...       True
+        True
+    """
+    try:
+        f = open('/proc/%d/clear_refs'%os.getpid(), 'w')
+        try:
+            f.write('5')
+        finally:
+            f.close()
+    except (IOError, OSError):
+        return False
+    return True
+
 
 ########################################################################
 # The following is adapted from
@@ -42,47 +42,46 @@ def math_parse(s):
         sage: sage.misc.html.math_parse(r'This \$\$is $2+2$.')
         'This $$is <span class="math">2+2</span>.'    
     """
-    # Below t always has the "parsed so far" version of s, and s is
-    # just the part of the original input s that hasn't been parsed.
-    t = ''
+    # Below t is the list of pieces of the "parsed so far" version of
+    # s, and s[pos:] is the part of the input that hasn't been parsed.
+    # Pieces are joined only at the end, so this takes linear time.
+    t = []
+    pos = 0
+    n = len(s)
     while True:
-        i = s.find('$')
+        i = s.find('$', pos)
         if i == -1:
             # No dollar signs -- definitely done.
-            return t + s
-        elif i > 0 and s[i-1] == '\\':
+            t.append(s[pos:])
+            return ''.join(t)
+        elif i > pos and s[i-1] == '\\':
             # A dollar sign with a backslash right before it, so
             # we ignore it by sticking it in the parsed string t
             # and skip to the next iteration.
-            t += s[:i-1] + '$'
-            s = s[i+1:]
+            t.append(s[pos:i-1])
+            t.append('$')
+            pos = i+1
             continue
-        elif i+1 < len(s) and s[i+1] == '$':
+        elif i+1 < n and s[i+1] == '$':
             # Found a math environment. Double dollar sign so div mode.
             typ = 'div'
+            start = i+2
         else:
             # Found math environment. Single dollar sign so span mode.
             typ = 'span'
+            start = i+1
 
-        # Now find the matching $ sign and form the span or div.
-        j = s[i+2:].find('$')
+        # Now find the matching $ sign and form the span or div.  If
+        # there is none, the math environment extends to the end.
+        j = s.find('$', i+2)
         if j == -1:
-            j = len(s)
-            s += '$'
-            if typ == 'div':
-                s += '$$'
-        else:
-            j += i + 2
-        if typ == 'div':
-            txt = s[i+2:j]
-        else:
-            txt = s[i+1:j]
-        t += s[:i] + '<%s class="math">%s</%s>'%(typ,
-                      ' '.join(txt.splitlines()), typ)
-        s = s[j+1:]
+            j = n
+        t.append(s[pos:i])
+        t.append('<%s class="math">%s</%s>'%(typ,
+                      ' '.join(s[start:j].splitlines()), typ))
+        pos = j+1
         if typ == 'div':
-            s = s[1:]
-    return t
+            pos += 1
 
 class HTMLExpr(str):
     def __init__(self, x):
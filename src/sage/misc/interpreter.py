@@ -434,7 +434,7 @@ def preparse_file_named_to_stream(name, out):
     os.chdir(dir)
     contents = open(name).read()
     contents = handle_encoding_declaration(contents, out)
-    parsed = preparse_file(contents, attached, do_time=True) 
+    parsed = preparse_file(contents, attached, do_time=True, disk_cache=True)
     os.chdir(cur)
     out.write("# -*- encoding: utf-8 -*-\n")
     out.write('#'*70+'\n')
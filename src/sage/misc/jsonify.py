@@ -0,0 +1,226 @@
+r"""
+Reading and writing JSON
+
+Benchmark results and other data meant to be read by other programs
+are written as JSON.  The json module only exists in Python 2.6 and
+later, so this module has a small encoder and decoder for the builtin
+types.
+
+EXAMPLES::
+
+    sage: from sage.misc.jsonify import jsonify, unjsonify
+    sage: print jsonify({'a': [1, 2.5, None], 'b': 'x"y'})
+    {"a": [1, 2.5, null], "b": "x\"y"}
+    sage: unjsonify(jsonify({'a': [1, 2.5, None], 'b': 'x"y'}))
+    {'a': [1, 2.5, None], 'b': 'x"y'}
+"""
+
+#############################################################################
+#       Copyright (C) 2009 William Stein <wstein@gmail.com>
+#  Distributed under the terms of the GNU General Public License (GPL)
+#  The full text of the GPL is available at:
+#                  http://www.gnu.org/licenses/
+#############################################################################
+
+import re
+
+_escapes = {'"': '\\"', '\\': '\\\\', '\n': '\\n', '\r': '\\r', '\t': '\\t',
+            '\b': '\\b', '\f': '\\f'}
+
+def jsonify(x, indent=None):
+    r"""
+    Return the JSON representation of x.
+
+    INPUT:
+        x -- None, a bool, number or string, or a list, tuple or
+             dictionary with string keys built out of these
+        indent -- None or an integer; if given, lists and
+                  dictionaries are written one item per line,
+                  indented by that many spaces per level
+
+    Floats that are not finite, which JSON cannot represent, are
+    written as null.
+
+    EXAMPLES::
+
+        sage: from sage.misc.jsonify import jsonify
+        sage: jsonify([True, 1e400, u'\xe9'])
+        '[true, null, "\\u00e9"]'
+        sage: print jsonify({'a': [1, 2]}, indent=2)
+        {
+          "a": [
+            1,
+            2
+          ]
+        }
+    """
+    return _jsonify(x, indent, 0)
+
+def _jsonify(x, indent, level):
+    if x is None:
+        return 'null'
+    if x is True:
+        return 'true'
+    if x is False:
+        return 'false'
+    if isinstance(x, (int, long)):
+        return str(x)
+    if isinstance(x, float):
+        if x != x or x in (float('inf'), float('-inf')):
+            return 'null'
+        return repr(x)
+    if isinstance(x, basestring):
+        return _string(x)
+    if isinstance(x, dict):
+        keys = x.keys()
+        keys.sort()
+        items = ['%s: %s'%(_string(str(k)), _jsonify(x[k], indent, level+1)) for k in keys]
+        return _join(items, '{', '}', indent, level)
+    if isinstance(x, (list, tuple)):
+        return _join([_jsonify(y, indent, level+1) for y in x], '[', ']', indent, level)
+    # e.g., Sage integers and real numbers
+    try:
+        if x == int(x):
+            return str(int(x))
+    except (TypeError, ValueError, OverflowError):
+        pass
+    try:
+        return _jsonify(float(x), indent, level)
+    except (TypeError, ValueError):
+        raise TypeError, "cannot write %r as JSON"%(x,)
+
+def _string(s):
+    if isinstance(s, str):
+        try:
+            s = s.decode('utf-8')
+        except UnicodeError:
+            s = s.decode('latin-1')
+    v = ['"']
+    for c in s:
+        if c in _escapes:
+            v.append(_escapes[c])
+        elif ' ' <= c < '\x7f':
+            v.append(str(c))
+        else:
+            v.append('\\u%04x'%ord(c))
+    v.append('"')
+    return ''.join(v)
+
+def _join(items, open, close, indent, level):
+    if not items:
+        return open + close
+    if indent is None:
+        return open + ', '.join(items) + close
+    inner = '\n' + ' '*(indent*(level+1))
+    return open + inner + (',' + inner).join(items) + '\n' + ' '*(indent*level) + close
+
+_unescapes = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n',
+              'r': '\r', 't': '\t'}
+
+_whitespace_regex = re.compile(r'[ \t\n\r]*')
+_number_regex = re.compile(r'-?(0|[1-9][0-9]*)(\.[0-9]+)?([eE][-+]?[0-9]+)?')
+_chars_regex = re.compile(r'[^"\\]*')
+
+def unjsonify(s):
+    r"""
+    Return the object represented by the JSON string s.
+
+    Strings are returned as str if they only contain ASCII
+    characters, and as unicode otherwise.
+
+    EXAMPLES::
+
+        sage: from sage.misc.jsonify import unjsonify
+        sage: unjsonify('{"a": [true, null, -1.5e3], "b": "\\u00e9\\n"}')
+        {'a': [True, None, -1500.0], 'b': u'\xe9\n'}
+        sage: unjsonify('[1, 2')
+        Traceback (most recent call last):
+        ...
+        ValueError: invalid JSON at position 5
+    """
+    x, i = _parse(s, _skip(s, 0))
+    i = _skip(s, i)
+    if i != len(s):
+        raise ValueError, "invalid JSON at position %s"%i
+    return x
+
+def _skip(s, i):
+    return _whitespace_regex.match(s, i).end()
+
+def _parse(s, i):
+    c = s[i:i+1]
+    if c == '{':
+        x = {}
+        i = _skip(s, i+1)
+        if s[i:i+1] == '}':
+            return x, i+1
+        while True:
+            if s[i:i+1] != '"':
+                raise ValueError, "invalid JSON at position %s"%i
+            key, i = _parse_string(s, i)
+            i = _skip(s, i)
+            if s[i:i+1] != ':':
+                raise ValueError, "invalid JSON at position %s"%i
+            x[key], i = _parse(s, _skip(s, i+1))
+            i = _skip(s, i)
+            c = s[i:i+1]
+            if c == '}':
+                return x, i+1
+            if c != ',':
+                raise ValueError, "invalid JSON at position %s"%i
+            i = _skip(s, i+1)
+    if c == '[':
+        x = []
+        i = _skip(s, i+1)
+        if s[i:i+1] == ']':
+            return x, i+1
+        while True:
+            y, i = _parse(s, i)
+            x.append(y)
+            i = _skip(s, i)
+            c = s[i:i+1]
+            if c == ']':
+                return x, i+1
+            if c != ',':
+                raise ValueError, "invalid JSON at position %s"%i
+            i = _skip(s, i+1)
+    if c == '"':
+        return _parse_string(s, i)
+    for word, value in [('null', None), ('true', True), ('false', False)]:
+        if s.startswith(word, i):
+            return value, i + len(word)
+    m = _number_regex.match(s, i)
+    if m is None:
+        raise ValueError, "invalid JSON at position %s"%i
+    if m.group(2) or m.group(3):
+        return float(m.group(0)), m.end()
+    return int(m.group(0)), m.end()
+
+def _parse_string(s, i):
+    v = []
+    i += 1
+    while True:
+        j = _chars_regex.match(s, i).end()
+        v.append(s[i:j])
+        c = s[j:j+1]
+        if c == '"':
+            break
+        if c != '\\':
+            raise ValueError, "invalid JSON at position %s"%j
+        e = s[j+1:j+2]
+        if e == 'u':
+            try:
+                v.append(unichr(int(s[j+2:j+6], 16)))
+            except ValueError:
+                raise ValueError, "invalid JSON at position %s"%j
+            i = j + 6
+        elif e in _unescapes:
+            v.append(_unescapes[e])
+            i = j + 2
+        else:
+            raise ValueError, "invalid JSON at position %s"%j
+    x = u''.join([isinstance(y, str) and y.decode('utf-8') or y for y in v])
+    try:
+        return str(x), j+1
+    except UnicodeError:
+        return x, j+1
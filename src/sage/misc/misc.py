@@ -1593,6 +1593,28 @@ def graphics_filename(ext='png'):
 # Word wrap lines
 #################################################################
 def word_wrap(s, ncols=85):
+    r"""
+    Wrap the lines of s that are longer than ncols characters at
+    spaces, or, if there are none, with a backslash at the end.
+    Lines starting with sage: are left alone.
+
+    EXAMPLES::
+
+        sage: from sage.misc.misc import word_wrap
+        sage: print word_wrap('aaa bbb ccc', 5)
+        aaa
+        bbb
+        ccc
+        sage: print word_wrap('abcdefgh', 3)
+        abc\
+        def\
+        gh
+
+    TESTS::
+
+        sage: len(word_wrap('a '*10^6))
+        2000000
+    """
     t = []
     if ncols == 0:
         return s
@@ -1600,22 +1622,22 @@ def word_wrap(s, ncols=85):
         if len(x) == 0 or x.lstrip()[:5] == 'sage:':
             t.append(x)
             continue
-        while len(x) > ncols:
-            k = ncols
-            while k > 0 and x[k] != ' ':
-                k -= 1
-            if k == 0:
-                k = ncols
+        # Wrap x[i:] without copying it, which would take quadratic
+        # time for long lines.
+        i = 0
+        n = len(x)
+        while n - i > ncols:
+            k = x.rfind(' ', i+1, i+ncols+1)
+            if k == -1:
+                k = i + ncols
                 end = '\\'
             else:
                 end = ''
-            t.append(x[:k] + end)
-            x = x[k:]
-            k=0
-            while k < len(x) and x[k] == ' ':
-                k += 1
-            x = x[k:]
-        t.append(x)
+            t.append(x[i:k] + end)
+            i = k
+            while i < n and x[i] == ' ':
+                i += 1
+        t.append(x[i:])
     return '\n'.join(t)
 
 
@@ -14,4 +14,6 @@ from sage_email import email
 
 from notebook_object import notebook, inotebook
 
+from backup import export_notebook, import_notebook
+
 from interact import interact, input_box, slider, range_slider, selector, checkbox, input_grid, text_control
@@ -0,0 +1,419 @@
+"""
+Exporting and importing whole notebooks
+
+This module writes all users, worksheets (including their snapshots,
+data files and cell output) and user histories of a notebook to a
+single archive, and restores a notebook from such an archive.  Unlike
+nb.sobj, the archive does not contain any pickled classes, so it can
+be read by other versions of the notebook.
+
+The archive is an uncompressed tar file.  Its first member is the
+file MANIFEST, a pickle of a dictionary built only out of strings,
+numbers, lists and dictionaries that describes the users and the
+worksheets.  Each worksheet is stored as an sws file
+worksheets/<owner>/<name>.sws, and the history of each user as
+users/<username>/history.log.  Since the sws files are compressed
+independently, worksheets are compressed and extracted in parallel.
+
+EXAMPLES:
+    sage: from sage.server.notebook.backup import export_notebook, import_notebook
+    sage: nb = sage.server.notebook.notebook.Notebook(tmp_dir())
+    sage: nb.add_user('sage','sage','sage@sagemath.org',force=True)
+    sage: W = nb.create_new_worksheet('Test', 'sage')
+    sage: W.edit_save('Test\n{{{\n2+3\n}}}')
+    sage: F = tmp_filename() + '.tar'
+    sage: export_notebook(nb, F, verbose=False)
+    sage: import_notebook(F, dry_run=True, verbose=False)
+    True
+    sage: nb2 = import_notebook(F, tmp_dir() + '/nb', verbose=False)
+    sage: nb2.get_worksheet_with_filename('sage/0').cell_list()
+    [Cell 0; in=2+3, out=]
+"""
+
+#############################################################################
+#       Copyright (C) 2009 William Stein <wstein@gmail.com>
+#  Distributed under the terms of the GNU General Public License (GPL)
+#  The full text of the GPL is available at:
+#                  http://www.gnu.org/licenses/
+#############################################################################
+
+import cPickle
+import os
+import shutil
+import tarfile
+import threading
+import Queue
+from cStringIO import StringIO
+
+from sage.misc.misc import walltime, tmp_dir
+from sage.version import version
+
+import sws
+
+FORMAT_VERSION = 1
+MANIFEST = 'MANIFEST'
+
+# Number of worksheets that are compressed or extracted at the same time.
+THREADS = 4
+
+def export_notebook(nb, filename, threads=THREADS, verbose=True):
+    """
+    Write all users and worksheets of the notebook nb to the archive
+    filename.
+
+    INPUT:
+        nb -- a Notebook
+        filename -- string
+        threads -- integer (default: 4); number of worksheets that
+                   are compressed at the same time
+        verbose -- bool (default: True); if True, print progress and
+                   throughput information
+    """
+    import twist
+    # Worksheets find their notebook through this global variable.
+    old_notebook = twist.notebook
+    twist.notebook = nb
+    try:
+        _export(nb, filename, threads, verbose)
+    finally:
+        twist.notebook = old_notebook
+
+def _export(nb, filename, threads, verbose):
+    """
+    Write the notebook nb, which must be twist.notebook, to the
+    archive filename.
+    """
+    t = walltime()
+    worksheets = [nb.get_worksheet_with_filename(name) for name in nb.worksheet_names()]
+    worksheets = [W for W in worksheets if W.owner() != '_sage_']
+    for W in worksheets:
+        W.save()   # make sure worksheet.txt is up to date
+    manifest = _manifest(nb, worksheets)
+
+    tar = tarfile.open(filename, 'w')
+    try:
+        _add_string(tar, MANIFEST, cPickle.dumps(manifest, 0))
+
+        tmp = tmp_dir()
+        def compress(W):
+            target = '%s/%s-%s.sws'%(tmp, W.owner(), W.filename_without_owner())
+            sws.write_sws(W.directory(), W.filename_without_owner(), target)
+            return target
+
+        try:
+            for W, target, err in _parallel_imap(compress, worksheets, threads):
+                if err is not None:
+                    raise RuntimeError, "error exporting worksheet '%s': %s"%(W.filename(), err)
+                tar.add(target, _worksheet_member(W.filename()))
+                os.unlink(target)
+                if verbose:
+                    print "Exported worksheet '%s'"%W.filename()
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        for U in manifest['users']:
+            log = nb.user(U['username']).history_log()
+            if log is not None and os.path.exists(log.filename()):
+                tar.add(log.filename(), _history_member(U['username']))
+    finally:
+        tar.close()
+
+    if verbose:
+        _report('Exported', len(worksheets), os.path.getsize(filename), walltime(t))
+
+def import_notebook(filename, directory=None, threads=THREADS, dry_run=False, verbose=True):
+    """
+    Create a new notebook in directory from the archive filename
+    written by export_notebook.
+
+    INPUT:
+        filename -- string
+        directory -- string; a directory that does not contain a
+                     notebook yet (not needed if dry_run is True)
+        threads -- integer (default: 4); number of worksheets that
+                   are extracted at the same time
+        dry_run -- bool (default: False); if True, restore the
+                   notebook into a temporary directory, check that
+                   every worksheet in the archive can be read and
+                   parsed, and then delete it again
+        verbose -- bool (default: True); if True, print progress and
+                   throughput information
+
+    OUTPUT:
+        the new notebook, without the worksheets that could not be
+        restored, or, if dry_run is True, True if all worksheets
+        could be restored and False otherwise
+
+    .. note::
+
+       Creating a notebook makes it the notebook used by the server
+       in this process, so do not call this from a running notebook
+       server.  The previous notebook is put back after a dry run or
+       if the import fails.
+    """
+    import twist
+
+    old_notebook = twist.notebook
+    if not dry_run:
+        if directory is None:
+            raise ValueError, "a directory must be given"
+        if os.path.exists('%s/nb.sobj'%directory):
+            raise ValueError, "there is already a notebook in '%s'"%directory
+        try:
+            nb = _import(filename, directory, threads, 'Imported', verbose)[0]
+            nb.save()
+        except:
+            twist.notebook = old_notebook
+            raise
+        return nb
+
+    tmp = tmp_dir()
+    try:
+        failed = _import(filename, tmp + '/nb', threads, 'Verified', verbose)[1]
+    finally:
+        twist.notebook = old_notebook
+        shutil.rmtree(tmp, ignore_errors=True)
+    return len(failed) == 0
+
+def _import(filename, directory, threads, action, verbose):
+    """
+    Create a new notebook in directory from the archive filename, and
+    return it together with the list of the filenames of the
+    worksheets that could not be restored, which are deleted from it.
+    """
+    import notebook as _notebook
+
+    t = walltime()
+    tar = tarfile.open(filename, 'r')
+    try:
+        members = {}
+        for member in tar.getmembers():
+            members[member.name] = member
+        if not members.has_key(MANIFEST):
+            raise ValueError, "'%s' is not a notebook archive"%filename
+        manifest = cPickle.loads(tar.extractfile(members[MANIFEST]).read())
+    finally:
+        tar.close()
+    if manifest['format'] > FORMAT_VERSION:
+        raise ValueError, "the notebook archive was written by a newer version of Sage (%s)"%manifest['sage_version']
+
+    nb = _notebook.Notebook(directory)
+    nb.conf().confs.update(manifest['conf'])
+    nb.set_accounts(manifest['accounts'])
+    for U in manifest['users']:
+        nb.add_user(U['username'], '', U['email'], U['account_type'], force=True)
+        V = nb.user(U['username'])
+        V.set_hashed_password(U['password'])
+        V.set_email_confirmation(U['email_confirmed'])
+        V.conf().confs.update(U['conf'])
+        member = members.get(_history_member(U['username']))
+        if member is not None:
+            log = V.history_log()
+            _copy_section(filename, member, open(log.filename(), 'wb'))
+
+    # First create all worksheets, so they get the same filenames as
+    # in the exported notebook, then fill in their directories.
+    worksheets = []
+    for D in manifest['worksheets']:
+        W = nb.create_new_worksheet(D['name'], D['owner'])
+        if W.filename() != D['filename']:
+            old = W.directory()
+            nb.change_worksheet_key(W.filename(), D['filename'])
+            W.set_filename(D['filename'])
+            shutil.rmtree(old, ignore_errors=True)
+        worksheets.append((W, D))
+
+    def extract(X):
+        W, D = X
+        target = W.directory()
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        parent, name = os.path.split(target)
+        tmp = '%s/.import-%s'%(parent, name)
+        os.makedirs(tmp)
+        try:
+            f = _FileSection(filename, members[_worksheet_member(D['filename'])])
+            try:
+                top = sws.extract_sws(f, tmp)
+            finally:
+                f.close()
+            os.rename('%s/%s'%(tmp, top), target)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    failed = []
+    for X, _, err in _parallel_imap(extract, worksheets, threads):
+        W, D = X
+        if err is None:
+            try:
+                nb.share_worksheet_files(W)
+                W.edit_save(open(W.directory() + '/worksheet.txt').read())
+                _set_worksheet_metadata(W, D)
+            except Exception, msg:
+                err = msg
+        if err is None:
+            if verbose:
+                print "Restored worksheet '%s'"%W.filename()
+        else:
+            failed.append(W.filename())
+            if verbose:
+                print "Error restoring worksheet '%s': %s"%(W.filename(), err)
+            # Do not leave a worksheet without its files behind.
+            nb.delete_worksheet(W.filename())
+
+    for W, D in worksheets:
+        if W.filename() in failed:
+            continue
+        if D.has_key('published_version'):
+            W.set_published_version(D['published_version'])
+        if D.has_key('worksheet_that_was_published'):
+            try:
+                W.set_worksheet_that_was_published(
+                    nb.get_worksheet_with_filename(D['worksheet_that_was_published']))
+            except KeyError:
+                pass
+
+    if verbose:
+        _report(action, len(worksheets), os.path.getsize(filename), walltime(t))
+        if failed:
+            print "%s worksheets could not be restored: %s"%(len(failed), ', '.join(failed))
+    return nb, failed
+
+######################################################################
+# Helper functions
+######################################################################
+
+def _manifest(nb, worksheets):
+    """
+    Return a description of the users and worksheets of nb that only
+    involves builtin Python types.
+    """
+    users = []
+    for name, U in nb.users().iteritems():
+        users.append({'username': name,
+                      'password': U.password(),
+                      'email': U.get_email(),
+                      'email_confirmed': U.is_email_confirmed(),
+                      'account_type': U.account_type(),
+                      'conf': dict(U.conf().confs)})
+    ws = []
+    for W in worksheets:
+        D = {'filename': W.filename(),
+             'owner': W.owner(),
+             'name': W.name(),
+             'system': W.system(),
+             'collaborators': list(W.collaborators()),
+             'viewers': list(W.viewers()),
+             'auto_publish': W.is_auto_publish()}
+        D['views'] = dict([(u, W.user_view(u)) for u in [W.owner()] + D['collaborators'] + D['viewers']])
+        if W.has_published_version():
+            D['published_version'] = W.published_version().filename()
+        if W.is_published():
+            try:
+                D['worksheet_that_was_published'] = W.worksheet_that_was_published().filename()
+            except Exception:
+                pass
+        ws.append(D)
+    return {'format': FORMAT_VERSION,
+            'sage_version': version,
+            'conf': dict(nb.conf().confs),
+            'accounts': nb.get_accounts(),
+            'users': users,
+            'worksheets': ws}
+
+def _set_worksheet_metadata(W, D):
+    """
+    Set the properties of the restored worksheet W that are recorded
+    in the manifest entry D.
+    """
+    W.set_name(D['name'])
+    W.set_system(D['system'])
+    W.set_collaborators(D['collaborators'])
+    for u in D['viewers']:
+        W.add_viewer(u)
+    for u, view in D['views'].iteritems():
+        W.set_user_view(u, view)
+    if D['auto_publish'] != W.is_auto_publish():
+        W.set_auto_publish()
+
+def _worksheet_member(filename):
+    return 'worksheets/%s.sws'%filename
+
+def _history_member(username):
+    return 'users/%s/history.log'%username
+
+def _add_string(tar, name, s):
+    info = tarfile.TarInfo(name)
+    info.size = len(s)
+    info.mtime = int(walltime())
+    tar.addfile(info, StringIO(s))
+
+def _report(what, n, nbytes, t):
+    mb = nbytes / 2.0**20
+    t = max(t, 1e-6)
+    print "%s %s worksheets (%.1f MB) in %.2f seconds: %.2f MB/s, %.1f worksheets/s"%(
+        what, n, mb, t, mb/t, n/t)
+
+class _FileSection:
+    """
+    A read-only file-like object for the data of one member of a tar
+    file, so that several members can be read at the same time.
+    """
+    def __init__(self, filename, member):
+        self.__file = open(filename, 'rb')
+        self.__file.seek(member.offset_data)
+        self.__remaining = member.size
+
+    def read(self, n=-1):
+        if n < 0 or n > self.__remaining:
+            n = self.__remaining
+        s = self.__file.read(n)
+        self.__remaining -= len(s)
+        return s
+
+    def close(self):
+        self.__file.close()
+
+def _copy_section(filename, member, out):
+    f = _FileSection(filename, member)
+    try:
+        while True:
+            s = f.read(sws.CHUNK_SIZE)
+            if not s:
+                break
+            out.write(s)
+    finally:
+        f.close()
+        out.close()
+
+def _parallel_imap(f, items, threads):
+    """
+    Apply f to each of the items using the given number of threads,
+    and iterate over triples (item, f(item), exception) in the order
+    in which they complete; exception is None if f succeeded.
+
+    Threads help here since reading and writing files and bzip2
+    compression release the global interpreter lock.
+    """
+    tasks = Queue.Queue()
+    results = Queue.Queue()
+    for x in items:
+        tasks.put(x)
+
+    def worker():
+        while True:
+            try:
+                x = tasks.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results.put((x, f(x), None))
+            except Exception, msg:
+                results.put((x, None, msg))
+
+    for i in range(min(threads, len(items))):
+        T = threading.Thread(target=worker)
+        T.setDaemon(True)
+        T.start()
+    for i in range(len(items)):
+        yield results.get()
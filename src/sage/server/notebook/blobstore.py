@@ -0,0 +1,293 @@
+"""
+Content-addressed storage of worksheet files
+
+Worksheets often contain identical files: copying or publishing a
+worksheet, or having many users import the same worksheet, used to
+copy all of its data files and cell output.  A BlobStore keeps one
+copy of each distinct file, named after the SHA-1 digest of its
+contents, and the files in worksheet directories are hard links to
+these blobs.
+
+The reference count of a blob is the number of hard links to it
+besides the one in the store, which the file system keeps track of
+for us; deleting a worksheet directory thus releases its references,
+and collect_garbage() removes the blobs nobody refers to anymore.
+
+Since all links to a blob share the same file, a shared file must
+never be modified in place.  Cell directories are emptied before a
+cell is evaluated, unshare_tree is called on the data directory of
+a worksheet before its compute process is started, and the files of
+a worksheet whose compute process is running are copied instead of
+shared.  Where hard links are not supported, files are simply copied.
+
+EXAMPLES::
+
+    sage: from sage.server.notebook.blobstore import BlobStore
+    sage: B = BlobStore(tmp_dir() + '/blobs')
+    sage: D = tmp_dir(); open(D + '/a', 'w').write('foo')
+    sage: E = tmp_dir() + '/copy'; B.copytree(D, E)
+    sage: open(E + '/a').read()
+    'foo'
+    sage: B.refcount(B.add(E + '/a'))
+    2
+    sage: import shutil; shutil.rmtree(D); shutil.rmtree(E)
+    sage: B.collect_garbage()
+    (1, 3)
+"""
+
+#############################################################################
+#       Copyright (C) 2009 William Stein <wstein@gmail.com>
+#  Distributed under the terms of the GNU General Public License (GPL)
+#  The full text of the GPL is available at:
+#                  http://www.gnu.org/licenses/
+#############################################################################
+
+import hashlib
+import os
+import random
+import shutil
+import time
+
+# Size of the pieces in which files are read when computing digests.
+CHUNK_SIZE = 65536
+
+class BlobStore:
+    def __init__(self, directory):
+        """
+        A store of files named by the digest of their contents.
+
+        INPUT:
+            directory -- string; the directory in which the blobs are
+                         kept; it is created if necessary
+        """
+        self.__dir = directory
+
+    def directory(self):
+        """
+        Return the directory in which the blobs are kept.
+        """
+        if not os.path.exists(self.__dir):
+            os.makedirs(self.__dir)
+        return self.__dir
+
+    def path(self, digest):
+        """
+        Return the filename of the blob with the given digest.
+        """
+        return '%s/%s/%s'%(self.directory(), digest[:2], digest[2:])
+
+    def add(self, filename):
+        """
+        Put the contents of the file filename in the store and replace
+        filename by a link to the corresponding blob.
+
+        INPUT:
+            filename -- string; a regular file
+
+        OUTPUT:
+            string -- the digest of the contents of filename
+
+        EXAMPLES::
+
+            sage: from sage.server.notebook.blobstore import BlobStore
+            sage: B = BlobStore(tmp_dir())
+            sage: F = tmp_filename(); open(F, 'w').write('foo')
+            sage: G = tmp_filename(); open(G, 'w').write('foo')
+            sage: B.add(F) == B.add(G)
+            True
+            sage: os.stat(F).st_ino == os.stat(G).st_ino
+            True
+        """
+        digest = file_digest(filename)
+        blob = self.path(digest)
+        if os.path.exists(blob):
+            if not _same_file(blob, filename):
+                _replace_with_link(blob, filename)
+        else:
+            dir = os.path.dirname(blob)
+            if not os.path.exists(dir):
+                os.makedirs(dir)
+            if not _link(filename, blob):
+                shutil.copy2(filename, blob)
+        return digest
+
+    def copy(self, src, dest):
+        """
+        Make dest a copy of the regular file src, sharing the contents
+        of both through the store.
+        """
+        _link(self.path(self.add(src)), dest) or shutil.copy2(src, dest)
+
+    def copytree(self, src, dest):
+        """
+        Recursively copy the directory src to dest, like
+        shutil.copytree does, but put all regular files into the store
+        and link them into dest.
+
+        INPUT:
+            src -- string; an existing directory
+            dest -- string; a directory that does not exist yet
+        """
+        os.makedirs(dest)
+        for name in os.listdir(src):
+            s = os.path.join(src, name)
+            d = os.path.join(dest, name)
+            if os.path.islink(s):
+                os.symlink(os.readlink(s), d)
+            elif os.path.isdir(s):
+                self.copytree(s, d)
+            elif os.path.isfile(s):
+                self.copy(s, d)
+        shutil.copystat(src, dest)
+
+    def add_tree(self, directory):
+        """
+        Put all regular files below directory into the store, replacing
+        them by links to the blobs.
+        """
+        for dirpath, dirnames, filenames in os.walk(directory):
+            for name in filenames:
+                F = os.path.join(dirpath, name)
+                if os.path.isfile(F) and not os.path.islink(F):
+                    self.add(F)
+
+    def refcount(self, digest):
+        """
+        Return the number of files outside the store that share the
+        blob with the given digest.
+        """
+        try:
+            return os.stat(self.path(digest)).st_nlink - 1
+        except OSError:
+            return 0
+
+    def collect_garbage(self):
+        """
+        Delete all blobs that are not referred to anymore.
+
+        OUTPUT:
+            pair (number of blobs deleted, number of bytes freed)
+        """
+        n = 0
+        nbytes = 0
+        dir = self.directory()
+        for prefix in os.listdir(dir):
+            D = os.path.join(dir, prefix)
+            if not os.path.isdir(D):
+                continue
+            for name in os.listdir(D):
+                F = os.path.join(D, name)
+                try:
+                    st = os.stat(F)
+                    if st.st_nlink <= 1:
+                        os.unlink(F)
+                        n += 1
+                        nbytes += st.st_size
+                except OSError:
+                    pass
+        return n, nbytes
+
+def unshare_tree(directory):
+    """
+    Replace all files below directory that are hard links to a blob
+    by private copies, so that they may be modified in place.
+
+    EXAMPLES::
+
+        sage: from sage.server.notebook.blobstore import BlobStore, unshare_tree
+        sage: B = BlobStore(tmp_dir())
+        sage: D = tmp_dir(); open(D + '/a', 'w').write('foo')
+        sage: d = B.add(D + '/a'); B.refcount(d)
+        1
+        sage: unshare_tree(D); B.refcount(d)
+        0
+        sage: open(D + '/a').read()
+        'foo'
+    """
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for name in filenames:
+            F = os.path.join(dirpath, name)
+            if os.path.islink(F) or not os.path.isfile(F):
+                continue
+            if os.stat(F).st_nlink > 1:
+                tmp = _tmp_name(F)
+                shutil.copy2(F, tmp)
+                os.rename(tmp, F)
+
+# Digests of files, keyed by filename.  An entry is reused as long as
+# the inode, size and modification time of the file are the same.
+_file_digests = {}
+
+def file_digest(filename):
+    """
+    Return the hex SHA-1 digest of the contents of the file filename.
+
+    Besides naming blobs, this is used as a strong entity tag when
+    serving files from cell directories, and to version the URLs of
+    these files in the output of cells, so that browsers only
+    download them again when they change.
+
+    EXAMPLES::
+
+        sage: from sage.server.notebook.blobstore import file_digest
+        sage: F = tmp_filename(); open(F, 'w').write('foo')
+        sage: file_digest(F)
+        '0beec7b5ea3f0fdbc95d0dd47f3c5bc275da8a33'
+        sage: open(F, 'w').write('bar'); file_digest(F)
+        '62cdb7020ff920e5aa642c3d4066950dd1f01f4d'
+    """
+    st = os.stat(filename)
+    key = (st.st_ino, st.st_size, st.st_mtime)
+    try:
+        k, digest = _file_digests[filename]
+        if k == key:
+            return digest
+    except KeyError:
+        pass
+    h = hashlib.sha1()
+    f = open(filename, 'rb')
+    try:
+        while True:
+            s = f.read(CHUNK_SIZE)
+            if not s:
+                break
+            h.update(s)
+    finally:
+        f.close()
+    digest = h.hexdigest()
+    # A file that was modified within the last two seconds might be
+    # modified again without changing its modification time, so we do
+    # not remember its digest yet.
+    if time.time() - st.st_mtime > 2:
+        if len(_file_digests) > 10000:
+            _file_digests.clear()
+        _file_digests[filename] = (key, digest)
+    return digest
+
+def _tmp_name(filename):
+    return '%s.tmp-%s'%(filename, random.randint(0, 2**31))
+
+def _same_file(a, b):
+    sa = os.stat(a)
+    sb = os.stat(b)
+    return sa.st_dev == sb.st_dev and sa.st_ino == sb.st_ino
+
+def _link(src, dest):
+    """
+    Make dest a hard link to src, and return True, or return False if
+    that is not possible (e.g., because they are on different file
+    systems).
+    """
+    try:
+        os.link(src, dest)
+        return True
+    except (OSError, AttributeError):
+        return False
+
+def _replace_with_link(blob, filename):
+    """
+    Atomically replace filename by a hard link to blob, if possible.
+    """
+    tmp = _tmp_name(filename)
+    if _link(blob, tmp):
+        os.rename(tmp, filename)
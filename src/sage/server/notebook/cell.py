@@ -23,6 +23,11 @@ a list of cells.
 MAX_OUTPUT = 32000
 MAX_OUTPUT_LINES = 120
 
+# The memory usage of a cell is shown below its output if evaluating
+# it increased the memory used by this many megabytes, or if it was
+# timed with %time.
+USAGE_NOTE_MB = 100
+
 TRACEBACK = 'Traceback (most recent call last):'
 
 import re
@@ -38,6 +43,9 @@ from   sage.misc.misc import word_wrap
 from   sage.misc.html import math_parse
 from   sage.misc.preparser import strip_string_literals
 from   sage.misc.package   import is_package_installed
+from   interact            import coalesce_update_requests
+from   usage               import FILENAME as USAGE_FILENAME
+from   blobstore           import file_digest
 
 from cgi import escape
 
@@ -80,6 +88,24 @@ class Cell_generic:
         """
         raise NotImplementedError
 
+    def _clear_html_cache(self):
+        """
+        Forget the HTML fragments of this cell cached by html(); this
+        must be called whenever something shown by html() changes.
+
+        EXAMPLES::
+
+            sage: C = sage.server.notebook.cell.TextCell(0, '$x$', None)
+            sage: C.html() is C.html()
+            True
+            sage: s = C.html(); C._clear_html_cache(); C.html() is s
+            False
+        """
+        try:
+            del self._html_cache
+        except AttributeError:
+            pass
+
 
 class TextCell(Cell_generic):
     def __init__(self, id, text, worksheet):
@@ -136,6 +162,7 @@ class TextCell(Cell_generic):
             TextCell 0: 3+2
         """
         self.__text = input_text
+        self._clear_html_cache()
 
     def set_worksheet(self, worksheet, id=None):
         """
@@ -156,6 +183,7 @@ class TextCell(Cell_generic):
         self.__worksheet = worksheet
         if id is not None:
             self.__id = id
+        self._clear_html_cache()
 
     def worksheet(self):
         """
@@ -188,6 +216,15 @@ class TextCell(Cell_generic):
             sage: C.html(do_math_parse=True)
             '<div class="text_cell" id="cell_text_0"><span class="math">2+3</span>...'
         """
+        # The HTML only changes when the text does, so it is cached
+        # until set_input_text is called.
+        key = (ncols, do_print, do_math_parse, editing)
+        try:
+            return self._html_cache[key]
+        except AttributeError:
+            self._html_cache = {}
+        except KeyError:
+            pass
 
         s = """<div class="text_cell" id="cell_text_%s">%s</div>"""%(self.__id,self.html_inner(ncols=ncols, do_print=do_print, do_math_parse=do_math_parse, editing=editing))
 
@@ -213,7 +250,8 @@ return(value);
 
         if editing:
             s += """<script>$("#cell_text_%s").trigger('dblclick');</script>"""%self.__id
-            
+
+        self._html_cache[key] = s
         return s
 
     def html_inner(self,ncols=0, do_print=False, do_math_parse=True, editing=False):
@@ -380,6 +418,7 @@ class Cell(Cell_generic):
         self.__out = ''
         self.__out_html = ''
         self.__evaluated = False
+        self._clear_html_cache()
 
     def evaluated(self):
         r"""
@@ -501,6 +540,7 @@ class Cell(Cell_generic):
             'nowrap'
         """
         self.__type = typ
+        self._clear_html_cache()
 
     def cell_output_type(self):
         """
@@ -540,6 +580,7 @@ class Cell(Cell_generic):
         self.__worksheet = worksheet
         if id is not None:
             self.set_id(id)
+        self._clear_html_cache()
 
     def worksheet(self):
         """
@@ -567,6 +608,7 @@ class Cell(Cell_generic):
             self.__out_html = ""
         else:
             self.__out_html = self.files_html(output)
+        self._clear_html_cache()
 
     def id(self):
         """
@@ -592,6 +634,7 @@ class Cell(Cell_generic):
             2
         """
         self.__id = int(id)
+        self._clear_html_cache()
 
     def worksheet(self):
         """
@@ -913,6 +956,7 @@ class Cell(Cell_generic):
         """
         self.__interrupted = True
         self.__evaluated = False
+        self._clear_html_cache()
 
     def interrupted(self):
         """
@@ -990,6 +1034,7 @@ class Cell(Cell_generic):
         """
         if self.is_interacting():
             del self.interact
+            self._clear_html_cache()
 
     def set_input_text(self, input):
         """
@@ -1027,8 +1072,14 @@ class Cell(Cell_generic):
         """
         # Stuff to deal with interact
         if input.startswith('%__sage_interact__'):
-            self.interact = input[len('%__sage_interact__')+1:]
+            interact = input[len('%__sage_interact__')+1:]
+            if self.is_interacting() and self.__worksheet is not None and self.computing():
+                # An earlier update of this cell is still queued or
+                # running; only the latest value of each control matters.
+                interact = coalesce_update_requests(self.interact, interact)
+            self.interact = interact
             self.__version = self.version() + 1
+            self._clear_html_cache()
             return
         elif self.is_interacting():
             try:
@@ -1042,8 +1093,7 @@ class Cell(Cell_generic):
         self.__evaluated = False
         self.__version = self.version() + 1
         self.__in = input
-        if hasattr(self, '_html_cache'):
-            del self._html_cache
+        self._clear_html_cache()
 
         #Run get the input text with all of the percent
         #directives parsed
@@ -1105,7 +1155,7 @@ class Cell(Cell_generic):
                     pass
                 else:
                     break
-            elif line in ['%auto', '%hide', '%hideall', '%save_server', "%time", "%timeit"]:
+            elif line in ['%auto', '%hide', '%hideall', '%save_server', "%time", "%timeit", "%prun"]:
                 #We do not consider any of the above percent
                 #directives as specifying a system.
                 pass
@@ -1216,20 +1266,20 @@ class Cell(Cell_generic):
         """
         self.__changed_input = new_text
         self.__in = new_text
+        self._clear_html_cache()
 
     def set_output_text(self, output, html, sage=None):
         if output.count('<?__SAGE__TEXT>') > 1:
             html = '<h3><font color="red">WARNING: multiple @interacts in one cell disabled (not yet implemented).</font></h3>'
             output = ''
 
+        self._clear_html_cache()
+
         # In interacting mode, we just save the computed output
         # (do not overwrite). 
         if self.is_interacting():
             self._interact_output = (output, html)
             return
-        
-        if hasattr(self, '_html_cache'):
-            del self._html_cache
 
         output = output.replace('\r','')
         # We do not truncate if "notruncate" or "Output truncated!" already
@@ -1274,16 +1324,76 @@ class Cell(Cell_generic):
 
     def output_html(self):
         try:
-            return self.__out_html
+            s = self.__out_html
+        except AttributeError:
+            s = self.__out_html = ''
+        return s + self.usage_html()
+
+    def usage(self):
+        """
+        Return a dictionary of the resources used by the last
+        evaluation of this cell, as returned by
+        sage.server.notebook.usage.read_usage, or None if they are not
+        known.
+
+        EXAMPLES::
+
+            sage: C = sage.server.notebook.cell.Cell(0, '2+3', '5', None)
+            sage: C.usage() is None
+            True
+        """
+        try:
+            return self.__usage
         except AttributeError:
-            self.__out_html = ''
+            return None
+
+    def set_usage(self, usage):
+        """
+        Set the resources used by the last evaluation of this cell; if
+        the dictionary usage has the key 'memory_budget_mb', the
+        worksheet was over that memory budget afterwards.
+        """
+        self.__usage = usage
+        self._clear_html_cache()
+
+    def usage_html(self):
+        """
+        Return HTML showing the memory used by this cell, if its
+        evaluation increased the memory usage by at least USAGE_NOTE_MB
+        megabytes, it was timed or its worksheet is over its memory
+        budget, and the empty string otherwise.
+
+        EXAMPLES::
+
+            sage: C = sage.server.notebook.cell.Cell(0, '2+3', '5', None)
+            sage: C.set_usage({'cpu_seconds': 0.5, 'wall_seconds': 0.6, 'rss_before_mb': 100.0,
+            ...                'rss_after_mb': 350.0, 'peak_rss_mb': 400.0})
+            sage: C.usage_html()
+            '<div class="cell_usage">Memory: 350.0 MB (+250.0 MB), peak 400.0 MB</div>'
+            sage: U = C.usage(); U['memory_budget_mb'] = 300
+            sage: C.set_usage(U); C.usage_html()
+            '<div class="cell_usage_over_budget">Memory: 350.0 MB (+250.0 MB), peak 400.0 MB. This worksheet uses more than its memory budget of 300 MB; restart it to free memory.</div>'
+        """
+        U = self.usage()
+        if U is None or U['rss_after_mb'] is None:
             return ''
+        growth = U['rss_after_mb'] - U['rss_before_mb']
+        peak = U['peak_rss_mb'] or U['rss_after_mb']
+        over = U.has_key('memory_budget_mb')
+        if not (over or self.time() or growth >= USAGE_NOTE_MB or
+                peak - U['rss_before_mb'] >= USAGE_NOTE_MB):
+            return ''
+        s = 'Memory: %.1f MB (%+.1f MB), peak %.1f MB'%(U['rss_after_mb'], growth, peak)
+        if over:
+            s += ('. This worksheet uses more than its memory budget of %s MB;'
+                  ' restart it to free memory.'%U['memory_budget_mb'])
+            return '<div class="cell_usage_over_budget">%s</div>'%s
+        return '<div class="cell_usage">%s</div>'%s
     
     def process_cell_urls(self, x):
-        end = '?%d"'%self.version()
-        begin = self.url_to_self()
         for s in re_cell.findall(x) + re_cell_2.findall(x):
-            x = x.replace(s,begin + s[7:-1] + end)
+            # s is "cell://filename" including the quotes
+            x = x.replace(s, s[0] + self.file_url(s[8:-1]) + s[-1])
         return x
 
     def output_text(self, ncols=0, html=True, raw=False, allow_interact=True):
@@ -1343,31 +1453,42 @@ class Cell(Cell_generic):
             s = format_exception(format_html(s), ncols)
 
         # Everything not wrapped in <html> ... </html> should be
-        # escaped and word wrapped.
-        t = ''
-        while len(s) > 0:
-            i = s.find('<html>')
+        # escaped and word wrapped.  The input is scanned by index
+        # and the pieces are joined at the end, so large outputs
+        # take linear time.
+        t = []
+        pos = 0
+        n = len(s)
+        while pos < n:
+            i = s.find('<html>', pos)
             if i == -1:
-                t += format(s)
+                t.append(format(s[pos:]))
                 break
-            j = s.find('</html>')
+            j = s.find('</html>', pos)
             if j == -1:
-                t += format(s[:i])
+                t.append(format(s[pos:i]))
                 break
-            t += format(s[:i]) + format_html(s[i+6:j])
-            s = s[j+7:]
-        t = t.replace('</html>','')
+            t.append(format(s[pos:i]))
+            t.append(format_html(s[i+6:j]))
+            pos = j+7
+        t = ''.join(t).replace('</html>','')
 
         # Get rid of the <script> tags, since we do not want them to
         # be evaluated twice.  They are only evaluated in the wrapped
         # version of the output.
         if ncols == 0:
+            lower = t.lower()
+            v = []
+            pos = 0
             while True:
-                i = t.lower().find('<script>')
+                i = lower.find('<script>', pos)
                 if i == -1: break
-                j = t[i:].lower().find('</script>')
+                j = lower.find('</script>', i)
                 if j == -1: break
-                t = t[:i] + t[i+j+len('</script>'):]
+                v.append(t[pos:i])
+                pos = j + len('</script>')
+            v.append(t[pos:])
+            t = ''.join(v)
                 
         return t
         
@@ -1425,6 +1546,7 @@ class Cell(Cell_generic):
             True
         """
         self.__is_html = v
+        self._clear_html_cache()
 
     #################
     # Introspection #
@@ -1435,6 +1557,7 @@ class Cell(Cell_generic):
         else:
             html = escape(html).strip()
             self.__introspect_html = '<pre class="introspection">'+html+'</pre>'
+        self._clear_html_cache()
 
     def introspect_html(self):
         if not self.introspect():
@@ -1480,6 +1603,7 @@ class Cell(Cell_generic):
             False
         """
         self.__introspect = False
+        self._clear_html_cache()
 
     def set_introspect(self, before_prompt, after_prompt):
         """
@@ -1494,6 +1618,7 @@ class Cell(Cell_generic):
             ['a', 'b']
         """
         self.__introspect = [before_prompt, after_prompt]
+        self._clear_html_cache()
 
     def evaluate(self, introspect=False, time=None, username=None):
         r"""
@@ -1535,8 +1660,11 @@ class Cell(Cell_generic):
         if time is not None:
             self.__time = time
         self.__introspect = introspect
+        if not introspect:
+            self.__usage = None
         self.__worksheet.enqueue(self, username=username)
         self.__type = 'wrap'
+        self._clear_html_cache()
         dir = self.directory()
         for D in os.listdir(dir):
             F = dir + '/' + D
@@ -1585,6 +1713,22 @@ class Cell(Cell_generic):
                 'timeit' in self.percent_directives() or
                 getattr(self, '__time', False))
 
+    def prun(self):
+        r"""
+        Returns True if this cell should be run under the profiler,
+        which is requested by the percent directive %prun (see
+        sage.server.notebook.prun).
+
+        EXAMPLES::
+
+            sage: C = sage.server.notebook.cell.Cell(0, '%prun\n2+3', '5', None)
+            sage: C.prun()
+            True
+            sage: C.system() is None
+            True
+        """
+        return 'prun' in self.percent_directives()
+
     def doc_html(self, wrap=None, div_wrap=True, do_print=False):
         """
         Modified version of ``self.html`` for the doc browser.
@@ -1611,14 +1755,44 @@ class Cell(Cell_generic):
         return s
    
     def html(self, wrap=None, div_wrap=True, do_print=False):
+        """
+        Returns the HTML code for this cell.
+
+        The result is cached until the input, output or output type of
+        the cell changes, so rendering a worksheet only recomputes the
+        cells that changed since it was last shown.
+
+        EXAMPLES::
+
+            sage: nb = sage.server.notebook.notebook.Notebook(tmp_dir())
+            sage: nb.add_user('sage','sage','sage@sagemath.org',force=True)
+            sage: W = nb.create_new_worksheet('Test', 'sage')
+            sage: C = W.new_cell_after(0, "2^2")
+            sage: C.html() is C.html()
+            True
+            sage: s = C.html(); C.set_output_text('4', ''); C.html() is s
+            False
+
+        ::
+
+            sage: import shutil; shutil.rmtree(nb.directory())
+        """
         if do_print:
             wrap = 68
             div_wrap = 68
-        key = (wrap,div_wrap,do_print)
 
         if wrap is None:
             wrap = self.notebook().conf()['word_wrap_cols']
         evaluated = self.evaluated()
+        # Whether the cell is evaluated or computing depends on the
+        # state of the worksheet, so it is part of the key.
+        key = (wrap, div_wrap, do_print, evaluated, self.computing())
+        try:
+            return self._html_cache[key]
+        except AttributeError:
+            self._html_cache = {}
+        except KeyError:
+            pass
         if evaluated or do_print:
             cls = 'cell_evaluated'
         else:
@@ -1635,8 +1809,7 @@ class Cell(Cell_generic):
 
         if div_wrap:
             s = '\n\n<div id="cell_outer_%s" class="cell_visible"><div id="cell_%s" class="%s">'%(self.id(), self.id(), cls) + s + '</div></div>'
-            
-        #self._html_cache[key] = s
+        self._html_cache[key] = s
         return s
 
     def html_in(self, do_print=False, ncols=80):
@@ -1759,7 +1932,8 @@ $("#insert_new_cell_%(id)s").shiftclick(function(e) {insert_new_text_cell_after(
             sage: import shutil; shutil.rmtree(nb.directory())
         """
         dir = self.directory()
-        D = os.listdir(dir)
+        # The file of the resources used by the cell is not an output.
+        D = [F for F in os.listdir(dir) if not F.startswith(USAGE_FILENAME)]
         return D
 
     def delete_files(self):
@@ -1792,30 +1966,62 @@ $("#insert_new_cell_%(id)s").shiftclick(function(e) {insert_new_text_cell_after(
 
 
 
+    def file_url(self, F, depends=[]):
+        """
+        Returns the URL of the file F in this cell's directory.  The
+        URL contains a digest of the contents of the file, so it
+        changes exactly when the file changes, and browsers can cache
+        the file as long as they like.
+
+        INPUT:
+
+        -  ``F`` - string; name of a file in this cell's directory
+
+        -  ``depends`` - list of names of further files whose
+           contents the URL should depend on, e.g., files that are
+           loaded by F
+        
+        EXAMPLES::
+        
+            sage: nb = sage.server.notebook.notebook.Notebook(tmp_dir())
+            sage: nb.add_user('sage','sage','sage@sagemath.org',force=True)
+            sage: W = nb.create_new_worksheet('Test', 'sage')
+            sage: C = sage.server.notebook.cell.Cell(0, '2+3', '5', W)
+            sage: open(C.directory() + '/a.txt', 'w').write('foo')
+            sage: C.file_url('a.txt')
+            '/home/sage/0/cells/0/a.txt?v=0beec7b5ea3f0fdbc95d0dd47f3c5bc275da8a33'
+        """
+        url = "%s/%s"%(self.url_to_self(), F)
+        dir = self.directory()
+        try:
+            v = [file_digest(os.path.join(dir, G)) for G in [F] + depends]
+        except (OSError, IOError):
+            # The file was deleted in the meantime.
+            return url
+        return '%s?v=%s'%(url, '-'.join(v))
+
     def files_html(self, out):
-        import time
         D = self.files()
         D.sort()
         if len(D) == 0:
             return ''
         images = []
         files  = []
-        # The question mark trick here is so that images will be reloaded when
-        # the async request requests the output text for a computation.
-        # This is inspired by http://www.irt.org/script/416.htm/.
+        # Images and jmol scripts are referred to by versioned URLs (see
+        # file_url), so that they are reloaded exactly when they change.
         for F in D:
             if 'cell://%s'%F in out:
                 continue
             url = "%s/%s"%(self.url_to_self(), F)
             if F.endswith('.png') or F.endswith('.bmp') or \
                     F.endswith('.jpg') or F.endswith('.gif'):
-                images.append('<img src="%s?%d">'%(url, time.time()))
+                images.append('<img src="%s">'%self.file_url(F))
             elif F.endswith('.obj'):
                 images.append("""<a href="javascript:sage3d_show('%s', '%s_%s', '%s');">Click for interactive view.</a>"""%(url, self.__id, F, F[:-4]))
             elif F.endswith('.mtl') or F.endswith(".objmeta"):
                 pass # obj data
             elif F.endswith('.svg'):
-                images.append('<embed src="%s" type="image/svg+xml" name="emap">'%url)
+                images.append('<embed src="%s" type="image/svg+xml" name="emap">'%self.file_url(F))
             elif F.endswith('.jmol'):
                 # If F ends in -size500.jmol then we make the viewer applet with size 500.
                 i = F.rfind('-size')
@@ -1828,7 +2034,10 @@ $("#insert_new_cell_%(id)s").shiftclick(function(e) {insert_new_text_cell_after(
                 #script = '<script>jmol_applet(%s, "%s");</script>%s' % (size, url, popup)
                 #script = '<script>jmol_popup("%s");</script>' % (url)
 
-                script = '<div><script>jmol_applet(%s, "%s?%d");</script></div>' % (size, url, time.time())
+                # The script loads the .jmol.zip file with the same
+                # name, so the URL has to change when either changes.
+                depends = [G for G in [F + '.zip'] if G in D]
+                script = '<div><script>jmol_applet(%s, "%s");</script></div>' % (size, self.file_url(F, depends))
                 images.append(script)
             elif F.endswith('.jmol.zip'):
                 pass # jmol data
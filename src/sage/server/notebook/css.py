@@ -1231,6 +1231,23 @@ a.file_link {
   text-decoration:underline;
 }
 
+div.cell_usage {
+  font-family: sans-serif;
+  font-size:9pt;
+  color:#777777;
+}
+
+div.cell_usage_over_budget {
+  font-family: sans-serif;
+  font-size:9pt;
+  color:#cc0000;
+}
+
+table.resource_usage td {
+  text-align:right;
+  padding-right:1em;
+}
+
 
 /************ INSERTING NEW CELLS **************************/
 
@@ -149,6 +149,7 @@ class MySessionWrapper(object):
         Inital logic occurs here to decide the
         authentication status of a given user.
         """
+        twist.time_request(request)
         if segments and segments[0] == "login":
             #log.msg("Login")
             #get the username and password in the postdata
@@ -140,11 +140,16 @@ VERSION 3:
 from base64 import standard_b64encode, standard_b64decode
 import inspect
 import math
+import os
+import re
+import sys
 import types
+from cStringIO import StringIO
 
 # Sage libraries
 from sage.misc.sage_eval import sage_eval
 from sage.misc.misc import srange
+from sage.misc.cache import LRUCache
 try:
     from sage.plot.misc import Color
     from sage.structure.element import is_Matrix
@@ -1614,7 +1619,7 @@ class UpdateButton(JavascriptCodeButton):
         s = 'interact(%s, "sage.server.notebook.interact.recompute(%s)")'%(cell_id, cell_id)
         JavascriptCodeButton.__init__(self, "Update", s)                                     
         
-def interact(f):
+def interact(f=None, cache=0):
     r"""
     Use interact as a decorator to create interactive Sage notebook
     cells with sliders, text boxes, radio buttons, check boxes, and
@@ -1625,6 +1630,12 @@ def interact(f):
 
     INPUT:
         f -- a Python function
+        cache -- integer (default: 0); if positive, remember the
+                 output and generated files of the last \code{cache}
+                 distinct settings of the controls, and show them
+                 again instead of calling f when the controls return
+                 to one of those settings.  Only use this if f is a
+                 pure function of its inputs.
 
     EXAMPLES:
     In each example below we use a single underscore for the function
@@ -1686,6 +1697,16 @@ def interact(f):
         ...     show(factor(x^n - 1))
         <html>...
 
+    If your function is slow but only depends on the values of the
+    controls, you can ask for the results to be remembered, so that
+    moving a slider back to a previous position shows the earlier
+    output immediately.  Here the last 20 results are kept:
+
+        sage: @interact(cache=20)
+        ... def _(n=(10,100,1)):
+        ...     show(factor(x^n - 1))
+        <html>...
+
     DEFAULTS:
     Defaults for the variables of the input function determine
     interactive controls.  The standard controls are \code{input_box},
@@ -1901,6 +1922,9 @@ def interact(f):
         <html>...
 
     """
+    if f is None:
+        # Called as @interact(cache=...)
+        return lambda f: interact(f, cache=cache)
     
     (args, varargs, varkw, defaults) = inspect.getargspec(f)
 
@@ -1913,7 +1937,9 @@ def interact(f):
 
     variables = {}
     adapt = {}
-    state[SAGE_CELL_ID] = {'variables':variables, 'adapt':adapt}
+    state[SAGE_CELL_ID] = {'variables':variables, 'adapt':adapt, 'raw':{}}
+    if cache > 0:
+        state[SAGE_CELL_ID]['cache'] = RecomputeCache(cache)
 
     for control in controls:
         variables[control.var()] = control.default_value()
@@ -2795,6 +2821,9 @@ def update(cell_id, var, adapt, value, globs):
         adapt_function = S["adapt"][adapt]
         # Apply that function and save the result in the appropriate variables dictionary.
         S["variables"][var] = adapt_function(value, globs)
+        # Remember the string the user gave, which is used as a key
+        # by cached interacts.
+        S["raw"][var] = value
     except KeyError:
         # If you change this, make sure to change js.py as well.
         print "__SAGE_INTERACT_RESTART__"
@@ -2816,8 +2845,252 @@ def recompute(cell_id):
     try:
         S = state[cell_id]
         # Finally call the interactive function, which will use the above variables.
-        S['function']()
+        if S.has_key('cache'):
+            raw = S['raw'].items()
+            raw.sort()
+            S['cache'].recompute(tuple(raw), S['function'])
+        else:
+            S['function']()
     except KeyError:
         # If you change this, make sure to change js.py as well.
         print "__SAGE_INTERACT_RESTART__"
+
+# Results of an interact function whose files take more than this
+# many bytes in total are not remembered by RecomputeCache, so a cache
+# holds at most maxsize times this many bytes of files.
+RECOMPUTE_CACHE_MAX_FILE_BYTES = 2**20
+
+class RecomputeCache:
+    def __init__(self, maxsize):
+        """
+        A bounded least-recently-used cache of the results of an
+        interact function, keyed by the values of its controls.  Each
+        result consists of the text the function printed and the
+        contents of the files in the current directory (the cell
+        directory) after it ran.  Results with more than
+        RECOMPUTE_CACHE_MAX_FILE_BYTES bytes of files are not
+        remembered.
+
+        INPUT:
+            maxsize -- positive integer; the maximum number of results
+                       to remember
+
+        EXAMPLES:
+            sage: C = sage.server.notebook.interact.RecomputeCache(2); C
+            Interact recompute cache with 0 of at most 2 results
+        """
+        self.__results = LRUCache(int(maxsize))
+
+    def __repr__(self):
+        """
+        EXAMPLES:
+            sage: sage.server.notebook.interact.RecomputeCache(5).__repr__()
+            'Interact recompute cache with 0 of at most 5 results'
+        """
+        return "Interact recompute cache with %s of at most %s results"%(len(self.__results), self.__results.maxsize())
+
+    def __len__(self):
+        """
+        Return the number of results in the cache.
+
+        EXAMPLES:
+            sage: C = sage.server.notebook.interact.RecomputeCache(5)
+            sage: def f(): print 'hi'
+            sage: C.recompute(('n', '1'), f)
+            hi
+            sage: len(C)
+            1
+        """
+        return len(self.__results)
+
+    def recompute(self, key, f):
+        """
+        Print the output and create the files of f(), reusing the
+        stored result if key has been seen before.
+
+        INPUT:
+            key -- a hashable object
+            f -- a function taking no arguments
+
+        EXAMPLES:
+            sage: C = sage.server.notebook.interact.RecomputeCache(2)
+            sage: v = []
+            sage: def f(): v.append(1); print len(v)
+            sage: C.recompute(1, f); C.recompute(2, f); C.recompute(1, f)
+            1
+            2
+            1
+            sage: C.recompute(3, f); C.recompute(2, f)
+            3
+            4
+            sage: len(C)
+            2
+
+        Results with large files are computed every time::
+
+            sage: import os; os.chdir(tmp_dir())
+            sage: def g(): open('big', 'w').write(' '*2**21); print 'done'
+            sage: C.recompute(4, g); len(C)
+            done
+            2
+        """
+        try:
+            output, files = self.__results[key]
+        except KeyError:
+            pass
+        else:
+            for filename, data in files:
+                open(filename, 'wb').write(data)
+            sys.stdout.write(output)
+            return
+
+        stdout = sys.stdout
+        sys.stdout = tee = _Tee(stdout)
+        try:
+            f()
+        finally:
+            sys.stdout = stdout
+        filenames = [filename for filename in os.listdir('.') if os.path.isfile(filename)]
+        if sum([os.path.getsize(filename) for filename in filenames]) > RECOMPUTE_CACHE_MAX_FILE_BYTES:
+            return
+        files = [(filename, open(filename, 'rb').read()) for filename in filenames]
+        self.__results[key] = (tee.getvalue(), files)
+
+class _Tee:
+    """
+    A file-like object that writes to stream and also remembers
+    everything written to it.
+    """
+    def __init__(self, stream):
+        self.__stream = stream
+        self.__buffer = StringIO()
+
+    def write(self, s):
+        self.__stream.write(s)
+        self.__buffer.write(s)
+
+    def getvalue(self):
+        return self.__buffer.getvalue()
+
+    def __getattr__(self, name):
+        return getattr(self.__stream, name)
         
+
+
+######################################################
+# Coalescing of update requests (used by the server)
+######################################################
+
+# These match exactly the Python strings generated by
+# InteractControl.interact and UpdateButton.  If you change the format
+# of those strings, make sure to change these as well.
+_update_re = re.compile(r'^sage\.server\.notebook\.interact\.update\((-?\d+), "(\w+)", (\d+), sage\.server\.notebook\.interact\.standard_b64decode\("([A-Za-z0-9+/=]*)"\), globals\(\)\)$')
+_recompute_re = re.compile(r'^sage\.server\.notebook\.interact\.recompute\((-?\d+)\)$')
+
+def parse_update_request(s):
+    """
+    Parse the Python code sent by the notebook when an interact
+    control changes, which is a sequence of calls to update and
+    recompute separated by semicolons.
+
+    INPUT:
+        s -- string
+
+    OUTPUT:
+        None if s is not of the standard form; otherwise a pair
+        (updates, recompute_ids), where updates is a list of tuples
+        (cell_id, var, adapt, b64value) and recompute_ids is a list
+        of cell ids to recompute.
+
+    EXAMPLES:
+        sage: from sage.server.notebook.interact import parse_update_request
+        sage: parse_update_request('sage.server.notebook.interact.update(3, "n", 7, sage.server.notebook.interact.standard_b64decode("NQ=="), globals());sage.server.notebook.interact.recompute(3)')
+        ([(3, 'n', 7, 'NQ==')], [3])
+        sage: parse_update_request('sage.server.notebook.interact.recompute(3)')
+        ([], [3])
+        sage: parse_update_request('os.system("ls")') is None
+        True
+    """
+    updates = []
+    recompute_ids = []
+    for t in s.strip().split(';'):
+        t = t.strip()
+        m = _update_re.match(t)
+        if m is not None:
+            cell_id, var, adapt, value = m.groups()
+            updates.append((int(cell_id), var, int(adapt), value))
+            continue
+        m = _recompute_re.match(t)
+        if m is not None:
+            cell_id = int(m.group(1))
+            if cell_id not in recompute_ids:
+                recompute_ids.append(cell_id)
+            continue
+        return None
+    return updates, recompute_ids
+
+def format_update_request(updates, recompute_ids):
+    """
+    Return the Python code that applies the given updates and then
+    recomputes the given cells.  This is the inverse of
+    parse_update_request.
+
+    INPUT:
+        updates -- list of tuples (cell_id, var, adapt, b64value)
+        recompute_ids -- list of integers
+
+    OUTPUT:
+        string
+
+    EXAMPLES:
+        sage: from sage.server.notebook.interact import format_update_request
+        sage: format_update_request([(3, 'n', 7, 'NQ==')], [3])
+        'sage.server.notebook.interact.update(3, "n", 7, sage.server.notebook.interact.standard_b64decode("NQ=="), globals());sage.server.notebook.interact.recompute(3)'
+    """
+    v = ['sage.server.notebook.interact.update(%s, "%s", %s, sage.server.notebook.interact.standard_b64decode("%s"), globals())'%u
+         for u in updates]
+    v += ['sage.server.notebook.interact.recompute(%s)'%i for i in recompute_ids]
+    return ';'.join(v)
+
+def coalesce_update_requests(old, new):
+    """
+    Combine two pending update requests into one, so that only the
+    latest value of each control is applied and each interact
+    function is recomputed at most once.
+
+    If either request is not of the standard form then the new
+    request simply replaces the old one.
+
+    INPUT:
+        old, new -- strings
+
+    OUTPUT:
+        string
+
+    EXAMPLES:
+        sage: from sage.server.notebook.interact import coalesce_update_requests, format_update_request
+        sage: a = format_update_request([(3, 'n', 7, 'MQ==')], [3])
+        sage: b = format_update_request([(3, 'm', 8, 'Mg==')], [])
+        sage: c = format_update_request([(3, 'n', 7, 'Mw==')], [3])
+        sage: coalesce_update_requests(coalesce_update_requests(a, b), c) == format_update_request([(3, 'n', 7, 'Mw=='), (3, 'm', 8, 'Mg==')], [3])
+        True
+        sage: coalesce_update_requests(a, 'print 5')
+        'print 5'
+    """
+    P = parse_update_request(old)
+    Q = parse_update_request(new)
+    if P is None or Q is None:
+        return new
+    updates, recompute_ids = P
+    position = dict([((u[0], u[1]), i) for i, u in enumerate(updates)])
+    for u in Q[0]:
+        key = (u[0], u[1])
+        if position.has_key(key):
+            updates[position[key]] = u
+        else:
+            position[key] = len(updates)
+            updates.append(u)
+    for i in Q[1]:
+        if i not in recompute_ids:
+            recompute_ids.append(i)
+    return format_update_request(updates, recompute_ids)
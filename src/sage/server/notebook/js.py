@@ -404,6 +404,38 @@ function get_keyboard_callback(status, response_text) {
 }
 
 
+function upload_with_progress(form) {
+    /*
+    Submit the upload form and show how much of the upload has been
+    received by the server in the element with id upload_progress.
+
+    INPUT:
+        form -- the upload form
+    */
+    var id = Math.floor(Math.random()*1e9).toString();
+    form.action = form.action.split('?')[0] + '?upload_id=' + id;
+    form.submit();
+    var progress = get_element('upload_progress');
+    if (!progress) {
+        return;
+    }
+    setInterval(function () {
+        async_request('/upload_progress?upload_id=' + id, function (status, response_text) {
+            var v = response_text.split(' ');
+            if (status != 'success' || v.length != 2) {
+                return;
+            }
+            var received = parseInt(v[0]) / 1048576;
+            var total = parseInt(v[1]) / 1048576;
+            var text = 'Received ' + received.toFixed(1) + ' MB';
+            if (total > 0) {
+                text += ' of ' + total.toFixed(1) + ' MB (' + Math.floor(100*received/total) + '%)';
+            }
+            progress.innerHTML = text;
+        });
+    }, 1000);
+}
+
 function get_element(id) {
     /*
     Return the DOM element with the given id.
@@ -2616,6 +2648,42 @@ function cycle_cell_output_type(id) {
     }
 }
 
+function sort_table_column(th) {
+    /*
+    Sort the rows of a table, e.g., the profile shown by %prun, by the
+    column of the header cell th.  Numbers are sorted in decreasing
+    order first; clicking the same header again reverses the order.
+
+    INPUT:
+        th -- a th element in the first row of a table
+    */
+    var header = th.parentNode;
+    var body = header.parentNode;
+    var col = 0;
+    for (var c = th.previousSibling; c; c = c.previousSibling) {
+        if (c.nodeType == 1) col++;
+    }
+    var rows = [];
+    for (var i = 0; i < body.rows.length; i++) {
+        if (body.rows[i] != header) rows.push(body.rows[i]);
+    }
+    var value = function(row) {
+        var s = row.cells[col].innerHTML;
+        var x = parseFloat(s);
+        return isNaN(x) ? s : x;
+    };
+    var descending = th.getAttribute('sorted') != 'descending';
+    rows.sort(function(a, b) {
+        var x = value(a), y = value(b);
+        var c = (x < y) ? -1 : ((x > y) ? 1 : 0);
+        return descending ? -c : c;
+    });
+    th.setAttribute('sorted', descending ? 'descending' : 'ascending');
+    for (var i = 0; i < rows.length; i++) {
+        body.appendChild(rows[i]);
+    }
+}
+
 function cell_set_evaluated(id) {
     /*
     Set the cell with given id to be evaluated.  This is purely a CSS style setting.
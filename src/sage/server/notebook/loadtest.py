@@ -0,0 +1,298 @@
+"""
+Load testing the notebook server
+
+This module starts a notebook server on localhost with a new notebook
+directory and a number of user accounts, and simulates users working
+with it at the same time, each in its own thread.  Every simulated
+user logs in, creates and opens a worksheet, then until the time is up
+repeatedly evaluates a cell and polls ``cell_update`` until it is
+done, the way the browser does, asks for introspection on a cell and
+lists their worksheets.
+
+The time taken by every request is recorded, and the number of
+requests per second and latency percentiles are reported for each
+endpoint, together with the time from sending a cell for evaluation to
+getting its output.  Nothing but the local machine is used.
+
+EXAMPLES::
+
+    sage: from sage.server.notebook.loadtest import load_test
+    sage: R = load_test(users=2, duration=10, verbose=False)   # long time
+    sage: sorted(R['endpoints'].keys())                         # long time
+    ['cell_update', 'eval', 'eval_round_trip', 'introspect', 'list',
+     'login', 'new_worksheet', 'open_worksheet']
+    sage: R['endpoints']['eval']['p90_seconds']                 # long time, random
+    0.0113
+"""
+
+#############################################################################
+#       Copyright (C) 2009 William Stein <wstein@gmail.com>
+#  Distributed under the terms of the GNU General Public License (GPL)
+#  The full text of the GPL is available at:
+#                  http://www.gnu.org/licenses/
+#############################################################################
+
+import cookielib
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+import urllib
+import urllib2
+
+# The cells evaluated by the simulated users, in turn.
+CELLS = ['2 + 2', 'factor(2^64 + 1)', 'sum(range(10^5))', 'var("x"); integrate(sin(x)^2, x)']
+
+# The text before the cursor when asking for introspection.
+INTROSPECT = 'fact'
+
+# Order of the endpoints in the report.
+ENDPOINTS = ['login', 'new_worksheet', 'open_worksheet', 'eval', 'cell_update',
+             'eval_round_trip', 'introspect', 'list']
+
+def load_test(users=10, duration=60, port=8500, think_time=0.5, poll_interval=0.1,
+              timeout=120, filename=None, verbose=True):
+    """
+    Start a notebook server and report how it copes with several
+    users using it at the same time.
+
+    INPUT:
+
+    - ``users`` - integer (default: 10); number of simulated users
+
+    - ``duration`` - number (default: 60); seconds during which the
+      users keep evaluating cells, after they have logged in and
+      opened a worksheet
+
+    - ``port`` - integer (default: 8500); the server uses the first
+      free port from this one on
+
+    - ``think_time`` - number (default: 0.5); seconds a user waits
+      between two actions
+
+    - ``poll_interval`` - number (default: 0.1); seconds between two
+      ``cell_update`` requests for the same computation
+
+    - ``timeout`` - number (default: 120); seconds after which a
+      request or computation is counted as failed
+
+    - ``filename`` - string (default: None); if given, the report is
+      written to this file as JSON
+
+    - ``verbose`` - bool (default: True); print the report
+
+    OUTPUT: a dictionary with the parameters, the Sage version, date
+    and host and, under 'endpoints', a dictionary giving for each
+    endpoint the number of requests and errors, the requests per
+    second, and the mean, 50th, 90th and 99th percentile and maximum
+    latency in seconds.
+    """
+    from sage.version import version
+    from sage.server.misc import find_next_available_port
+    from notebook_object import test_notebook
+    import notebook as _notebook
+
+    port = find_next_available_port(port, verbose=False)
+    directory = tempfile.mkdtemp()
+    nb = _notebook.load_notebook(directory)
+    nb.set_accounts(True)
+    passwords = {}
+    for i in range(users):
+        username = 'loadtest%s'%i
+        passwords[username] = '%x'%random.randint(0, 2**64)
+        nb.add_user(username, passwords[username], '')
+    nb.save()
+    del nb
+
+    old_timeout = socket.getdefaulttimeout()
+    socket.setdefaulttimeout(timeout)
+    server = test_notebook('%x'%random.randint(0, 2**128), directory=directory,
+                           port=port, address='localhost')
+    try:
+        url = 'http://localhost:%s'%port
+        _wait_for_server(url, timeout)
+        stop = []
+        latencies = dict([(e, []) for e in ENDPOINTS])
+        errors = dict([(e, []) for e in ENDPOINTS])
+        threads = [SimulatedUser(url, username, passwords[username], latencies, errors,
+                                 stop, think_time, poll_interval, timeout)
+                   for username in passwords.keys()]
+        start = time.time()
+        for T in threads:
+            T.start()
+        time.sleep(duration)
+        stop.append(True)
+        for T in threads:
+            T.join()
+        elapsed = time.time() - start
+    finally:
+        socket.setdefaulttimeout(old_timeout)
+        server.dispose()
+
+    R = {'sage_version': version,
+         'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+         'host': os.uname()[1],
+         'parameters': {'users': users, 'duration': duration, 'think_time': think_time,
+                        'poll_interval': poll_interval},
+         'elapsed_seconds': elapsed,
+         'endpoints': dict([(e, _summary(latencies[e], errors[e], elapsed))
+                            for e in ENDPOINTS]),
+         'errors': dict([(e, errors[e][:10]) for e in ENDPOINTS if errors[e]])}
+    if filename is not None:
+        from sage.misc.jsonify import jsonify
+        open(filename, 'w').write(jsonify(R, indent=2) + '\n')
+    if verbose:
+        _print_report(R)
+    return R
+
+class SimulatedUser(threading.Thread):
+    """
+    A thread that logs into the notebook server at url and works with
+    a worksheet until stop is not empty, appending the time taken by
+    every request to latencies and the error messages to errors,
+    which are dictionaries of lists indexed by the endpoints.
+    """
+    def __init__(self, url, username, password, latencies, errors, stop,
+                 think_time=0.5, poll_interval=0.1, timeout=120):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.__url = url
+        self.__username = username
+        self.__password = password
+        self.__latencies = latencies
+        self.__errors = errors
+        self.__stop = stop
+        self.__think_time = think_time
+        self.__poll_interval = poll_interval
+        self.__timeout = timeout
+        self.__opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(cookielib.CookieJar()))
+
+    def run(self):
+        try:
+            self.request('login', '/')   # sets the cookie_test cookie
+            self.request('login', '/login', {'email': self.__username,
+                                             'password': self.__password})
+            worksheet = self.request('new_worksheet', '/new_worksheet', url=True)
+            worksheet = worksheet[len(self.__url):].rstrip('/')
+            self.request('open_worksheet', worksheet + '/')
+        except Exception, msg:
+            self.__errors['login'].append('%s: %s'%(self.__username, msg))
+            return
+        id = 0
+        n = 0
+        while not self.__stop:
+            try:
+                t = time.time()
+                self.request('eval', worksheet + '/eval', {'id': id, 'newcell': 0,
+                                                           'input': CELLS[n % len(CELLS)]})
+                self.wait_for_cell(worksheet, id)
+                self.__latencies['eval_round_trip'].append(time.time() - t)
+                self.think()
+                self.request('introspect', worksheet + '/introspect',
+                             {'id': id, 'before_cursor': INTROSPECT, 'after_cursor': ''})
+                self.wait_for_cell(worksheet, id)
+                self.think()
+                self.request('list', '/home/%s/'%self.__username)
+                self.think()
+            except Exception, msg:
+                self.__errors['eval_round_trip'].append('%s: %s'%(self.__username, msg))
+            n += 1
+
+    def request(self, endpoint, path, data=None, url=False):
+        """
+        Request path, with the dictionary data as POST data if it is
+        given, record the time taken under endpoint and return the
+        response body, or the final URL if url is True.
+        """
+        if data is not None:
+            data = urllib.urlencode(data)
+        t = time.time()
+        try:
+            h = self.__opener.open(self.__url + path, data)
+            body = h.read()
+            final_url = h.geturl()
+            h.close()
+        except Exception, msg:
+            self.__errors[endpoint].append('%s: %s'%(path, msg))
+            raise
+        self.__latencies[endpoint].append(time.time() - t)
+        if url:
+            return final_url
+        return body
+
+    def wait_for_cell(self, worksheet, id):
+        """
+        Poll cell_update for the cell with the given id of worksheet
+        until its computation is done.
+        """
+        t = time.time()
+        while True:
+            s = self.request('cell_update', worksheet + '/cell_update', {'id': id})
+            if s.startswith('d'):
+                return
+            if time.time() - t > self.__timeout:
+                raise RuntimeError, "cell %s of %s still computing after %s seconds"%(
+                    id, worksheet, self.__timeout)
+            time.sleep(self.__poll_interval)
+
+    def think(self):
+        if self.__think_time:
+            time.sleep(random.uniform(0.5, 1.5)*self.__think_time)
+
+def percentile(values, p):
+    """
+    Return the p-th percentile of the sorted list values, by the
+    nearest rank method, or None if values is empty.
+
+    EXAMPLES::
+
+        sage: from sage.server.notebook.loadtest import percentile
+        sage: v = range(1, 101)
+        sage: percentile(v, 50), percentile(v, 99), percentile(v, 100)
+        (50, 99, 100)
+        sage: percentile([3], 10), percentile([], 50)
+        (3, None)
+    """
+    if not values:
+        return None
+    k = -(-p*len(values)//100)   # the ceiling of p*len(values)/100
+    return values[max(int(k), 1) - 1]
+
+def _summary(latencies, errors, elapsed):
+    v = sorted(latencies)
+    R = {'requests': len(v), 'errors': len(errors),
+         'requests_per_second': len(v)/max(elapsed, 1e-6)}
+    if v:
+        R['mean_seconds'] = sum(v)/len(v)
+    else:
+        R['mean_seconds'] = None
+    for p in [50, 90, 99]:
+        R['p%s_seconds'%p] = percentile(v, p)
+    R['max_seconds'] = percentile(v, 100)
+    return R
+
+def _wait_for_server(url, timeout):
+    t = time.time()
+    while True:
+        try:
+            urllib2.urlopen(url).close()
+            return
+        except IOError:
+            if time.time() - t > timeout:
+                raise
+            time.sleep(0.2)
+
+def _print_report(R):
+    print "%s users for %.1f seconds"%(R['parameters']['users'], R['elapsed_seconds'])
+    print "%-16s %8s %7s %8s %8s %8s %8s %8s"%('endpoint', 'requests', 'errors', 'req/s',
+                                               'mean', 'p50', 'p90', 'p99')
+    for e in ENDPOINTS:
+        S = R['endpoints'][e]
+        times = ['%8s'%(x is None and '-' or '%.4f'%x) for x in
+                 [S['mean_seconds'], S['p50_seconds'], S['p90_seconds'], S['p99_seconds']]]
+        print "%-16s %8s %7s %8.2f %s"%(e, S['requests'], S['errors'],
+                                        S['requests_per_second'], ' '.join(times))
+    for e, msgs in R['errors'].iteritems():
+        print "%s failed: %s"%(e, msgs[0].split('\n')[0])
@@ -0,0 +1,246 @@
+"""
+Notebook server metrics
+
+The notebook server records how long it takes to render each request
+and how many bytes it sends back, grouped by the class of the resource
+that rendered the request.  Work that the server does synchronously
+on behalf of every user, such as saving the whole notebook or
+checking on the worksheet processes, blocks the reactor and is
+recorded separately under the name of what was done.
+
+Admins can see the metrics at ``/metrics``, in the plain text format
+read by Prometheus, and a summary is written to the server log every
+``metrics_log_interval`` seconds (0 to disable).
+
+EXAMPLES::
+
+    sage: from sage.server.notebook.metrics import Metrics
+    sage: M = Metrics()
+    sage: M.record_request('Worksheet_eval', 0.02, 512)
+    sage: M.record_request('Worksheet_eval', 0.3, 2048)
+    sage: M.time_blocking('notebook_save', sum, range(10))
+    45
+    sage: print M.exposition()
+    # HELP sage_notebook_request_seconds Time taken to render a request.
+    # TYPE sage_notebook_request_seconds histogram
+    sage_notebook_request_seconds_bucket{resource="Worksheet_eval",le="0.005"} 0
+    ...
+    sage_notebook_request_seconds_bucket{resource="Worksheet_eval",le="0.025"} 1
+    ...
+    sage_notebook_request_seconds_bucket{resource="Worksheet_eval",le="+Inf"} 2
+    sage_notebook_request_seconds_sum{resource="Worksheet_eval"} 0.32
+    sage_notebook_request_seconds_count{resource="Worksheet_eval"} 2
+    # HELP sage_notebook_response_bytes_total Bytes in the bodies of responses.
+    # TYPE sage_notebook_response_bytes_total counter
+    sage_notebook_response_bytes_total{resource="Worksheet_eval"} 2560
+    # HELP sage_notebook_blocking_seconds Time the server was blocked by synchronous work.
+    # TYPE sage_notebook_blocking_seconds histogram
+    sage_notebook_blocking_seconds_bucket{section="notebook_save",le="0.005"} 1
+    ...
+    sage_notebook_blocking_seconds_count{section="notebook_save"} 1
+    # HELP sage_notebook_uptime_seconds Time since the metrics were reset.
+    # TYPE sage_notebook_uptime_seconds gauge
+    sage_notebook_uptime_seconds ...
+"""
+
+#############################################################################
+#       Copyright (C) 2009 William Stein <wstein@gmail.com>
+#  Distributed under the terms of the GNU General Public License (GPL)
+#  The full text of the GPL is available at:
+#                  http://www.gnu.org/licenses/
+#############################################################################
+
+import time
+from bisect import bisect_left
+
+# Upper bounds in seconds of the buckets of the latency histograms.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    """
+    A histogram of values, which counts the values at most each of the
+    upper bounds buckets, and keeps their number and sum.
+
+    EXAMPLES::
+
+        sage: from sage.server.notebook.metrics import Histogram
+        sage: H = Histogram((1, 2))
+        sage: for x in [0.5, 1, 1.5, 3]: H.observe(x)
+        sage: H.cumulative_counts()
+        [(1, 2), (2, 3), ('+Inf', 4)]
+        sage: H.count, H.sum
+        (4, 6.0)
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0]*(len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """
+        Add value to the histogram.
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self):
+        """
+        Return a list of pairs (bound, number of values at most bound),
+        the last bound being '+Inf'.
+        """
+        v = []
+        n = 0
+        for bound, c in zip(self.buckets + ('+Inf',), self.counts):
+            n += c
+            v.append((bound, n))
+        return v
+
+class Metrics:
+    """
+    The request and blocking time metrics of a notebook server.
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.__buckets = buckets
+        self.reset()
+
+    def reset(self):
+        """
+        Forget everything recorded so far.
+        """
+        self.__start = time.time()
+        self.__requests = {}
+        self.__bytes = {}
+        self.__blocking = {}
+        self.__last_log = (self.__start, 0, 0.0, 0, 0.0)
+
+    def record_request(self, resource, seconds, nbytes=0):
+        """
+        Record that a request rendered by resource took the given
+        number of seconds and that nbytes were sent back.
+
+        INPUT:
+
+        - ``resource`` - string; the name of the resource
+
+        - ``seconds`` - float
+
+        - ``nbytes`` - integer (default: 0)
+        """
+        try:
+            H = self.__requests[resource]
+        except KeyError:
+            H = self.__requests[resource] = Histogram(self.__buckets)
+            self.__bytes[resource] = 0
+        H.observe(seconds)
+        self.__bytes[resource] += nbytes
+
+    def record_blocking(self, section, seconds):
+        """
+        Record that the server was blocked for the given number of
+        seconds by the synchronous work named section.
+        """
+        try:
+            H = self.__blocking[section]
+        except KeyError:
+            H = self.__blocking[section] = Histogram(self.__buckets)
+        H.observe(seconds)
+
+    def time_blocking(self, section, f, *args, **kwds):
+        """
+        Call f with the given arguments, record the time it took
+        as blocking time of section, and return its result.
+
+        EXAMPLES::
+
+            sage: from sage.server.notebook.metrics import Metrics
+            sage: M = Metrics()
+            sage: M.time_blocking('sleep', sleep, 0.01)
+            sage: 'section="sleep",le="0.025"} 1' in M.exposition()
+            True
+        """
+        t = time.time()
+        try:
+            return f(*args, **kwds)
+        finally:
+            self.record_blocking(section, time.time() - t)
+
+    def exposition(self):
+        """
+        Return the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        _histograms(lines, 'sage_notebook_request_seconds', 'resource',
+                    'Time taken to render a request.', self.__requests)
+        lines.append('# HELP sage_notebook_response_bytes_total Bytes in the bodies of responses.')
+        lines.append('# TYPE sage_notebook_response_bytes_total counter')
+        names = self.__bytes.keys()
+        names.sort()
+        for name in names:
+            lines.append('sage_notebook_response_bytes_total{resource="%s"} %s'%(
+                _escape_label(name), self.__bytes[name]))
+        _histograms(lines, 'sage_notebook_blocking_seconds', 'section',
+                    'Time the server was blocked by synchronous work.', self.__blocking)
+        lines.append('# HELP sage_notebook_uptime_seconds Time since the metrics were reset.')
+        lines.append('# TYPE sage_notebook_uptime_seconds gauge')
+        lines.append('sage_notebook_uptime_seconds %.3f'%(time.time() - self.__start))
+        return '\n'.join(lines) + '\n'
+
+    def log_line(self):
+        """
+        Return a one line summary of the requests and blocking time
+        since the previous call, and of the resource and section with
+        the most time overall.
+
+        EXAMPLES::
+
+            sage: from sage.server.notebook.metrics import Metrics
+            sage: M = Metrics()
+            sage: M.record_request('Worksheet_cell_update', 0.25, 1000)
+            sage: M.record_blocking('notebook_save', 1.5)
+            sage: M.log_line()
+            'metrics: 1 requests in ...s, 0.250s mean, 1000 bytes; blocked 1.500s; top Worksheet_cell_update 0.250s, notebook_save 1.500s'
+            sage: M.log_line()
+            'metrics: 0 requests in ...s, 0.000s mean, 0 bytes; blocked 0.000s; top Worksheet_cell_update 0.250s, notebook_save 1.500s'
+        """
+        now = time.time()
+        count = sum([H.count for H in self.__requests.itervalues()])
+        total = sum([H.sum for H in self.__requests.itervalues()])
+        nbytes = sum(self.__bytes.itervalues())
+        blocked = sum([H.sum for H in self.__blocking.itervalues()])
+        t, c, s, b, k = self.__last_log
+        self.__last_log = (now, count, total, nbytes, blocked)
+        n = count - c
+        if n:
+            mean = (total - s)/n
+        else:
+            mean = 0.0
+        return 'metrics: %s requests in %.0fs, %.3fs mean, %s bytes; blocked %.3fs; top %s, %s'%(
+            n, now - t, mean, nbytes - b, blocked - k,
+            _top(self.__requests), _top(self.__blocking))
+
+def _histograms(lines, metric, label, help, histograms):
+    lines.append('# HELP %s %s'%(metric, help))
+    lines.append('# TYPE %s histogram'%metric)
+    names = histograms.keys()
+    names.sort()
+    for name in names:
+        H = histograms[name]
+        labels = '%s="%s"'%(label, _escape_label(name))
+        for bound, n in H.cumulative_counts():
+            lines.append('%s_bucket{%s,le="%s"} %s'%(metric, labels, bound, n))
+        lines.append('%s_sum{%s} %r'%(metric, labels, H.sum))
+        lines.append('%s_count{%s} %s'%(metric, labels, H.count))
+
+def _escape_label(s):
+    return s.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _top(histograms):
+    if not histograms:
+        return 'none'
+    name, H = max(histograms.iteritems(), key=lambda x: x[1].sum)
+    return '%s %.3fs'%(name, H.sum)
+
+# The metrics of the running notebook server.
+server_metrics = Metrics()
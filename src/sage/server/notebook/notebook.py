@@ -39,6 +39,8 @@ import keyboards    # keyboard layouts
 import server_conf  # server configuration
 import user_conf    # user configuration
 import user         # users
+import sws          # reading and writing sws files
+import blobstore    # shared storage of identical worksheet files
 
 from cgi import escape
 
@@ -587,13 +589,20 @@ class Notebook(SageObject):
         ``src`` and ``W`` are worksheets and
         ``W`` is brand new.
         """
-        # Copy over images and other files
+        # Copy over images and other files.  The files are shared
+        # with src through the blob store, except when the compute
+        # process of src is running, since it might modify its data
+        # and cell files in place.
+        if src.compute_process_has_been_started():
+            copytree = shutil.copytree
+        else:
+            copytree = self.blob_store().copytree
         data = src.data_directory()
         if os.path.exists(data):
-            shutil.copytree(data, W.directory() + '/data')
+            copytree(data, W.directory() + '/data')
         cells = src.cells_directory()
         if os.path.exists(cells):
-            shutil.copytree(cells, W.directory() + '/cells')
+            copytree(cells, W.directory() + '/cells')
         W.edit_save(src.edit_text())
 
     def publish_worksheet(self, worksheet, username):
@@ -633,6 +642,7 @@ class Notebook(SageObject):
                 X.move_to_archive(username)
                 worksheet.set_published_version(X.filename())
                 X.record_edit(username)
+                X.html()   # render the page now, not for the first reader
                 return X
 
         # Have to create a new worksheet
@@ -641,6 +651,7 @@ class Notebook(SageObject):
         W.set_worksheet_that_was_published(worksheet)
         W.move_to_archive(username)
         worksheet.set_published_version(W.filename())
+        W.html()
         return W
 
     ##########################################################
@@ -695,6 +706,9 @@ class Notebook(SageObject):
         """
         Delete the given worksheet and remove its name from the worksheet
         list.
+
+        The files in the blob store that were only used by this
+        worksheet are deleted by the next call to collect_garbage.
         """
         if not (filename in self.__worksheets.keys()):
             print self.__worksheets.keys()
@@ -704,6 +718,39 @@ class Notebook(SageObject):
         shutil.rmtree(W.directory(), ignore_errors=True)
         self.deleted_worksheets()[filename] = W
         del self.__worksheets[filename]
+        self.__blob_garbage = True
+
+    def collect_garbage(self):
+        """
+        Delete the files in the blob store that no worksheet uses
+        anymore, if worksheets were deleted since the last call.  The
+        notebook server calls this every save_interval seconds, since
+        it scans the whole blob store.
+
+        OUTPUT:
+            pair (number of files deleted, number of bytes freed)
+
+        EXAMPLES::
+
+            sage: nb = sage.server.notebook.notebook.Notebook(tmp_dir())
+            sage: nb.add_user('sage','sage','sage@sagemath.org',force=True)
+            sage: W = nb.new_worksheet_with_title_from_text('Sage', owner='sage')
+            sage: open(W.data_directory() + 'a', 'w').write('foo')
+            sage: V = nb.copy_worksheet(W, 'sage')
+            sage: nb.delete_worksheet(W.filename()); nb.delete_worksheet(V.filename())
+            sage: nb.collect_garbage()
+            (1, 3)
+            sage: nb.collect_garbage()
+            (0, 0)
+        """
+        try:
+            if not self.__blob_garbage:
+                return 0, 0
+        except AttributeError:
+            # notebooks saved before this was kept track of
+            pass
+        self.__blob_garbage = False
+        return self.blob_store().collect_garbage()
 
     def deleted_worksheets(self):
         try:
@@ -872,21 +919,15 @@ class Notebook(SageObject):
 
     def create_new_worksheet_from_history(self, name, username, maxlen=None):
         W = self.create_new_worksheet(name, username)
-        W.edit_save('Log Worksheet\n' + self.user_history_text(username, maxlen=None))
+        W.edit_save('Log Worksheet\n' + self.user_history_text(username, maxlen=maxlen))
         return W
         
     def user_history_text(self, username, maxlen=None):
-        H = self.user_history(username)
-        if maxlen:
-            H = H[-maxlen:]
-        return '\n\n'.join([L.strip() for L in H])
+        U = self.user(username)
+        return '\n\n'.join([L.strip() for L in U.history_entries(maxlen)])
 
     def add_to_user_history(self, entry, username):
-        H = self.user_history(username)
-        H.append(entry)
-        maxlen = self.user_conf(username)['max_history_length']
-        while len(H) > maxlen:
-            del H[0]
+        self.user(username).add_to_history(entry)
 
     def add_to_history(self, input_text):
         H = self.history()
@@ -952,22 +993,40 @@ class Notebook(SageObject):
         -  ``output_filename`` - string
         
         -  ``verbose`` - bool (default: True) if True print
-           some the tar command used to extract the sws file.
+           the name of the file the worksheet is written to.
         
         
         OUTPUT: creates a file on the filesystem
         """
+        if verbose:
+            print "Exporting worksheet '%s' to '%s'"%(worksheet_filename, output_filename)
+        sws.write_sws(*self.export_worksheet_args(worksheet_filename) + (output_filename,))
+
+    def export_worksheet_chunks(self, worksheet_filename):
+        """
+        Return an iterator over the pieces of the sws file of the
+        worksheet with given filename, which are produced as they are
+        consumed.  This is used to send a worksheet to a web browser
+        without storing the whole file anywhere.
+        
+        INPUT:
+        
+        
+        -  ``worksheet_filename`` - string
+        
+        
+        OUTPUT: iterator over strings
+        """
+        return sws.sws_chunks(*self.export_worksheet_args(worksheet_filename))
+
+    def export_worksheet_args(self, worksheet_filename):
+        """
+        Save the worksheet with given filename and return its directory
+        and the name of the top directory in its sws file.
+        """
         W = self.get_worksheet_with_filename(worksheet_filename)
         W.save()
-        path = W.filename_without_owner()
-        cmd = 'cd "%s/%s/" && tar -jcf "%s" "%s"'%(
-            self.__worksheet_dir, W.owner(),
-            os.path.abspath(output_filename), path)
-        if verbose:
-            print cmd
-        e = os.system(cmd)
-        if e:
-            print "Failed to execute command to export worksheet:\n'%s'"%cmd
+        return W.directory(), W.filename_without_owner()
 
     def new_worksheet_with_title_from_text(self, text, owner):
         name, _ = worksheet.extract_name(text)
@@ -1080,7 +1139,7 @@ class Notebook(SageObject):
         -  ``owner`` - string
         
         -  ``verbose`` - bool (default: True) if True print
-           some the tar command used to extract the sws file.
+           the name of the file being imported.
         
         
         OUTPUT: a new worksheet
@@ -1115,22 +1174,67 @@ class Notebook(SageObject):
             sage: nb.worksheet_names()
             ['admin/0', 'admin/2']
         """
-        # Decompress the worksheet to a temporary directory.
-        tmp = tmp_dir()
-        cmd = 'cd "%s"; tar -jxf "%s"'%(tmp, os.path.abspath(filename))
         if verbose:
-            print cmd
-        e = os.system(cmd)
-        if e:
-            raise ValueError, "Error decompressing saved worksheet."
+            print "Importing worksheet from '%s'"%filename
+        f = open(filename, 'rb')
+        try:
+            return self.import_worksheet_sws_stream(f, owner)
+        finally:
+            f.close()
+
+    def import_worksheet_sws_stream(self, fileobj, owner):
+        r"""
+        Import an sws format worksheet that is read from a file-like
+        object into this notebook as a new worksheet.
 
-        # Find the worksheet text representation and load it into memory.
+        The archive is extracted a file at a time into a directory next
+        to the worksheets of ``owner``, which is then renamed to be the
+        directory of the new worksheet, so the data files are written
+        to disk only once.
+        
+        INPUT:
+        
+        
+        -  ``fileobj`` - a file-like object with a read method
+        
+        -  ``owner`` - string
+        
+        
+        OUTPUT: a new worksheet
+        """
+        owner_dir = '%s/%s'%(os.path.abspath(self.__worksheet_dir), owner)
+        if not os.path.exists(owner_dir):
+            os.makedirs(owner_dir)
+        tmp = '%s/.import-%s'%(owner_dir, random.randint(0, 2**31))
+        os.makedirs(tmp)
         try:
-            D = os.listdir(tmp)[0]
-        except IndexError:
-            raise ValueError, "invalid worksheet"
-        text_filename = '%s/%s/worksheet.txt'%(tmp,D)
-        worksheet_txt = open(text_filename).read()
+            D = sws.extract_sws(fileobj, tmp)
+
+            # Find the worksheet text representation and load it into memory.
+            text_filename = '%s/%s/worksheet.txt'%(tmp,D)
+            if not os.path.exists(text_filename):
+                raise ValueError, "invalid worksheet"
+            worksheet_txt = open(text_filename).read()
+            worksheet = self._new_imported_worksheet(worksheet_txt, owner)
+
+            # Put the worksheet files in the target directory.
+            target = '%s/%s'%(os.path.abspath(self.__worksheet_dir), worksheet.filename())
+            if os.path.exists(target):
+                shutil.rmtree(target)
+            os.rename('%s/%s'%(tmp, D), target)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        self.share_worksheet_files(worksheet)
+        worksheet.edit_save(worksheet_txt)
+        return worksheet
+
+    def _new_imported_worksheet(self, worksheet_txt, owner):
+        """
+        Create a new worksheet from the text of an imported worksheet,
+        changing its filename and display name if they clash with those
+        of the other worksheets of owner.
+        """
         worksheet = self.new_worksheet_with_title_from_text(worksheet_txt, owner)
         worksheet.set_owner(owner)
         name = worksheet.filename_without_owner()
@@ -1156,22 +1260,6 @@ class Notebook(SageObject):
                 i += 1
             name = name + " (%s)"%i
             worksheet.set_name(name)
-
-
-        # Put the worksheet files in the target directory.
-        S = self.__worksheet_dir
-        target = '%s/%s'%(os.path.abspath(S), worksheet.filename())
-        if not os.path.exists(target):
-            os.makedirs(target)
-        cmd = 'rm -rf "%s"/*; mv "%s/%s/"* "%s/"'%(target, tmp, D, target)
-        #print cmd
-        if os.system(cmd):
-            raise ValueError, "Error moving over files when loading worksheet."
-
-        worksheet.edit_save(worksheet_txt)
-        
-        shutil.rmtree(tmp, ignore_errors=True)
-
         return worksheet
 
 
@@ -1216,6 +1304,41 @@ class Notebook(SageObject):
     def worksheet_directory(self):
         return self.__worksheet_dir
 
+    def blob_store(self):
+        """
+        Return the store in which the files shared by several
+        worksheets are kept (see sage.server.notebook.blobstore).
+
+        EXAMPLES::
+
+            sage: nb = sage.server.notebook.notebook.Notebook(tmp_dir())
+            sage: nb.blob_store().directory()
+            '.../blobs'
+        """
+        return blobstore.BlobStore('%s/blobs'%self.__dir)
+
+    def share_worksheet_files(self, W):
+        """
+        Replace the data files and cell output of the worksheet W by
+        links to identical files in the blob store.
+
+        EXAMPLES::
+
+            sage: nb = sage.server.notebook.notebook.Notebook(tmp_dir())
+            sage: nb.add_user('sage','sage','sage@sagemath.org',force=True)
+            sage: W = nb.create_new_worksheet('Test', 'sage')
+            sage: open(W.data_directory() + 'a', 'w').write('foo')
+            sage: V = nb.create_new_worksheet('Test2', 'sage')
+            sage: open(V.data_directory() + 'a', 'w').write('foo')
+            sage: nb.share_worksheet_files(W); nb.share_worksheet_files(V)
+            sage: os.stat(W.data_directory() + 'a').st_nlink
+            3
+        """
+        B = self.blob_store()
+        for D in [W.directory() + '/data', W.cells_directory()]:
+            if os.path.exists(D):
+                B.add_tree(D)
+
     def __makedirs(self):
         if not os.path.exists(self.__dir):
             os.makedirs(self.__dir)
@@ -2144,7 +2267,8 @@ function save_worksheet_and_close() {
               </td>
               </tr>
               <tr>
-              <td><br><input type="button" class="upload_worksheet_menu" value="Upload File" onClick="form.submit();"></td>
+              <td><br><input type="button" class="upload_worksheet_menu" value="Upload File" onClick="upload_with_progress(form);">
+              <span id="upload_progress"></span></td>
               </tr>
               </form><br>
               </div>
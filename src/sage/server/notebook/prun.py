@@ -0,0 +1,190 @@
+"""
+Profiling notebook cells
+
+A cell whose first line is the percent directive ``%prun`` is run
+under the deterministic profiler cProfile, while the call stack is
+also sampled at regular intervals of CPU time.  When the cell is done,
+its output is followed by a table of the functions that took the most
+time, which can be sorted by clicking on a column header, and the
+following files are written to the cell directory:
+
+- ``profile.txt`` - the complete table, as printed by pstats
+
+- ``profile.pstats`` - the profile data, which can be loaded with
+  ``pstats.Stats``
+
+- ``profile.stacks`` - the sampled call stacks in the collapsed
+  format read by flame graph tools: one line per distinct stack, with
+  the functions from the outermost to the innermost separated by
+  semicolons, followed by the number of samples
+
+This module is used in the compute process of a worksheet; cells
+without the directive do not import it and run without any overhead.
+
+EXAMPLES::
+
+    sage: from sage.server.notebook.prun import run_cell
+    sage: F = tmp_filename() + '.py'
+    sage: open(F, 'w').write('s = sum(range(10^5))')
+    sage: os.chdir(tmp_dir())
+    sage: run_cell(F, globals(), limit=3)
+    <html>...</html>
+    sage: s
+    4999950000
+    sage: sorted(os.listdir('.'))
+    ['profile.pstats', 'profile.stacks', 'profile.txt']
+"""
+
+#############################################################################
+#       Copyright (C) 2009 William Stein <wstein@gmail.com>
+#  Distributed under the terms of the GNU General Public License (GPL)
+#  The full text of the GPL is available at:
+#                  http://www.gnu.org/licenses/
+#############################################################################
+
+import cProfile
+import os
+import pstats
+import signal
+import sys
+from cgi import escape
+
+# Seconds of CPU time between two samples of the call stack.
+SAMPLE_INTERVAL = 0.005
+
+# Number of rows of the table shown in the cell output.
+LIMIT = 40
+
+# Frames of cProfile itself are left out of the sampled stacks.
+_profiler_code = [cProfile.Profile.runctx.im_func.func_code,
+                  cProfile.Profile.runcall.im_func.func_code]
+
+def run_cell(filename, globals, limit=LIMIT):
+    """
+    Execute the code in the file filename in the namespace globals
+    while profiling it, then print an HTML table of the profile and
+    write the profile to files in the current directory.
+
+    INPUT:
+
+    - ``filename`` - string; a file of Python code
+
+    - ``globals`` - dictionary
+
+    - ``limit`` - integer (default: 40); the number of functions
+      shown in the table
+
+    If the code raises an exception, the profile up to that point is
+    still written, and the exception is raised again.
+    """
+    code = compile(open(filename).read(), filename, 'exec')
+    profiler = cProfile.Profile()
+    sampler = StackSampler()
+    sampler.start()
+    try:
+        profiler.runctx(code, globals, globals)
+    finally:
+        sampler.stop()
+        out = open('profile.txt', 'w')
+        stats = pstats.Stats(profiler, stream=out)
+        stats.sort_stats('cumulative').print_stats()
+        out.close()
+        stats.dump_stats('profile.pstats')
+        sampler.write('profile.stacks')
+        print html_table(stats, limit)
+
+def html_table(stats, limit=LIMIT):
+    """
+    Return an HTML table of the limit functions of the pstats.Stats
+    object stats that took the most time including subcalls.
+
+    EXAMPLES::
+
+        sage: import cProfile, pstats
+        sage: from sage.server.notebook.prun import html_table
+        sage: P = cProfile.Profile(); P.runcall(factor, 2^30 + 1)
+        5^2 * 13 * 41 * 61 * 1321
+        sage: print html_table(pstats.Stats(P), 1)
+        <html><table class="profile">
+        <tr><th onClick="sort_table_column(this);">ncalls</th>...
+        </table></html>
+    """
+    columns = ['ncalls', 'tottime', 'percall', 'cumtime', 'percall',
+               'filename:lineno(function)']
+    rows = ['<tr>%s</tr>'%''.join(['<th onClick="sort_table_column(this);">%s</th>'%c
+                                   for c in columns])]
+    entries = stats.stats.items()
+    entries.sort(key=lambda x: -x[1][3])
+    for func, (cc, nc, tt, ct, callers) in entries[:limit]:
+        if cc == nc:
+            ncalls = str(nc)
+        else:
+            ncalls = '%s/%s'%(nc, cc)
+        values = [ncalls, '%.3f'%tt, '%.3f'%(tt/max(nc, 1)), '%.3f'%ct, '%.3f'%(ct/max(cc, 1)),
+                  escape(pstats.func_std_string(func))]
+        rows.append('<tr>%s</tr>'%''.join(['<td>%s</td>'%v for v in values]))
+    return '<html><table class="profile">\n%s\n</table></html>'%'\n'.join(rows)
+
+class StackSampler:
+    """
+    Count the call stacks found at regular intervals of CPU time.
+
+    Sampling needs signal.setitimer, which is new in Python 2.6; with
+    older versions of Python, no stacks are recorded.
+
+    EXAMPLES::
+
+        sage: from sage.server.notebook.prun import StackSampler
+        sage: S = StackSampler(0.001); S.start()
+        sage: _ = factor(2^200 - 1)
+        sage: S.stop()
+        sage: F = tmp_filename(); S.write(F)
+        sage: open(F).read()    # random
+        'factor (arith.py:1847);factor (integer.pyx:2802) 12\\n'
+    """
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.__interval = interval
+        self.__counts = {}
+        self.__old_handler = None
+
+    def start(self):
+        """
+        Start sampling the stack of the current thread.
+        """
+        if not hasattr(signal, 'setitimer'):
+            return
+        self.__top = sys._getframe(1)
+        self.__old_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.__interval, self.__interval)
+
+    def stop(self):
+        """
+        Stop sampling.
+        """
+        if self.__old_handler is None:
+            return
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self.__old_handler)
+        self.__old_handler = None
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None and frame is not self.__top:
+            code = frame.f_code
+            frame = frame.f_back
+            if code in _profiler_code:
+                continue
+            stack.append('%s (%s:%s)'%(code.co_name, os.path.basename(code.co_filename),
+                                       code.co_firstlineno))
+        if stack:
+            stack.reverse()
+            stack = ';'.join(stack)
+            self.__counts[stack] = self.__counts.get(stack, 0) + 1
+
+    def write(self, filename):
+        """
+        Write the collapsed stacks to the file filename.
+        """
+        items = self.__counts.items()
+        items.sort()
+        open(filename, 'w').write(''.join(['%s %s\n'%(s, n) for s, n in items]))
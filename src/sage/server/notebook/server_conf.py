@@ -14,7 +14,14 @@ defaults = {'cell_input_color':'#0000000',
             
             'save_interval':360,        # seconds
 
+            'metrics_log_interval':600, # seconds; 0 to disable
+
+            'memory_budget':0,          # megabytes per worksheet; 0 for none
+            'memory_budget_action':'warn',  # or 'refuse'
+
             'doc_pool_size':128,
+
+            'max_upload_size':512*2**20,   # bytes
             'email':False 
            }
 
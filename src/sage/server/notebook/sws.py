@@ -0,0 +1,236 @@
+"""
+Streaming reading and writing of sws files
+
+An sws file is a bzip2 compressed tar archive of a worksheet
+directory.  The functions in this module produce and consume such
+archives a chunk at a time, so that worksheets can be sent to and
+received from a web browser without running tar in a subprocess,
+without building the whole archive in memory and without copying the
+extracted files around.
+"""
+
+#############################################################################
+#       Copyright (C) 2009 William Stein <wstein@gmail.com>
+#  Distributed under the terms of the GNU General Public License (GPL)
+#  The full text of the GPL is available at:
+#                  http://www.gnu.org/licenses/
+#############################################################################
+
+import bz2
+import os
+import tarfile
+
+# Size of the pieces in which files are read and compressed.
+CHUNK_SIZE = 65536
+
+BLOCKSIZE  = tarfile.BLOCKSIZE     # 512
+RECORDSIZE = tarfile.RECORDSIZE    # 20 blocks
+
+def sws_chunks(directory, arcname, first=['worksheet.txt']):
+    """
+    Iterate over the pieces of a bzip2 compressed tar archive of
+    directory, in which all files are stored below arcname.
+
+    INPUT:
+        directory -- string; a worksheet directory
+        arcname -- string; name of the top directory in the archive
+        first -- list of file names in directory that are stored
+                 before anything else (default: ['worksheet.txt']),
+                 so that readers can parse them before the data files
+                 arrive
+
+    OUTPUT:
+        iterator over strings
+
+    EXAMPLES:
+        sage: from sage.server.notebook.sws import sws_chunks, extract_sws
+        sage: D = tmp_dir()
+        sage: open(D + '/worksheet.txt', 'w').write('foo')
+        sage: os.mkdir(D + '/data'); open(D + '/data/a', 'w').write('x'*10000)
+        sage: F = tmp_filename()
+        sage: f = open(F, 'w')
+        sage: for s in sws_chunks(D, '0'): f.write(s)
+        sage: f.close()
+        sage: import tarfile
+        sage: tarfile.open(F).getnames()
+        ['0', '0/worksheet.txt', '0/data', '0/data/a']
+    """
+    compressor = bz2.BZ2Compressor()
+    written = [0]   # number of uncompressed bytes
+
+    def compress(s):
+        written[0] += len(s)
+        return compressor.compress(s)
+
+    directory = os.path.abspath(directory)
+    for path, name in _walk(directory, arcname, first):
+        info = _tarinfo(path, name)
+        s = compress(info.tobuf())
+        if s:
+            yield s
+        if info.isfile():
+            f = open(path, 'rb')
+            try:
+                remaining = info.size
+                while remaining > 0:
+                    data = f.read(min(CHUNK_SIZE, remaining))
+                    if not data:
+                        # The file shrank while we were reading it.
+                        data = '\0'*remaining
+                    remaining -= len(data)
+                    s = compress(data)
+                    if s:
+                        yield s
+            finally:
+                f.close()
+            if info.size % BLOCKSIZE:
+                s = compress('\0'*(BLOCKSIZE - info.size % BLOCKSIZE))
+                if s:
+                    yield s
+
+    # Two zero blocks mark the end of the archive, which is then
+    # padded to a whole record like tar does.
+    end = '\0'*(2*BLOCKSIZE)
+    n = (written[0] + len(end)) % RECORDSIZE
+    if n:
+        end += '\0'*(RECORDSIZE - n)
+    s = compress(end) + compressor.flush()
+    if s:
+        yield s
+
+def write_sws(directory, arcname, fileobj):
+    """
+    Write a bzip2 compressed tar archive of directory to fileobj.
+
+    INPUT:
+        directory -- string; a worksheet directory
+        arcname -- string; name of the top directory in the archive
+        fileobj -- a file opened for writing, or a filename
+
+    EXAMPLES:
+        sage: from sage.server.notebook.sws import write_sws
+        sage: D = tmp_dir(); open(D + '/worksheet.txt', 'w').write('foo')
+        sage: F = tmp_filename(); write_sws(D, '5', F)
+        sage: import tarfile; tarfile.open(F).getnames()
+        ['5', '5/worksheet.txt']
+    """
+    close = False
+    if isinstance(fileobj, basestring):
+        fileobj = open(fileobj, 'wb')
+        close = True
+    try:
+        for s in sws_chunks(directory, arcname):
+            fileobj.write(s)
+    finally:
+        if close:
+            fileobj.close()
+
+def extract_sws(fileobj, directory):
+    """
+    Extract the sws archive read from fileobj into directory, reading
+    it one member at a time.
+
+    Members whose names would end up outside of directory, as well as
+    links and device files, are ignored.
+
+    INPUT:
+        fileobj -- a file-like object with a read method
+        directory -- string; an existing directory
+
+    OUTPUT:
+        string -- the name of the top directory in the archive
+
+    A ValueError is raised if fileobj does not contain an sws archive.
+
+    EXAMPLES:
+        sage: from sage.server.notebook.sws import write_sws, extract_sws
+        sage: D = tmp_dir(); open(D + '/worksheet.txt', 'w').write('foo')
+        sage: F = tmp_filename(); write_sws(D, '5', F)
+        sage: E = tmp_dir(); extract_sws(open(F), E)
+        '5'
+        sage: open(E + '/5/worksheet.txt').read()
+        'foo'
+    """
+    try:
+        return _extract(fileobj, os.path.abspath(directory))
+    except (tarfile.TarError, IOError, EOFError), msg:
+        raise ValueError, "Error decompressing saved worksheet (%s)."%msg
+
+def _extract(fileobj, directory):
+    top = None
+    tar = tarfile.open(fileobj=fileobj, mode='r|bz2')
+    try:
+        for member in tar:
+            name = os.path.normpath(member.name)
+            if name.startswith('/') or name == '..' or name.startswith('../'):
+                continue
+            if not (member.isfile() or member.isdir()):
+                continue
+            if top is None:
+                top = name.split('/')[0]
+            elif name.split('/')[0] != top:
+                continue
+            target = os.path.join(directory, name)
+            if member.isdir():
+                if not os.path.exists(target):
+                    os.makedirs(target)
+                continue
+            parent = os.path.dirname(target)
+            if not os.path.exists(parent):
+                os.makedirs(parent)
+            source = tar.extractfile(member)
+            f = open(target, 'wb')
+            try:
+                while True:
+                    data = source.read(CHUNK_SIZE)
+                    if not data:
+                        break
+                    f.write(data)
+            finally:
+                f.close()
+    finally:
+        tar.close()
+    if top is None:
+        raise ValueError, "invalid worksheet"
+    return top
+
+def _walk(directory, arcname, first):
+    """
+    Iterate over pairs (path, name) of all files and directories below
+    directory, where name is the name to use for path in the archive.
+    """
+    yield directory, arcname
+    for name in first:
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            yield path, '%s/%s'%(arcname, name)
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        filenames.sort()
+        rel = dirpath[len(directory)+1:]
+        if rel:
+            prefix = '%s/%s/'%(arcname, rel)
+        else:
+            prefix = arcname + '/'
+        for name in filenames:
+            if rel or name not in first:
+                yield os.path.join(dirpath, name), prefix + name
+        for name in dirnames:
+            yield os.path.join(dirpath, name), prefix + name
+
+def _tarinfo(path, name):
+    """
+    Return a TarInfo object describing the file or directory path,
+    which is stored as name in the archive.
+    """
+    st = os.stat(path)
+    info = tarfile.TarInfo(name)
+    info.mode = st.st_mode & 07777
+    info.mtime = int(st.st_mtime)
+    if os.path.isdir(path):
+        info.type = tarfile.DIRTYPE
+        info.size = 0
+    else:
+        info.type = tarfile.REGTYPE
+        info.size = st.st_size
+    return info
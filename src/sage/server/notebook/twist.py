@@ -36,12 +36,15 @@ import bz2
 from cgi import escape
 
 from twisted.web2 import server, http, resource, channel
-from twisted.web2 import static, http_headers, responsecode
+from twisted.web2 import static, http_headers, responsecode, stream
 from twisted.web2.filter import gzip
+from twisted.internet import defer, task
 
 import css, js, keyboards
 
 import notebook as _notebook
+from blobstore import file_digest
+from metrics import server_metrics
 
 from sage.server.notebook.template import template
 
@@ -93,24 +96,58 @@ def init_updates():
     last_save_time = walltime()
     last_idle_time = walltime()
 
+    global metrics_log
+    interval = notebook.conf()['metrics_log_interval']
+    if interval > 0:
+        metrics_log = task.LoopingCall(log_metrics)
+        metrics_log.start(interval, now=False)
+
 def notebook_save_check():
     global last_save_time
     t = walltime()
     if t > last_save_time + save_interval:
-        notebook.save()
+        server_metrics.time_blocking('notebook_save', notebook.save)
+        server_metrics.time_blocking('collect_garbage', notebook.collect_garbage)
         last_save_time = t
 
 def notebook_idle_check():
     global last_idle_time
     t = walltime()
     if t > last_idle_time + idle_interval:
-        notebook.quit_idle_worksheet_processes()
+        server_metrics.time_blocking('quit_idle_worksheet_processes',
+                                     notebook.quit_idle_worksheet_processes)
         last_idle_time = t
 
 def notebook_updates():
     notebook_save_check()
     notebook_idle_check()
 
+############################
+# Server metrics
+############################
+def log_metrics():
+    print server_metrics.log_line()
+
+def time_request(request):
+    """
+    Record the time taken to render the request and the size of the
+    response body in server_metrics, under the name of the class of
+    the resource that rendered the request.
+    """
+    start = time.time()
+    def record(request, response):
+        resources = getattr(request, 'resources', None)
+        if resources:
+            name = resources[-1].__class__.__name__
+        else:
+            name = 'unknown'
+        nbytes = 0
+        if response.stream is not None and response.stream.length is not None:
+            nbytes = response.stream.length
+        server_metrics.record_request(name, time.time() - start, nbytes)
+        return response
+    request.addResponseFilter(record, atEnd=True)
+
 ######################################################################################
 # RESOURCES
 ######################################################################################
@@ -335,27 +372,122 @@ class Upload(resource.Resource):
     def render(self, ctx):
         return HTMLResponse(stream = template('upload.html', username=self.username))
 
-class UploadWorksheet(resource.PostableResource):
+######################################################################
+# Uploading files
+#
+# twisted.web2 spools uploaded files to temporary files as they
+# arrive; UploadResource limits their size and records the progress
+# of the upload, and the render methods below copy the files to their
+# destination a chunk at a time.
+######################################################################
+
+# Size of the pieces in which uploaded files are copied.
+UPLOAD_CHUNK_SIZE = 65536
+
+# The number of bytes received so far and the total size (or None)
+# of the uploads in progress, indexed by (username, upload_id).
+uploads = {}
+
+class UploadProgressStream:
+    """
+    A stream that passes on the data read from another stream and
+    records how much has been read in the uploads dictionary.
+    """
+    def __init__(self, stream, key):
+        self.stream = stream
+        self.length = stream.length
+        self.key = key
+        uploads[key] = [0, stream.length]
+
+    def read(self):
+        data = self.stream.read()
+        if isinstance(data, defer.Deferred):
+            return data.addCallback(self._received)
+        return self._received(data)
+
+    def _received(self, data):
+        if data is not None and uploads.has_key(self.key):
+            uploads[self.key][0] += len(data)
+        return data
+
+    def split(self, point):
+        return stream.fallbackSplit(self, point)
+
+    def close(self):
+        self.stream.close()
+
+class UploadResource(resource.PostableResource):
+    """
+    A resource that receives uploaded files, at most
+    notebook.conf()['max_upload_size'] bytes of them.  If the
+    request has an upload_id argument, the progress of the upload is
+    reported by UploadProgress.
+    """
+    def http_POST(self, request):
+        self.maxSize = notebook.conf()['max_upload_size']
+        length = request.stream.length
+        if length is not None and length > self.maxSize:
+            s = "The upload is too large (%.1f MB); at most %.1f MB can be uploaded."%(
+                length/2.0**20, self.maxSize/2.0**20)
+            return HTMLResponse(stream = message(s, '/'))
+        if not request.args.has_key('upload_id'):
+            return resource.PostableResource.http_POST(self, request)
+        key = (self.username, request.args['upload_id'][0])
+        request.stream = UploadProgressStream(request.stream, key)
+        def done(result):
+            uploads.pop(key, None)
+            return result
+        return resource.PostableResource.http_POST(self, request).addBoth(done)
+
+class UploadProgress(resource.Resource):
+    """
+    Return the number of bytes received so far and the total size of
+    the upload with the given upload_id, separated by a space, or
+    nothing if there is no such upload in progress.
+    """
+    def __init__(self, username):
+        self.username = username
+
+    def render(self, ctx):
+        try:
+            received, total = uploads[(self.username, ctx.args['upload_id'][0])]
+        except KeyError:
+            return http.Response(stream = '')
+        return http.Response(stream = '%s %s'%(received, total or 0))
+
+def save_uploaded_file(fileobj, filename):
+    """
+    Copy the uploaded file fileobj to filename, a chunk at a time.
+    """
+    fileobj.seek(0)
+    f = open(filename, 'wb')
+    try:
+        shutil.copyfileobj(fileobj, f, UPLOAD_CHUNK_SIZE)
+    finally:
+        f.close()
+
+class UploadWorksheet(UploadResource):
     def __init__(self, username):
         self.username = username
         
     def render(self, ctx):
         url = ctx.args['urlField'][0].strip()
         dir = ''  # we will delete the directory below if it is used
+        filename = None
         if url != '':
             # downloading a file from the internet
             filename = tmp_filename()+".sws"
         else:
             # uploading a file from the user's computer
-            dir = tmp_dir()
-            filename = ctx.files['fileField'][0][0]
-            # Make tmp file in SAGE temp directory
-            filename = '%s/%s'%(dir, filename)
-            f = file(filename,'wb')
-            # Then download to that file.
-            f.write(ctx.files['fileField'][0][2].read())
-            # TODO: Server blocking issues (?!)
-            f.close()
+            name, _, fileobj = ctx.files['fileField'][0]
+            if os.path.splitext(name)[1].lower() == '.sws':
+                # Extract sws files straight from the uploaded file.
+                fileobj.seek(0)
+            else:
+                # Make tmp file in SAGE temp directory
+                dir = tmp_dir()
+                filename = '%s/%s'%(dir, name)
+                save_uploaded_file(fileobj, filename)
 
 
         #We make a callback so that we can download a file remotely
@@ -363,20 +495,24 @@ class UploadWorksheet(resource.PostableResource):
         def callback(result):
             try:
                 try:
-                    W = notebook.import_worksheet(filename, self.username)
+                    if filename is None:
+                        W = notebook.import_worksheet_sws_stream(fileobj, self.username)
+                    else:
+                        W = notebook.import_worksheet(filename, self.username)
                 except IOError, msg:
                     print msg
                     raise ValueError, "Unfortunately, there was an error uploading the worksheet.  It could be an old unsupported format or worse.  If you desparately need its contents contact the Google group sage-support and post a link to your worksheet.  Alternatively, an sws file is just a bzip2'd tarball; take a look inside!"
                 finally:
                     # Clean up the temporarily uploaded filename.
-                    os.unlink(filename)
+                    if filename is not None:
+                        os.unlink(filename)
                     # if a temp directory was created, we delete it now.
                     if dir:
                         shutil.rmtree(dir)
 
             except ValueError, msg:
                 s = "Error uploading worksheet '%s'."%msg
-                return HTMLRespone(stream = message(s, '/'))
+                return HTMLResponse(stream = message(s, '/'))
 
             # If the user requested in the form a specific title for
             # the worksheet set it.
@@ -441,6 +577,10 @@ class Worksheet_savedatafile(WorksheetResource, resource.PostableResource):
             E = ctx.args['textfield'][0]
             filename = ctx.args['filename'][0]
             dest = '%s/%s'%(self.worksheet.data_directory(), filename)
+            # The file might be shared with other worksheets (see
+            # blobstore.py), so replace it instead of writing to it.
+            if os.path.exists(dest):
+                os.unlink(dest)
             open(dest,'w').write(E)
         return http.RedirectResponse('/home/'+self.worksheet.filename())            
     
@@ -461,7 +601,7 @@ class Worksheet_upload_data(WorksheetResource, resource.Resource):
     def render(self, ctx):
         return HTMLResponse(stream = notebook.html_upload_data_window(self.worksheet, self.username))
 
-class Worksheet_do_upload_data(WorksheetResource, resource.PostableResource):
+class Worksheet_do_upload_data(WorksheetResource, UploadResource):
     def render(self, ctx):
         name = ''
         if ctx.args.has_key('newField'):
@@ -485,6 +625,10 @@ class Worksheet_do_upload_data(WorksheetResource, resource.PostableResource):
             
         dest = '%s/%s'%(self.worksheet.data_directory(), name)
         response = http.RedirectResponse('/home/'+self.worksheet.filename() + '/datafile?name=%s'%name)
+        # The file might be shared with other worksheets (see
+        # blobstore.py), so replace it instead of writing to it.
+        if os.path.exists(dest) and not os.path.isdir(dest):
+            os.unlink(dest)
         
         if url != '':
             #Here we use twisted's downloadPage function which
@@ -505,9 +649,7 @@ class Worksheet_do_upload_data(WorksheetResource, resource.PostableResource):
             open(dest,'w').close()
             return response
         else:
-            f = file(dest,'wb')
-            f.write(ctx.files['fileField'][0][2].read())
-            f.close()
+            save_uploaded_file(ctx.files['fileField'][0][2], dest)
             return response
 
 
@@ -546,6 +688,38 @@ class Worksheet_data(WorksheetResource, resource.Resource):
         return static.File('%s/%s'%(dir, name))
     
 
+# How long browsers may cache a cell file requested with a versioned
+# URL (see Cell.file_url).
+CELL_FILE_MAX_AGE = 365*24*60*60
+
+class CellFile(static.File):
+    """
+    A file or directory below the cells directory of a worksheet.
+
+    Files are served with a strong entity tag computed from their
+    contents, so conditional requests (If-None-Match and
+    If-Modified-Since) are answered with 304 Not Modified when the
+    file has not changed.  Requests for a versioned URL whose version
+    matches the current contents of the file may be cached by the
+    browser indefinitely.
+    """
+    def etag(self):
+        if not self.fp.exists() or self.fp.isdir():
+            return static.File.etag(self)
+        return http_headers.ETag(file_digest(self.fp.path))
+
+    def render(self, request):
+        response = static.File.render(self, request)
+        # The version of a file that is loaded together with other
+        # files also contains their digests (see Cell.file_url), so
+        # only compare the first part.
+        if isinstance(response, http.Response) and request.args.has_key('v') \
+               and self.fp.isfile() \
+               and request.args['v'][0].split('-')[0] == file_digest(self.fp.path):
+            response.headers.setRawHeaders('cache-control',
+                                           ['private, max-age=%s'%CELL_FILE_MAX_AGE])
+        return response
+
 class CellData(resource.Resource):
     def __init__(self, worksheet, number):
         self.worksheet = worksheet
@@ -557,18 +731,17 @@ class CellData(resource.Resource):
     def childFactory(self, request, name):
         dir = self.worksheet.directory()
         path = '%s/cells/%s/%s'%(dir, self.number, name)
-        request.setLastModified(os.stat(filename).st_mtime)
-        return static.File(path)
+        return CellFile(path)
     
 
 class Worksheet_cells(WorksheetResource, resource.Resource):
     addSlash = True
 
     def render(self, ctx):
-        return static.File(self.worksheet.cells_directory())
+        return CellFile(self.worksheet.cells_directory())
     
     def childFactory(self, request, segment):
-        return static.File(self.worksheet.cells_directory() + segment)
+        return CellFile(self.worksheet.cells_directory() + segment)
     #return CellData(self.worksheet, segment)
 
 
@@ -629,6 +802,15 @@ class Worksheet_conf(WorksheetResource, resource.Resource):
         # of a given worksheet, saves the result, 
         return HTMLResponse(stream = s)
 
+class Worksheet_resource_usage(WorksheetResource, resource.Resource):
+    """
+    The resources, time and memory, used by the cells of the worksheet.
+    """
+    def render(self, ctx):
+        s = '<html><head><link rel=stylesheet href="/css/main.css"></head><body>%s</body></html>'%(
+            self.worksheet.html_resource_usage())
+        return HTMLResponse(stream = s)
+
 class TrivialResource(resource.Resource):
     def render(self, ctx):
         return HTMLResponse(stream="success")
@@ -1096,7 +1278,7 @@ class Worksheet_cell_update(WorksheetResource, resource.PostableResource):
         worksheet = self.worksheet
 
         # update the computation one "step".
-        worksheet.check_comp()
+        server_metrics.time_blocking('check_comp', worksheet.check_comp)
         
         # now get latest status on our cell
         status, cell = worksheet.check_cell(id)
@@ -1131,7 +1313,7 @@ class Worksheet_cell_update(WorksheetResource, resource.PostableResource):
                                     cell.introspect_html()]))
 
         # There may be more computations left to do, so start one if there is one.
-        worksheet.start_next_comp()
+        server_metrics.time_blocking('start_next_comp', worksheet.start_next_comp)
         
         return HTMLResponse(stream=msg)
     
@@ -1286,18 +1468,40 @@ class Worksheet_rate(WorksheetResource, resource.Resource):
 ########################################################
 
 
+class IteratorStream(stream.SimpleStream):
+    """
+    A stream whose data is produced by an iterator over strings.  Each
+    piece is only computed when the server is ready to send it, so
+    other requests are served in between.
+    """
+    length = None
+
+    def __init__(self, iterator):
+        self.iterator = iterator
+
+    def read(self):
+        if self.iterator is None:
+            return None
+        try:
+            return self.iterator.next()
+        except StopIteration:
+            self.iterator = None
+            return None
+
+    def close(self):
+        self.iterator = None
+        stream.SimpleStream.close(self)
+
 class Worksheet_download(WorksheetResource, resource.Resource):
     def childFactory(self, request, name):
         worksheet_name = self.name
-        filename = tmp_filename() + '.sws'
         try:
-            notebook.export_worksheet(worksheet_name, filename)
+            chunks = notebook.export_worksheet_chunks(worksheet_name)
         except KeyError:
             return HTMLResponse(stream=message('No such worksheet.'))
-        r = open(filename, 'rb').read()
-        os.unlink(filename)
-        return static.Data(r, 'application/sage')
-        #return static.File(filename)
+        response = http.Response(stream=IteratorStream(iter(chunks)))
+        response.headers.setRawHeaders('Content-Type', ['application/sage'])
+        return response
 
 class Worksheet_rename(WorksheetResource, resource.PostableResource):
     def render(self, ctx):
@@ -2142,6 +2346,17 @@ class ListOfUsers(resource.Resource):
                 s = template('user_management.html', {'users':notebook.valid_login_names()})
             return HTMLResponse(stream = s)
 
+class MetricsPage(resource.Resource):
+    def __init__(self, username):
+        self.username = username
+
+    def render(self, ctx):
+        if user_type(self.username) != 'admin':
+            return HTMLResponse(stream=message('You must be an admin to view the server metrics.'))
+        response = http.Response(stream=server_metrics.exposition())
+        response.headers.addRawHeader('Content-Type', 'text/plain; version=0.0.4')
+        return response
+
 class InvalidPage(resource.Resource):
     addSlash = True
     
@@ -2302,6 +2517,7 @@ class UserToplevel(Toplevel):
     userchild_live_history = LiveHistory
     userchild_new_worksheet = NewWorksheet
     userchild_users = ListOfUsers
+    userchild_metrics = MetricsPage
     userchild_notebook_settings = NotebookSettings
     userchild_settings = SettingsPage
     userchild_pub = PublicWorksheets
@@ -2314,6 +2530,7 @@ class UserToplevel(Toplevel):
 
     userchild_src = SourceBrowser
     userchild_upload_worksheet = UploadWorksheet
+    userchild_upload_progress = UploadProgress
     userchild_emptytrash = EmptyTrash
     
     def render(self, request):
@@ -0,0 +1,111 @@
+"""
+Resource usage of cell evaluations
+
+The compute process of a worksheet calls :func:`start_cell` before
+running the code of a cell and :func:`finish_cell` after it, even if
+the code raises an exception.  The CPU and wall time of the cell, the
+resident memory of the process before and after it, and the peak
+resident memory while it ran are then written to a file, which the
+notebook server reads with :func:`read_usage` when the cell is done.
+
+The peak is only that of the cell on Linux 4.0 and later; with older
+kernels it is the peak of the compute process since it started.
+Memory usage is only known on Linux; on other systems only times are
+recorded.
+
+EXAMPLES::
+
+    sage: from sage.server.notebook.usage import start_cell, finish_cell, read_usage
+    sage: F = tmp_filename()
+    sage: start_cell(F)
+    sage: v = range(10^6)
+    sage: finish_cell()
+    sage: U = read_usage(F); sorted(U.keys())
+    ['cpu_seconds', 'peak_rss_mb', 'rss_after_mb', 'rss_before_mb', 'wall_seconds']
+    sage: U['rss_after_mb'] - U['rss_before_mb'] > 10
+    True
+    sage: read_usage(F) is None
+    True
+"""
+
+#############################################################################
+#       Copyright (C) 2009 William Stein <wstein@gmail.com>
+#  Distributed under the terms of the GNU General Public License (GPL)
+#  The full text of the GPL is available at:
+#                  http://www.gnu.org/licenses/
+#############################################################################
+
+import os
+
+from sage.misc.misc import cputime, walltime
+from sage.misc.getusage import (get_resident_memory_usage, get_peak_memory_usage,
+                                reset_peak_memory_usage)
+
+# The name of the usage file in the directory of a cell, which is
+# writable by the compute process even if it runs as another user.
+FILENAME = '.sage_usage'
+
+# The order in which the values are written to the file.
+KEYS = ['cpu_seconds', 'wall_seconds', 'rss_before_mb', 'rss_after_mb', 'peak_rss_mb']
+
+# The file to write the usage of the running cell to, and the values
+# at its start.
+_filename = None
+_start = None
+
+def start_cell(filename):
+    """
+    Record the resource usage at the start of a cell, whose usage is
+    to be written to the file filename.
+    """
+    global _filename, _start
+    reset_peak_memory_usage()
+    _filename = filename
+    _start = (cputime(), walltime(), _memory(get_resident_memory_usage))
+
+def finish_cell():
+    """
+    Write the resource usage of the cell started with
+    :func:`start_cell` to its file.  Calling this again before the
+    next cell starts does nothing.
+    """
+    global _filename
+    if _filename is None:
+        return
+    filename = _filename
+    _filename = None
+    cpu, wall, rss = _start
+    values = [cputime(cpu), walltime(wall), rss, _memory(get_resident_memory_usage),
+              _memory(get_peak_memory_usage)]
+    try:
+        # write and rename, so that the server never reads half a file
+        open(filename + '.tmp', 'w').write(' '.join([repr(x) for x in values]))
+        os.rename(filename + '.tmp', filename)
+    except (IOError, OSError):
+        pass
+
+def read_usage(filename):
+    """
+    Return the resource usage written to the file filename by
+    :func:`finish_cell`, as a dictionary whose keys are in KEYS and
+    whose memory values are None if they are not known, and delete
+    the file.  If there is no such file, return None.
+    """
+    try:
+        s = open(filename).read()
+        os.unlink(filename)
+    except (IOError, OSError):
+        return None
+    try:
+        values = [None if x == 'None' else float(x) for x in s.split()]
+    except ValueError:
+        return None
+    if len(values) != len(KEYS):
+        return None
+    return dict(zip(KEYS, values))
+
+def _memory(f):
+    try:
+        return f()
+    except NotImplementedError:
+        return None
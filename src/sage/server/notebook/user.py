@@ -2,6 +2,7 @@ import copy
 import crypt
 import cPickle
 import os
+from collections import deque
 
 SALT = 'aa'
 
@@ -21,6 +22,10 @@ class User:
     def __getstate__(self):
         d = copy.copy(self.__dict__)
 
+        # The history log is only a handle on a file on disk.
+        if d.has_key('_User__history_log'):
+            del d['_User__history_log']
+
         # Some old worksheets have this attribute, which we do *not* want to save.
         if d.has_key('history'):
             try:
@@ -31,35 +36,80 @@ class User:
                 print "Unable to dump history of user %s to disk yet."%self.__username
         return d
 
-    def history_list(self):
+    def history_log(self):
+        """
+        Return the append-only log in which the history of this user
+        is stored, or None if there is no running notebook server.
+
+        The first time this is called, history saved by older
+        versions of the notebook (either as an attribute of this
+        object or in the file history.sobj) is moved into the log.
+        """
         try:
-            return self.history
+            return self.__history_log
         except AttributeError:
-            import twist   # late import
-            if twist.notebook is None: return []       
-            history_file = "%s/worksheets/%s/history.sobj"%(twist.notebook.directory(), self.__username)
-            if os.path.exists(history_file):
+            pass
+        import twist   # late import
+        if twist.notebook is None: return None
+        dir = "%s/worksheets/%s"%(twist.notebook.directory(), self.__username)
+        if not os.path.exists(dir):
+            os.makedirs(dir)
+        log = HistoryLog("%s/history.log"%dir)
+
+        # Convert history from the old pickled format.
+        old_file = "%s/history.sobj"%dir
+        if hasattr(self, 'history') or os.path.exists(old_file):
+            H = []
+            if os.path.exists(old_file):
                 try:
-                    self.history = cPickle.load(open(history_file))
+                    H = cPickle.load(open(old_file))
                 except:
                     print "Error loading history for user %s"%self.__username
-                    self.history = []
-            else:
-                self.history = []
-            return self.history    
+            if hasattr(self, 'history'):
+                H = H + list(self.history)
+                del self.history
+            log.extend(H)
+            if os.path.exists(old_file):
+                os.unlink(old_file)
+
+        self.__history_log = log
+        return log
+
+    def history_list(self, maxlen=None):
+        """
+        Return a list of the most recent maxlen history entries of this
+        user (or all of them if maxlen is None), oldest first.
+        """
+        return list(self.history_entries(maxlen))
+
+    def history_entries(self, maxlen=None):
+        """
+        Iterate over the most recent maxlen history entries of this
+        user, oldest first, reading them from disk.
+        """
+        log = self.history_log()
+        if log is None:
+            return iter([])
+        if maxlen is None:
+            maxlen = self.__conf['max_history_length']
+        return log.entries(maxlen)
+
+    def add_to_history(self, entry):
+        """
+        Append entry to the history log of this user.
+        """
+        log = self.history_log()
+        if log is not None:
+            log.append(entry, self.__conf['max_history_length'])
 
     def save_history(self):
-        if not hasattr(self, 'history'):
-            return
-        import twist   # late import
-        if twist.notebook is None: return
-        history_file = "%s/worksheets/%s/history.sobj"%(twist.notebook.directory(), self.__username)
-        try:
-            #print "Dumping %s history to '%s'"%(self.__username, history_file)
-            his = cPickle.dumps(self.history)
-        except AttributeError:
-            his = cPickle.dumps([])
-        open(history_file,'w').write(his)
+        """
+        Make sure the history of this user is stored on disk.  Since
+        history is appended to the log as it is created, this only has
+        an effect on objects created by older versions of the notebook.
+        """
+        if hasattr(self, 'history'):
+            self.history_log()
 
     def username(self):
         """
@@ -240,3 +290,134 @@ class User:
             False
         """
         return self.__account_type == 'guest'
+
+
+class HistoryLog:
+    """
+    An append-only log of strings stored in a file.
+
+    Each entry is stored as its length in bytes on a line by itself,
+    followed by the entry and a newline, so that appending is cheap
+    and the file can be read back one entry at a time.  When the file
+    holds more than twice the allowed number of entries it is
+    rewritten with only the most recent ones, so appends take
+    constant amortized time.
+
+    EXAMPLES::
+
+        sage: from sage.server.notebook.user import HistoryLog
+        sage: L = HistoryLog(tmp_filename())
+        sage: for i in range(10): L.append('entry %s'%i, maxlen=3)
+        sage: list(L.entries(3))
+        ['entry 7', 'entry 8', 'entry 9']
+        sage: len(L) <= 6
+        True
+    """
+    def __init__(self, filename):
+        self.__filename = filename
+
+    def __repr__(self):
+        return "History log '%s'"%self.__filename
+
+    def filename(self):
+        return self.__filename
+
+    def __len__(self):
+        try:
+            return self.__count
+        except AttributeError:
+            n = 0
+            for _ in self.__iter__():
+                n += 1
+            self.__count = n
+            # Drop a partially written entry left by a crash, so that
+            # new entries are appended after the last complete one.
+            if os.path.exists(self.__filename) and \
+                   os.path.getsize(self.__filename) > self.__end:
+                f = open(self.__filename, 'r+')
+                f.truncate(self.__end)
+                f.close()
+            return n
+
+    def __iter__(self):
+        """
+        Iterate over all entries in the log, oldest first.  A partially
+        written entry at the end of the file is ignored.
+        """
+        self.__end = 0
+        if not os.path.exists(self.__filename):
+            return
+        f = open(self.__filename)
+        try:
+            while True:
+                self.__end = f.tell()
+                n = f.readline()
+                if not n.endswith('\n'):
+                    return
+                try:
+                    n = int(n)
+                except ValueError:
+                    return
+                entry = f.read(n)
+                if len(entry) < n or f.read(1) != '\n':
+                    return
+                yield entry
+        finally:
+            f.close()
+
+    def entries(self, maxlen):
+        """
+        Iterate over the last maxlen entries in the log, oldest first.
+        """
+        D = deque()
+        for entry in self:
+            D.append(entry)
+            if len(D) > maxlen:
+                D.popleft()
+        return iter(D)
+
+    def append(self, entry, maxlen):
+        """
+        Append entry to the log, keeping at least the last maxlen
+        entries.
+        """
+        n = len(self)
+        f = open(self.__filename, 'a')
+        f.write(self._record(entry))
+        f.close()
+        self.__count = n + 1
+        if self.__count > 2*maxlen:
+            self._truncate(maxlen)
+
+    def extend(self, entries):
+        """
+        Append all the given entries to the log.
+        """
+        n = len(self)
+        f = open(self.__filename, 'a')
+        for entry in entries:
+            f.write(self._record(entry))
+            n += 1
+        f.close()
+        self.__count = n
+
+    def _record(self, entry):
+        if isinstance(entry, unicode):
+            entry = entry.encode('utf-8')
+        return '%s\n%s\n'%(len(entry), entry)
+
+    def _truncate(self, maxlen):
+        """
+        Rewrite the log so it only contains the last maxlen entries.
+        The new file is moved into place, so a crash cannot lose the
+        whole history.
+        """
+        tmp = self.__filename + '.tmp'
+        f = open(tmp, 'w')
+        n = 0
+        for entry in self.entries(maxlen):
+            f.write(self._record(entry))
+            n += 1
+        f.close()
+        os.rename(tmp, self.__filename)
+        self.__count = n
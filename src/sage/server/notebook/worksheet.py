@@ -51,6 +51,9 @@ import sage.server.support   as support
 # Imports specifically relevant to the sage notebook
 import worksheet_conf
 from   cell import Cell, TextCell
+from   interact import parse_update_request
+from   usage import read_usage, FILENAME as USAGE_FILENAME
+from   blobstore import unshare_tree
 
 # Set some constants that will be used for regular expressions below.
 whitespace = re.compile('\s')  # Match any whitespace character
@@ -58,6 +61,8 @@ non_whitespace = re.compile('\S')
 
 # Constants that control the behavior of the worksheet.
 INTERRUPT_TRIES = 3    # number of times to send control-c to subprocess before giving up
+INTERACT_CANCEL_TIME = 0.5  # number of seconds an @interact recompute may run before
+                            # it is interrupted when a newer update for it arrives
 INITIAL_NUM_CELLS = 1  # number of empty cells in new worksheets
 
 WARN_THRESHOLD = 100   # The number of seconds, so if there was no activity on
@@ -74,6 +79,10 @@ SAGE_BEGIN = SC + 'b'
 SAGE_END   = SC + 'e'
 SAGE_ERROR = SC + 'r'
 
+# Code run before and after a cell with the %time directive.
+TIME_START  = '__SAGE_t__=cputime()\n__SAGE_w__=walltime()\n'
+TIME_REPORT = 'print "CPU time: %.2f s,  Wall time: %.2f s"%(cputime(__SAGE_t__), walltime(__SAGE_w__))\n'
+
 # Integers that define which folder this worksheet is in
 # relative to a given user. 
 ARCHIVED = 0
@@ -129,6 +138,10 @@ def initialized_sage(server, ulimit):
     # Return our new Sage instance.
     return S
 
+# Systems whose interface the compute process of a worksheet using
+# them starts in the background right away, since they start slowly.
+PRESTART_SYSTEMS = ['gap', 'macaulay2', 'maxima', 'r', 'singular']
+
 _a_sage = None
 def init_sage_prestart(server, ulimit):
     """
@@ -1946,7 +1959,7 @@ class Worksheet:
         d = copy.copy(self.__dict__)
 
         # These attributes can take a while too and there is no need to cache them
-        for attr in ['html', 'notebook', 'conf']:
+        for attr in ['html', 'notebook', 'conf', 'running_interact', 'comp_start_time']:
             mangled = '_Worksheet__%s'%attr
             if d.has_key(mangled):
                 del d[mangled]
@@ -2182,6 +2195,9 @@ class Worksheet:
     ##########################################################
     def html(self, include_title=True, do_print=False,
              confirm_before_leave=False, read_only=False):
+        # Published worksheets do not change, so their HTML is
+        # computed once, when they are published, and kept until the
+        # worksheet is published again (see edit_save).
         if self.is_published():
             try:
                 return self.__html
@@ -2340,7 +2356,12 @@ class Worksheet:
         return menu
 
     def html_worksheet_body(self, do_print, publish=False):
-        n = len(self.cell_list())
+        """
+        Return the HTML code for the cells of this worksheet.
+
+        Each cell caches its own HTML until it changes (see Cell.html),
+        so after an edit only the changed cells are rendered again.
+        """
         published = self.is_published() or publish
 
         s = '<div class="cell_input_active" id="cell_resizer"></div>'
@@ -2348,10 +2369,8 @@ class Worksheet:
         ncols = D['word_wrap_cols']
         if not published:
             s += '<div class="worksheet_cell_list" id="worksheet_cell_list">\n'
-            
-        for i in range(n):
-            cell = self.cell_list()[i]
-            s += cell.html(ncols, do_print=do_print) + '\n'
+
+        s += ''.join([cell.html(ncols, do_print=do_print) + '\n' for cell in self.cell_list()])
 
         if not do_print and not published:
             s += '\n</div>\n'
@@ -2726,6 +2745,7 @@ $("#insert_last_cell").shiftclick(function(e) {insert_new_text_cell_after(cell_i
             pass
 
         del self.__sage
+        self.__memory_usage = None
 
         # We do this to avoid getting a stale Sage that uses old code. 
         self.clear_queue()
@@ -2758,11 +2778,16 @@ $("#insert_last_cell").shiftclick(function(e) {insert_new_text_cell_after(cell_i
 
     def initialize_sage(self):
         self.delete_cell_input_files()
+        # Code run in the compute process may modify data files in
+        # place, so they must not be shared with other worksheets.
+        unshare_tree(self.data_directory())
         object_directory = os.path.abspath(self.notebook().object_directory())
         S = self.sage()
         try:
             cmd = '__DIR__="%s/"; DIR=__DIR__; DATA="%s/"; '%(self.DIR(), os.path.abspath(self.data_directory()))
             cmd += '_support_.init(None, globals()); '
+            if self.system() in PRESTART_SYSTEMS:
+                cmd += '%s._prestart(); '%self.system()
             S._send(cmd)   # non blocking
         except Exception, msg:
             print "ERROR initializing compute process:\n"
@@ -2795,6 +2820,7 @@ $("#insert_last_cell").shiftclick(function(e) {insert_new_text_cell_after(cell_i
         self.__sage = one_prestarted_sage(server = self.notebook().get_server(),
                                           ulimit = self.notebook().get_ulimit())
         self.__next_block_id = 0
+        self.__memory_usage = None
         self.initialize_sage()
         
         # Check to see if the typeset/pretty print button is checked.
@@ -2851,6 +2877,13 @@ $("#insert_last_cell").shiftclick(function(e) {insert_new_text_cell_after(cell_i
         id = self.next_block_id()
         C.code_id = id
 
+        if C.is_interacting():
+            self.__running_interact = C.interact
+            if self._start_interact_update(S, C):
+                return
+        else:
+            self.__running_interact = None
+
         # prevent directory disappear problems
         dir = self.directory()
         code_dir = '%s/code'%dir
@@ -2871,7 +2904,7 @@ $("#insert_last_cell").shiftclick(function(e) {insert_new_text_cell_after(cell_i
         input += 'sage.server.notebook.interact.SAGE_CELL_ID=%s\n'%(C.id()) 
         
         if C.time():
-            input += '__SAGE_t__=cputime()\n__SAGE_w__=walltime()\n'
+            input += TIME_START
 
         # If the input ends in a question mark and is *not* a comment line,
         # then we introspect on it.
@@ -2880,6 +2913,13 @@ $("#insert_last_cell").shiftclick(function(e) {insert_new_text_cell_after(cell_i
             Istrip = I.strip().split('\n').pop()
             if Istrip.endswith('?') and not Istrip.startswith('#'):
                 C.set_introspect(I, '')
+
+        # Record the resources used by the cell (see sage.server.notebook.usage).
+        usage_file = None
+        if not C.introspect():
+            usage_file = os.path.join(absD, USAGE_FILENAME)
+            input += 'import sage.server.notebook.usage\n'
+            input += 'sage.server.notebook.usage.start_cell("%s")\n'%usage_file
         
         #Handle line continuations: join lines that end in a backslash
         #_except_ in LaTeX mode.
@@ -2887,7 +2927,9 @@ $("#insert_last_cell").shiftclick(function(e) {insert_new_text_cell_after(cell_i
             I = I.replace('\\\n','')
 
         C._before_preparse = input + I
-        input += self.preparse_input(I, C)
+        prefix = input
+        code = self.preparse_input(I, C)
+        input += code
 
         try:
             compile(input, '', 'exec')
@@ -2914,9 +2956,15 @@ $("#insert_last_cell").shiftclick(function(e) {insert_new_text_cell_after(cell_i
                 return
             except ValueError:
                 pass
+
+        if C.prun() and not C.introspect():
+            input = prefix + self._profiled_input(code, id)
         
         if C.time() and not C.introspect():
-            input += 'print "CPU time: %.2f s,  Wall time: %.2f s"%(cputime(__SAGE_t__), walltime(__SAGE_w__))\n'
+            input += TIME_REPORT
+
+        if usage_file is not None:
+            input += 'sage.server.notebook.usage.finish_cell()\n'
 
         input = self.synchronize(input)
         # Unfortunately, this has to go here at the beginning of the file until Python 2.6,
@@ -2930,15 +2978,81 @@ $("#insert_last_cell").shiftclick(function(e) {insert_new_text_cell_after(cell_i
         open(tmp,'w').write(input)
         
         cmd = 'execfile("%s")\n'%os.path.abspath(tmp)
+        if usage_file is not None:
+            # in case the code raised an exception
+            cmd += 'sage.server.notebook.usage.finish_cell()\n'
         # Signal an end (which would only be seen if there is an error.)
         cmd += 'print "\\x01r\\x01e%s"'%self.synchro()
+        self._send_comp(S, C, cmd)
+
+    def _profiled_input(self, code, id):
+        """
+        Return input for the compute process that runs the preparsed
+        code of a cell with the %prun directive under the profiler.
+        The code is written to its own file, so that tracebacks and
+        the profile refer to its lines.
+        """
+        filename = os.path.abspath('%s/code/%s-prun.py'%(self.directory(), id))
+        open(filename, 'w').write('# -*- coding: utf_8 -*-\nfrom __future__ import with_statement\n' + code)
+        return 'import sage.server.notebook.prun\nsage.server.notebook.prun.run_cell("%s", globals())\n'%filename
+
+    def _send_comp(self, S, C, cmd):
         self.__comp_is_running = True
+        self.__comp_start_time = walltime()
         try:
             S._send(cmd)
         except OSError, msg:
             self.restart_sage()
             C.set_output_text('The Sage compute process quit (possibly Sage crashed?).\nPlease retry your calculation.','')
-                
+
+    def _start_interact_update(self, S, C):
+        """
+        Send the @interact update request of the cell C directly to
+        the compute process as a single line, without preparsing it or
+        writing it to a temporary file.
+
+        Returns False if the request is not a standard sequence of
+        update and recompute calls, in which case it must be evaluated
+        the usual way.
+        """
+        if parse_update_request(C.interact) is None:
+            return False
+        I = C.interact.strip()
+        C._before_preparse = I
+        C.set_is_html(False)
+        absD = os.path.abspath(C.directory())
+        input = 'os.chdir("%s")\n'%absD
+        input += 'sage.server.notebook.interact.SAGE_CELL_ID=%s\n'%C.id()
+        if C.time():
+            input += TIME_START
+        input += I + '\n'
+        if C.time():
+            input += TIME_REPORT
+        # The lines are all simple statements.
+        cmd = ';'.join([x for x in self.synchronize(input).split('\n') if x]) + '\n'
+        # Signal an end (which would only be seen if there is an error.)
+        cmd += 'print "\\x01r\\x01e%s"'%self.synchro()
+        self._send_comp(S, C, cmd)
+        return True
+
+    def _cancel_superseded_interact(self, C):
+        """
+        Called when a newer @interact update arrives for the cell C
+        while C is being computed.  If the running recompute has
+        already taken a while, interrupt it so that the coalesced
+        update starts immediately; otherwise let it finish, after which
+        check_comp runs the cell again.
+        """
+        try:
+            S = self.__sage
+            if walltime() - self.__comp_start_time < INTERACT_CANCEL_TIME:
+                return
+        except AttributeError:
+            return
+        if S.interrupt(INTERRUPT_TRIES, quit_on_fail=False):
+            self.__comp_is_running = False
+            self.start_next_comp()
+
     def check_comp(self, wait=0.2):
         r"""
         Check on currently computing cells in the queue.
@@ -2991,7 +3105,16 @@ $("#insert_last_cell").shiftclick(function(e) {insert_new_text_cell_after(cell_i
 
         # Finished a computation.
         self.__comp_is_running = False
+
+        if C.is_interacting() and C.interact != self._running_interact():
+            # A newer @interact update arrived while this one was
+            # running; its output is stale, so run the cell again
+            # with the coalesced update instead of displaying it.
+            self.start_next_comp()
+            return 'w', C
+
         del self.__queue[0]
+        self._record_usage(C)
 
         if C.is_no_output():
             # Clean up the temp directories associated to C, and do not set any output
@@ -3025,6 +3148,140 @@ $("#insert_last_cell").shiftclick(function(e) {insert_new_text_cell_after(cell_i
 
         return 'd', C
 
+    def _record_usage(self, C):
+        """
+        Store the resources used by the cell C, which has just been
+        computed, in C, and remember the memory now used by the
+        compute process.
+        """
+        usage = read_usage(os.path.join(os.path.abspath(C.directory()), USAGE_FILENAME))
+        if usage is None:
+            return
+        self.__memory_usage = usage['rss_after_mb']
+        if self.over_memory_budget():
+            usage['memory_budget_mb'] = self.memory_budget()
+        C.set_usage(usage)
+
+    def memory_usage(self):
+        """
+        Return the resident memory in megabytes of the compute process
+        of this worksheet after the last cell it computed, or None if
+        it is not known.
+
+        EXAMPLES::
+
+            sage: nb = sage.server.notebook.notebook.Notebook(tmp_dir())
+            sage: nb.add_user('sage','sage','sage@sagemath.org',force=True)
+            sage: W = nb.create_new_worksheet('Test', 'sage')
+            sage: W.memory_usage() is None
+            True
+            sage: W.edit_save('Sage\n{{{\nv = range(10^6)\n}}}')
+            sage: W.cell_list()[0].evaluate()
+            sage: W.check_comp(wait=9999)
+            ('d', Cell 0; in=v = range(10^6), out=
+            )
+            sage: W.memory_usage() > 10
+            True
+            sage: W.quit(); W.memory_usage() is None
+            True
+            sage: nb.delete()
+        """
+        try:
+            return self.__memory_usage
+        except AttributeError:
+            return None
+
+    def memory_budget(self):
+        """
+        Return the number of megabytes of memory that the compute
+        process of a worksheet should use at most, which is the
+        notebook server's 'memory_budget' setting; 0 means no budget.
+        """
+        return self.notebook().conf()['memory_budget']
+
+    def over_memory_budget(self):
+        """
+        Return True if the compute process of this worksheet uses more
+        memory than the memory budget.
+
+        Depending on the server's 'memory_budget_action' setting,
+        cells evaluated then either show a warning ('warn') or are not
+        computed at all until the worksheet is restarted ('refuse').
+        """
+        budget = self.memory_budget()
+        m = self.memory_usage()
+        return budget > 0 and m is not None and m > budget
+
+    def resource_usage(self):
+        """
+        Return a summary of the resources used by the last evaluation
+        of each cell of this worksheet, as a dictionary with the
+        number of cells for which it is known, their total CPU and
+        wall time, the largest peak resident memory of any cell, the
+        current resident memory of the compute process and the
+        memory budget, in seconds and megabytes.
+
+        EXAMPLES::
+
+            sage: nb = sage.server.notebook.notebook.Notebook(tmp_dir())
+            sage: nb.add_user('sage','sage','sage@sagemath.org',force=True)
+            sage: W = nb.create_new_worksheet('Test', 'sage')
+            sage: W.edit_save('Sage\n{{{\n2+2\n}}}')
+            sage: W.cell_list()[0].evaluate()
+            sage: W.check_comp(wait=9999)
+            ('d', Cell 0; in=2+2, out=
+            4
+            )
+            sage: sorted(W.resource_usage().items())    # random
+            [('cells', 1), ('cpu_seconds', 0.0), ('memory_budget_mb', 0),
+             ('peak_rss_mb', 151.3), ('rss_mb', 151.3), ('wall_seconds', 0.0006)]
+            sage: nb.delete()
+        """
+        usages = [c.usage() for c in self.cell_list() if isinstance(c, Cell) and c.usage()]
+        peaks = [u['peak_rss_mb'] for u in usages if u['peak_rss_mb'] is not None]
+        if peaks:
+            peak = max(peaks)
+        else:
+            peak = None
+        return {'cells': len(usages),
+                'cpu_seconds': sum([u['cpu_seconds'] for u in usages]),
+                'wall_seconds': sum([u['wall_seconds'] for u in usages]),
+                'peak_rss_mb': peak,
+                'rss_mb': self.memory_usage(),
+                'memory_budget_mb': self.memory_budget()}
+
+    def html_resource_usage(self):
+        """
+        Return HTML showing the summary of the resources used by this
+        worksheet and the resources used by each of its cells.
+        """
+        import cgi
+        R = self.resource_usage()
+        def mb(x):
+            if x is None:
+                return 'unknown'
+            return '%.1f MB'%x
+        if R['memory_budget_mb']:
+            budget = mb(R['memory_budget_mb'])
+        else:
+            budget = 'none'
+        rows = ['<tr><th>Cell</th><th>CPU time</th><th>Wall time</th>'
+                '<th>Memory before</th><th>Memory after</th><th>Peak memory</th></tr>']
+        for c in self.cell_list():
+            if not isinstance(c, Cell) or not c.usage():
+                continue
+            u = c.usage()
+            rows.append('<tr><td>%s</td><td>%.2f s</td><td>%.2f s</td><td>%s</td><td>%s</td><td>%s</td></tr>'%(
+                c.id(), u['cpu_seconds'], u['wall_seconds'], mb(u['rss_before_mb']),
+                mb(u['rss_after_mb']), mb(u['peak_rss_mb'])))
+        return """<h2>Resources used by %s</h2>
+<p>%s cells computed, using %.2f s of CPU time and %.2f s of wall time.<br>
+Memory used by the compute process: %s (peak %s, budget %s).</p>
+<table class="resource_usage">
+%s
+</table>"""%(cgi.escape(self.name()), R['cells'], R['cpu_seconds'], R['wall_seconds'],
+              mb(R['rss_mb']), mb(R['peak_rss_mb']), budget, '\n'.join(rows))
+
     def interrupt(self):
         r"""
         Interrupt all currently queued up calculations.
@@ -3139,6 +3396,12 @@ $("#insert_last_cell").shiftclick(function(e) {insert_new_text_cell_after(cell_i
             self.__last_compute_walltime = t
             return t
 
+    def _running_interact(self):
+        try:
+            return self.__running_interact
+        except AttributeError:
+            return None
+
     def _record_that_we_are_computing(self, username=None):
         self.__last_compute_walltime = walltime()
         if username:
@@ -3186,7 +3449,18 @@ $("#insert_last_cell").shiftclick(function(e) {insert_new_text_cell_after(cell_i
         if C.worksheet() != self:
             raise ValueError, "C must be have self as worksheet."
 
+        if self.over_memory_budget() and not C.introspect() and \
+               self.notebook().conf()['memory_budget_action'] == 'refuse' and \
+               C.cleaned_input_text() not in ['restart', 'quit', 'exit']:
+            C.set_output_text('This worksheet uses %.1f MB of memory, more than its budget of %s MB.\n'
+                              'Restart the worksheet to free its memory.'%(
+                                  self.memory_usage(), self.memory_budget()), '')
+            return
+
         # Now enqueue the requested cell.
+        if C.is_interacting() and self.computing() and self.__queue[0] is C \
+               and C.interact != self._running_interact():
+            self._cancel_superseded_interact(C)
         if not (C in self.__queue):
             if C.is_asap():
                 if self.computing():
@@ -3255,12 +3529,19 @@ $("#insert_last_cell").shiftclick(function(e) {insert_new_text_cell_after(cell_i
         return self._new_cell(id)
 
     def synchronize(self, s):
+        """
+        Return the code s surrounded by code that prints the markers
+        of the beginning and end of the next computation.  The markers
+        are written as escapes, so that the code may also be sent to
+        the compute process as a line of input.
+        """
         try:
             i = (self.__synchro + 1)%65536
         except AttributeError:
             i = 0
         self.__synchro = i
-        return 'print "%s%s"\n'%(SAGE_BEGIN,i) + s + '\nprint "%s%s"\n'%(SAGE_END,i)
+        return 'print "%s%s"\n'%(SAGE_BEGIN.encode('string_escape'), i) + s + \
+               '\nprint "%s%s"\n'%(SAGE_END.encode('string_escape'), i)
 
     def synchro(self):
         try: